@@ -5,7 +5,9 @@ from .classifier_agent import ClassifierAgent
 from .summarizer_agent import SummarizerAgent
 from .decision_agent import DecisionAgent
 from .reply_agent import ReplyAgent
+from .fused_agent import FusedAnalysisAgent
 from .email_coordinator import EmailCoordinator
+from .pipeline import Stage, PipelineScheduler
 
 __all__ = [
     'BaseAgent',
@@ -14,5 +16,8 @@ __all__ = [
     'SummarizerAgent',
     'DecisionAgent',
     'ReplyAgent',
-    'EmailCoordinator'
+    'FusedAnalysisAgent',
+    'EmailCoordinator',
+    'Stage',
+    'PipelineScheduler'
 ]
@@ -1,6 +1,7 @@
 """
 Base Agent class that defines the interface for all agents in the system.
 """
+import asyncio
 from abc import ABC, abstractmethod
 from typing import Dict, Any, List, Optional
 
@@ -36,6 +37,23 @@ class BaseAgent(ABC):
         """
         pass
     
+    async def aprocess(self, data: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Asynchronous variant of process.
+        
+        Agents that call the AI service override this with a native async
+        implementation. The default runs process in a worker thread so that
+        CPU-only agents can be awaited alongside them.
+        
+        Args:
+            data: The data to process
+            context: Optional context information
+            
+        Returns:
+            A dictionary containing the processing results
+        """
+        return await asyncio.to_thread(self.process, data, context)
+    
     def register_tool(self, tool: Any) -> None:
         """
         Register a tool with the agent.
@@ -1,13 +1,71 @@
 """
 Classifier Agent - Phân loại email theo category.
 """
-import sys
 import json
 import os
-from typing import Dict, Any, Optional
+import asyncio
+from typing import Dict, Any, List, Optional, Tuple
 from .base_agent import BaseAgent
 from utils.openai_client import OpenAIClient
 from utils.errors import OpenAIAPIError
+from utils.near_duplicate import NearDuplicateIndex
+from utils.async_runner import run_sync
+from tools.rule_classifier import RuleClassifier
+from utils.tokens import count_tokens, fit_to_budget, agent_budget
+from utils.prompts import PromptTemplate, PromptRegistry
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+CLASSIFY_SYSTEM_TEMPLATE = """
+You are an email classification expert.
+Analyze the email and classify it into ONE of these categories: {category_list}
+
+Consider:
+- Subject line keywords
+- Sender information
+- Email content and context
+- Tone and purpose
+
+IMPORTANT: Your response MUST be a valid JSON object with these exact fields:
+{{
+    "category": "category name",
+    "confidence": 0.0-1.0,
+    "reasoning": "brief explanation"
+}}
+
+Do not include any text before or after the JSON.
+"""
+
+CLASSIFY_PROMPT_TEMPLATE = """
+Classify this email:
+
+From: {sender}
+Subject: {subject}
+Body: {body}
+"""
+
+BATCH_SYSTEM_TEMPLATE = """
+You are an email classification expert.
+You will receive several numbered emails. Classify EACH into ONE of these categories: {category_list}
+
+IMPORTANT: Your response MUST be a valid JSON object with this exact shape,
+containing one entry per email, in order:
+{{
+    "results": [
+        {{"index": 0, "category": "category name", "confidence": 0.0-1.0, "reasoning": "brief explanation"}},
+        ...
+    ]
+}}
+
+Do not include any text before or after the JSON.
+"""
+
+BATCH_PROMPT_TEMPLATE = """
+Classify these {count} emails:
+
+{emails}
+"""
 
 
 class ClassifierAgent(BaseAgent):
@@ -20,6 +78,41 @@ class ClassifierAgent(BaseAgent):
     - Giải thích lý do phân loại
     """
     
+    # Structured output schemas (OpenAI strict json_schema / Gemini response_schema)
+    RESPONSE_SCHEMA = {
+        "title": "classification",
+        "type": "object",
+        "properties": {
+            "category": {"type": "string"},
+            "confidence": {"type": "number"},
+            "reasoning": {"type": "string"}
+        },
+        "required": ["category", "confidence", "reasoning"],
+        "additionalProperties": False
+    }
+    BATCH_RESPONSE_SCHEMA = {
+        "title": "batch_classification",
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "index": {"type": "integer"},
+                        "category": {"type": "string"},
+                        "confidence": {"type": "number"},
+                        "reasoning": {"type": "string"}
+                    },
+                    "required": ["index", "category", "confidence", "reasoning"],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["results"],
+        "additionalProperties": False
+    }
+    
     def __init__(self):
         """Initialize the Classifier Agent."""
         super().__init__(name="Classifier Agent")
@@ -27,8 +120,27 @@ class ClassifierAgent(BaseAgent):
         # Initialize OpenAI client
         self.openai_client = OpenAIClient()
         
+        # Rules for obvious emails (receipts, newsletters) that skip the AI call
+        self.rules_enabled = os.environ.get('RULE_CLASSIFIER_ENABLED', 'true').lower() == 'true'
+        self.rule_classifier = RuleClassifier()
+        self.register_tool(self.rule_classifier)
+        
+        # Token budget for one email body, and for one multi-email classification prompt
+        self.body_token_budget = agent_budget("classifier")
+        self.batch_token_budget = int(os.environ.get('CLASSIFY_BATCH_TOKEN_BUDGET', '3000'))
+        
         # Load categories
         self._load_categories()
+        
+        # Compile the instructions once, with the category list baked into the stable prefix
+        registry = PromptRegistry.get_instance()
+        static = {"category_list": ", ".join(cat["name"] for cat in self.categories)}
+        self.template = registry.register(
+            PromptTemplate("classifier", CLASSIFY_SYSTEM_TEMPLATE, CLASSIFY_PROMPT_TEMPLATE, static)
+        )
+        self.batch_template = registry.register(
+            PromptTemplate("classifier_batch", BATCH_SYSTEM_TEMPLATE, BATCH_PROMPT_TEMPLATE, static)
+        )
     
     def _load_categories(self):
         """Load email categories from configuration."""
@@ -42,7 +154,7 @@ class ClassifierAgent(BaseAgent):
                 data = json.load(f)
                 self.categories = data['categories']
         except Exception as e:
-            print(f"Error loading categories: {str(e)}", file=sys.stderr)
+            log.error("config.load_failed", config="categories", error=str(e))
             self.categories = []
     
     def process(self, data: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
@@ -51,75 +163,365 @@ class ClassifierAgent(BaseAgent):
         
         Args:
             data: Parsed email data
-            context: Optional context information
+            context: Optional context (user_id scopes near-duplicate reuse;
+                cheap_tiers_tried skips rules and reuse already tried)
             
         Returns:
             Dictionary containing classification results
         """
         try:
-            parsed_email = data.get("parsed_email", data)
-            
-            # Build category list for prompt
-            category_list = ", ".join([cat["name"] for cat in self.categories])
+            shortcut = None if context and context.get("cheap_tiers_tried") else self._short_circuit(data, context)
+            if shortcut:
+                return shortcut
             
-            # Create classification prompt
-            system_instruction = f"""
-            You are an email classification expert.
-            Analyze the email and classify it into ONE of these categories: {category_list}
+            system_instruction, prompt = self._build_prompt(data)
             
-            Consider:
-            - Subject line keywords
-            - Sender information
-            - Email content and context
-            - Tone and purpose
+            # Get classification from OpenAI
+            response = self.openai_client.generate_text(
+                prompt=prompt,
+                system_instruction=system_instruction,
+                temperature=0.3,  # Lower temperature for more consistent classification
+                cache_namespace="classifier",
+                response_schema=self.RESPONSE_SCHEMA
+            )
             
-            IMPORTANT: Your response MUST be a valid JSON object with these exact fields:
-            {{
-                "category": "category name",
-                "confidence": 0.0-1.0,
-                "reasoning": "brief explanation"
-            }}
+            return self._build_result(response)
             
-            Do not include any text before or after the JSON.
-            """
+        except OpenAIAPIError:
+            raise
+        except Exception as e:
+            log.error("agent.failed", agent=self.name, error=str(e))
+            # Fallback to simple keyword-based classification
+            return self._fallback_classification(data)
+    
+    async def aprocess(self, data: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Classify email into appropriate category without blocking the event loop.
+        
+        Args:
+            data: Parsed email data
+            context: Optional context (user_id scopes near-duplicate reuse;
+                cheap_tiers_tried skips rules and reuse already tried)
             
-            prompt = f"""
-            Classify this email:
+        Returns:
+            Dictionary containing classification results
+        """
+        try:
+            shortcut = None if context and context.get("cheap_tiers_tried") else self._short_circuit(data, context)
+            if shortcut:
+                return shortcut
             
-            From: {parsed_email.get('sender', {}).get('email', 'Unknown')}
-            Subject: {parsed_email.get('subject', 'No subject')}
-            Body: {parsed_email.get('body', '')[:500]}
-            """
+            system_instruction, prompt = self._build_prompt(data)
             
-            # Get classification from OpenAI
-            response = self.openai_client.generate_text(
+            response = await self.openai_client.agenerate_text(
                 prompt=prompt,
                 system_instruction=system_instruction,
-                temperature=0.3  # Lower temperature for more consistent classification
-            )
-            
-            # Parse JSON response
-            classification = self.openai_client.parse_json_response(
-                response, 
-                required_fields=["category", "confidence", "reasoning"]
+                temperature=0.3,
+                cache_namespace="classifier",
+                response_schema=self.RESPONSE_SCHEMA
             )
             
-            return {
-                "agent": self.name,
-                "success": True,
-                "category": classification["category"],
-                "confidence": classification["confidence"],
-                "reasoning": classification["reasoning"],
-                "tools_used": ["OpenAI"]
-            }
+            return self._build_result(response)
             
         except OpenAIAPIError:
             raise
         except Exception as e:
-            print(f"Error in Classifier Agent: {str(e)}", file=sys.stderr)
-            # Fallback to simple keyword-based classification
+            log.error("agent.failed", agent=self.name, error=str(e))
             return self._fallback_classification(data)
     
+    def classify_many(self, items: List[Dict[str, Any]], context: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Classify several emails using as few AI calls as possible.
+        
+        Must not be called from the shared background event loop; use
+        aclassify_many there.
+        
+        Args:
+            items: Parsed email data, one entry per email
+            context: Optional context shared by all items (e.g. user_id)
+            
+        Returns:
+            Classification results in the same order as items
+        """
+        return run_sync(self.aclassify_many(items, context))
+    
+    async def aclassify_many(self, items: List[Dict[str, Any]], context: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Classify several emails by packing them into multi-email prompts.
+        
+        Emails are grouped into chunks that fit the token budget, each chunk
+        is sent as one prompt asking for an indexed JSON array, and results
+        are mapped back by index. A truncated or malformed response makes
+        the chunk split in half and retry; single emails go through aprocess.
+        
+        Args:
+            items: Parsed email data, one entry per email
+            context: Optional context shared by all items (e.g. user_id)
+            
+        Returns:
+            Classification results in the same order as items
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        
+        pending = []
+        for i, item in enumerate(items):
+            shortcut = self._short_circuit(item, context)
+            if shortcut:
+                results[i] = shortcut
+            else:
+                pending.append(i)
+        
+        chunks = self._chunk_by_budget(items, pending)
+        chunk_results = await asyncio.gather(*(self._classify_chunk(items, chunk, context) for chunk in chunks))
+        for chunk_result in chunk_results:
+            for i, result in chunk_result.items():
+                results[i] = result
+        
+        return results
+    
+    async def _classify_chunk(self,
+                              items: List[Dict[str, Any]],
+                              indices: List[int],
+                              context: Optional[Dict[str, Any]] = None) -> Dict[int, Dict[str, Any]]:
+        """
+        Classify one chunk with a single prompt, re-splitting on bad output.
+        
+        Returns:
+            Mapping of item index to classification result
+        """
+        if len(indices) == 1:
+            return {indices[0]: await self.aprocess(items[indices[0]], context)}
+        
+        system_instruction, prompt = self._build_batch_prompt(items, indices)
+        results: Dict[int, Dict[str, Any]] = {}
+        try:
+            response = await self.openai_client.agenerate_text(
+                prompt=prompt,
+                system_instruction=system_instruction,
+                temperature=0.3,
+                max_tokens=100 + 80 * len(indices),
+                cache_namespace="classifier",
+                response_schema=self.BATCH_RESPONSE_SCHEMA
+            )
+            results = self._build_batch_result(response, indices)
+        except OpenAIAPIError:
+            raise
+        except Exception as e:
+            log.error("agent.failed", agent=self.name, batch_size=len(indices), error=str(e))
+        
+        missing = [i for i in indices if i not in results]
+        if not missing:
+            return results
+        
+        # Retry whatever the response did not cover, in smaller chunks
+        if len(missing) == len(indices):
+            middle = len(missing) // 2
+            parts = [missing[:middle], missing[middle:]]
+        else:
+            parts = [missing]
+        for part in await asyncio.gather(*(self._classify_chunk(items, p, context) for p in parts)):
+            results.update(part)
+        return results
+    
+    def _chunk_by_budget(self, items: List[Dict[str, Any]], indices: List[int]) -> List[List[int]]:
+        """Group item indices into chunks whose estimated prompt fits the token budget."""
+        chunks, current, used = [], [], 0
+        for i in indices:
+            cost = count_tokens(self._format_email(items[i], 0))
+            if current and used + cost > self.batch_token_budget:
+                chunks.append(current)
+                current, used = [], 0
+            current.append(i)
+            used += cost
+        if current:
+            chunks.append(current)
+        return chunks
+    
+    def _format_email(self, data: Dict[str, Any], index: int) -> str:
+        """Format one email for a multi-email prompt."""
+        parsed_email = data.get("parsed_email", data)
+        return (
+            f"[{index}]\n"
+            f"From: {parsed_email.get('sender', {}).get('email', 'Unknown')}\n"
+            f"Subject: {parsed_email.get('subject', 'No subject')}\n"
+            f"Body: {fit_to_budget(parsed_email.get('body', ''), self.body_token_budget)}\n"
+        )
+    
+    def _build_batch_prompt(self, items: List[Dict[str, Any]], indices: List[int]) -> Tuple[str, str]:
+        """
+        Build the system instruction and prompt for a multi-email chunk.
+        
+        Emails are numbered 0..n-1 within the chunk.
+        
+        Returns:
+            Tuple of (system_instruction, prompt)
+        """
+        emails = "\n".join(self._format_email(items[i], n) for n, i in enumerate(indices))
+        return self.batch_template.system, self.batch_template.render(count=len(indices), emails=emails)
+    
+    def _build_batch_result(self, response: str, indices: List[int]) -> Dict[int, Dict[str, Any]]:
+        """
+        Map a multi-email response back to item indices.
+        
+        Entries that are missing or malformed (e.g. a truncated array) are
+        simply left out so the caller can retry them.
+        
+        Raises:
+            ValueError: If the response is not a JSON object with a results array
+        """
+        data = self.openai_client.parse_json_response(response, required_fields=["results"], agent="classifier")
+        entries = data["results"]
+        if not isinstance(entries, list):
+            raise ValueError("'results' is not an array")
+        
+        by_index = {}
+        for entry in entries:
+            if not isinstance(entry, dict) or not all(k in entry for k in ("index", "category", "confidence", "reasoning")):
+                continue
+            position = entry["index"]
+            if isinstance(position, int) and 0 <= position < len(indices):
+                by_index[indices[position]] = {
+                    "agent": self.name,
+                    "success": True,
+                    "category": entry["category"],
+                    "confidence": entry["confidence"],
+                    "reasoning": entry["reasoning"],
+                    "tools_used": ["OpenAI-Batch"]
+                }
+        
+        return by_index
+    
+    @staticmethod
+    def classification_source(result: Dict[str, Any]) -> str:
+        """
+        Describe which tier produced a classification result.
+        
+        Returns:
+            "rules", "near_duplicate", "ai" or "keywords"
+        """
+        if result.get("short_circuited"):
+            return "rules"
+        if result.get("reused_from"):
+            return "near_duplicate"
+        if "Keyword Matching" in result.get("tools_used", []):
+            return "keywords"
+        return "ai"
+    
+    def classify_cheaply(self, data: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Classify without an AI call, if a confident rule or a near-duplicate
+        email decides the category. Pass context["cheap_tiers_tried"] to
+        process/aprocess afterwards so these tiers are not evaluated twice.
+        
+        Args:
+            data: Parsed email data
+            context: Optional context (user_id scopes near-duplicate reuse)
+            
+        Returns:
+            Classification result, or None if the AI call is needed
+        """
+        return self._short_circuit(data, context)
+    
+    def _short_circuit(self, data: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Try the cheap tiers before the AI call: confident rules first, then
+        near-duplicate reuse.
+        
+        Returns:
+            Classification result, or None if the AI call is needed
+        """
+        return self._apply_rules(data) or self._reuse_near_duplicate(data, context)
+    
+    def _apply_rules(self, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Classify with the rule tier if a rule matches with enough confidence.
+        
+        Returns:
+            Classification result with "short_circuited" set, or None
+        """
+        if not self.rules_enabled:
+            return None
+        
+        parsed_email = data.get("parsed_email", data)
+        match = self.use_tool('RuleClassifier', email_data=parsed_email)
+        if not match or not match["is_confident"]:
+            return None
+        
+        return {
+            "agent": self.name,
+            "success": True,
+            "category": match["category"],
+            "confidence": match["confidence"],
+            "reasoning": f"Matched rule '{match['rule']}'",
+            "short_circuited": True,
+            "tools_used": ["RuleClassifier"]
+        }
+    
+    def _reuse_near_duplicate(self, data: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Reuse the classification of a near-duplicate email, skipping the AI call.
+        
+        Only emails of the same user (context["user_id"]) are considered, so
+        one user's mail never shapes another user's results.
+        
+        Returns:
+            Classification result, or None if no close enough match exists
+        """
+        user_id = context.get("user_id") if context else None
+        if not user_id:
+            return None
+        
+        parsed_email = data.get("parsed_email", data)
+        index = NearDuplicateIndex.get_instance()
+        match = index.find(parsed_email.get("fingerprint"), index.classify_threshold, "classification", user_id=user_id)
+        if not match:
+            return None
+        
+        classification = match["classification"]
+        return {
+            "agent": self.name,
+            "success": True,
+            "category": classification["category"],
+            "confidence": classification["confidence"],
+            "reasoning": f"Near-duplicate of email {match['email_id']} (similarity {match['similarity']:.2f})",
+            "reused_from": match["email_id"],
+            "tools_used": ["NearDuplicateIndex"]
+        }
+    
+    def _build_prompt(self, data: Dict[str, Any]) -> Tuple[str, str]:
+        """
+        Build the system instruction and prompt for classification.
+        
+        Returns:
+            Tuple of (system_instruction, prompt)
+        """
+        parsed_email = data.get("parsed_email", data)
+        prompt = self.template.render(
+            sender=parsed_email.get('sender', {}).get('email', 'Unknown'),
+            subject=parsed_email.get('subject', 'No subject'),
+            body=fit_to_budget(parsed_email.get('body', ''), self.body_token_budget)
+        )
+        return self.template.system, prompt
+    
+    def _build_result(self, response: str) -> Dict[str, Any]:
+        """
+        Parse the AI response into a classification result.
+        """
+        classification = self.openai_client.parse_json_response(
+            response, 
+            required_fields=["category", "confidence", "reasoning"],
+            agent="classifier"
+        )
+        
+        return {
+            "agent": self.name,
+            "success": True,
+            "category": classification["category"],
+            "confidence": classification["confidence"],
+            "reasoning": classification["reasoning"],
+            "tools_used": ["OpenAI"]
+        }
+    
     def _fallback_classification(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Fallback classification using simple keyword matching.
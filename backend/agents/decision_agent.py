@@ -1,11 +1,13 @@
 """
 Decision Agent - Quyết định hành động cho email.
 """
-import sys
 from typing import Dict, Any, Optional
 from .base_agent import BaseAgent
 from tools.importance_scorer import ImportanceScorer
 from tools.tone_analyzer import ToneAnalyzer
+from utils.logger import get_logger
+
+log = get_logger(__name__)
 
 
 class DecisionAgent(BaseAgent):
@@ -75,7 +77,7 @@ class DecisionAgent(BaseAgent):
             }
             
         except Exception as e:
-            print(f"Error in Decision Agent: {str(e)}", file=sys.stderr)
+            log.error("agent.failed", agent=self.name, error=str(e))
             return {
                 "agent": self.name,
                 "success": False,
@@ -1,213 +1,801 @@
 """
 Email Coordinator - Main orchestrator cho toàn bộ hệ thống.
 """
-import sys
-from typing import Dict, Any
+import os
+import time
+import asyncio
+import threading
+from typing import AsyncIterator, Callable, Dict, Any, List, Optional, Tuple
 from .base_agent import BaseAgent
 from .reader_agent import ReaderAgent
 from .classifier_agent import ClassifierAgent
 from .summarizer_agent import SummarizerAgent
 from .decision_agent import DecisionAgent
 from .reply_agent import ReplyAgent
+from .fused_agent import FusedAnalysisAgent
+from .pipeline import Stage, PipelineScheduler
 from utils.db import MongoDB
-from utils.errors import OpenAIAPIError
+from utils.errors import OpenAIAPIError, EmailProcessingError
+from utils.async_runner import run_sync
+from utils.near_duplicate import NearDuplicateIndex
+from utils.logger import get_logger
+
+log = get_logger(__name__)
 
 
 class EmailCoordinator(BaseAgent):
     """
     Main coordinator agent - orchestrates all specialist agents.
     
-    Flow:
+    Flow (stage graph, independent steps run concurrently):
     1. ReaderAgent → Parse email
-    2. ClassifierAgent → Phân loại
-    3. SummarizerAgent → Tóm tắt
-    4. DecisionAgent → Quyết định actions
-    5. ReplyAgent (optional) → Tạo gợi ý reply
+    2. ClassifierAgent → Phân loại        ┐ song song
+    3. SummarizerAgent → Tóm tắt          ┘
+    4. DecisionAgent → Quyết định actions (cần category)
+    5. ReplyAgent (optional) → Tạo gợi ý reply (ngay nếu đủ quan trọng,
+       còn lại tạo khi được yêu cầu qua generate_reply)
     6. Save to MongoDB
     """
     
+    MODES = ("pipeline", "fused")
+    
+    # Progress events for astream_process_email: (state key, event name, payload builder)
+    STAGE_EVENTS = (
+        ("parsed_email", "parsed", lambda o: {"parsed_email": o["parsed_email"]}),
+        ("classification", "category", lambda o: {
+            "category": o["classification"]["category"],
+            "classification_confidence": o["classification"]["confidence"],
+            "reasoning": o["classification"].get("reasoning"),
+            "classification_source": ClassifierAgent.classification_source(o["classification"])
+        }),
+        ("summarization", "summary", lambda o: {
+            "summary": o["summarization"]["summary"],
+            "key_points": o["summarization"].get("key_points", []),
+            "action_items": o["summarization"].get("action_items", [])
+        }),
+        ("decision", "decision", lambda o: {
+            "is_important": o["decision"]["is_important"],
+            "importance_score": o["decision"]["importance_score"],
+            "importance_level": o["decision"]["importance_level"],
+            "tone": o["decision"]["tone"],
+            "suggested_actions": o["decision"]["suggested_actions"]
+        }),
+        ("reply", "reply", lambda o: {
+            "suggested_reply": o["reply"],
+            "reply_pending": bool(o.get("reply_pending"))
+        }),
+        ("saved_email", "saved", lambda o: {
+            "email_id": o["saved_email"]["email_id"] if o["saved_email"] else None
+        }),
+    )
+    
+    # Specialist agent properties, in pipeline order
+    AGENT_ATTRS = ("reader_agent", "classifier_agent", "summarizer_agent",
+                   "decision_agent", "reply_agent", "fused_agent")
+    
     def __init__(self):
         """Initialize the Email Coordinator with all specialist agents."""
         super().__init__(name="Email Coordinator")
         
-        # Initialize all specialist agents
-        self.reader_agent = ReaderAgent()
-        self.classifier_agent = ClassifierAgent()
-        self.summarizer_agent = SummarizerAgent()
-        self.decision_agent = DecisionAgent()
-        self.reply_agent = ReplyAgent()
+        # Specialist agents are created on first use (see _agent): the AI
+        # agents import and configure the provider SDKs and compile prompts
+        self._agents: Dict[str, BaseAgent] = {}
+        self._agents_lock = threading.RLock()
+        
+        # "fused" sends one combined AI request per email instead of up to three
+        self.default_mode = os.environ.get('COORDINATOR_MODE', 'pipeline').lower()
+        self.batch_concurrency = int(os.environ.get('BATCH_CONCURRENCY', '8'))
+        if self.default_mode not in self.MODES:
+            self.default_mode = "pipeline"
+        
+        # Replies are only generated during ingest at or above this importance
+        # score; the rest are generated on first request
+        self.reply_precompute_min_importance = int(os.environ.get('REPLY_PRECOMPUTE_MIN_IMPORTANCE', '50'))
+        self._replies_in_flight: Dict[str, asyncio.Future] = {}
         
         # Initialize database
         self.db = MongoDB.get_instance()
+        
+        # Near-duplicate index lets classifier/summarizer reuse earlier results
+        self.duplicate_index = NearDuplicateIndex.get_instance()
+        
+        # Build the stage graph once; stages only depend on their declared inputs
+        self.scheduler = PipelineScheduler(self._build_stages())
+        self.fused_scheduler = PipelineScheduler(self._build_fused_stages())
+    
+    def _agent(self, attr: str, factory: Callable[[], BaseAgent]) -> BaseAgent:
+        """Get a specialist agent, creating it on first use."""
+        agent = self._agents.get(attr)
+        if agent is None:
+            with self._agents_lock:
+                agent = self._agents.get(attr)
+                if agent is None:
+                    agent = factory()
+                    self._agents[attr] = agent
+        return agent
+    
+    @property
+    def reader_agent(self) -> ReaderAgent:
+        return self._agent("reader_agent", ReaderAgent)
     
-    def process_email(self, email_data: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    @property
+    def classifier_agent(self) -> ClassifierAgent:
+        return self._agent("classifier_agent", ClassifierAgent)
+    
+    @property
+    def summarizer_agent(self) -> SummarizerAgent:
+        return self._agent("summarizer_agent", SummarizerAgent)
+    
+    @property
+    def decision_agent(self) -> DecisionAgent:
+        return self._agent("decision_agent", DecisionAgent)
+    
+    @property
+    def reply_agent(self) -> ReplyAgent:
+        return self._agent("reply_agent", ReplyAgent)
+    
+    @property
+    def fused_agent(self) -> FusedAnalysisAgent:
+        return self._agent("fused_agent", lambda: FusedAnalysisAgent(
+            self.classifier_agent,
+            self.summarizer_agent,
+            self.reply_agent
+        ))
+    
+    def load_agents(self) -> Dict[str, str]:
+        """
+        Create every specialist agent now (readiness check / warm-up).
+        
+        Returns:
+            Agent attribute -> agent name
+        
+        Raises:
+            Whatever agent construction raises (e.g. no AI API key)
+        """
+        return {attr: getattr(self, attr).name for attr in self.AGENT_ATTRS}
+    
+    def reset_agents(self) -> None:
+        """
+        Drop every created agent so they are rebuilt with fresh clients. Only
+        for a freshly forked process: the old lock is replaced, not taken.
+        """
+        self._agents = {}
+        self._agents_lock = threading.RLock()
+    
+    def loaded_agents(self) -> Dict[str, str]:
+        """Get the name of every agent created so far, without creating the rest."""
+        with self._agents_lock:
+            return {attr: agent.name for attr, agent in self._agents.items()}
+    
+    def _build_stages(self) -> List[Stage]:
+        """
+        Declare the processing graph.
+        
+        "preclassify" tries the cheap classification tiers (rules and
+        near-duplicate reuse) in microseconds. When one of them decides the
+        category the summarizer gets it; otherwise classification (an AI
+        call) and summarization run concurrently and the summary is written
+        without a category. The decision only needs the category, so the
+        critical path is read → classify → decide → reply → save.
+        """
+        return [
+            Stage("user", self._stage_user,
+                  inputs=["user_id"], outputs=["user"]),
+            Stage("read", self._stage_read,
+                  inputs=["email_data"], outputs=["parsed_email"]),
+            Stage("preclassify", self._stage_preclassify,
+                  inputs=["parsed_email"], outputs=["quick_classification"]),
+            Stage("classify", self._stage_classify,
+                  inputs=["parsed_email", "quick_classification"], outputs=["classification"]),
+            Stage("summarize", self._stage_summarize,
+                  inputs=["parsed_email", "quick_classification"], outputs=["summarization"]),
+            Stage("decide", self._stage_decide,
+                  inputs=["parsed_email", "classification"], outputs=["decision"]),
+            Stage("reply", self._stage_reply,
+                  inputs=["parsed_email", "classification", "summarization", "decision"],
+                  outputs=["reply", "reply_pending"]),
+            Stage("save", self._stage_save,
+                  inputs=["user", "parsed_email", "classification", "summarization",
+                          "decision", "reply"],
+                  outputs=["saved_email"]),
+        ]
+    
+    def _build_fused_stages(self) -> List[Stage]:
+        """
+        Declare the fused processing graph.
+        
+        A single "analyze" stage replaces classify, summarize and the reply
+        AI call; the reply stage only picks the drafted reply or falls back
+        to templates.
+        """
+        return [
+            Stage("user", self._stage_user,
+                  inputs=["user_id"], outputs=["user"]),
+            Stage("read", self._stage_read,
+                  inputs=["email_data"], outputs=["parsed_email"]),
+            Stage("analyze", self._stage_fused_analyze,
+                  inputs=["parsed_email"],
+                  outputs=["classification", "summarization", "draft_reply"]),
+            Stage("decide", self._stage_decide,
+                  inputs=["parsed_email", "classification"], outputs=["decision"]),
+            Stage("reply", self._stage_fused_reply,
+                  inputs=["parsed_email", "classification", "summarization", "decision", "draft_reply"],
+                  outputs=["reply", "reply_pending"]),
+            Stage("save", self._stage_save,
+                  inputs=["user", "parsed_email", "classification", "summarization",
+                          "decision", "reply"],
+                  outputs=["saved_email"]),
+        ]
+    
+    def process_email(self, email_data: Dict[str, Any], user_id: str, mode: Optional[str] = None) -> Dict[str, Any]:
         """
         Process a single email through all agents.
         
         Args:
             email_data: Raw email data
             user_id: User ID
+            mode: "pipeline" or "fused" (defaults to COORDINATOR_MODE)
             
         Returns:
             Fully processed email with all analysis
         """
-        try:
-            print(f"\n{'='*60}")
-            print(f"📧 Processing email for user: {user_id}")
-            print(f"Subject: {email_data.get('subject', 'No subject')}")
-            print(f"{'='*60}\n")
-            
-            # Ensure user exists
-            user = self.db.get_or_create_user(user_id)
-            if not user:
-                raise Exception("Failed to create or retrieve user")
-            
-            # Step 1: Reader Agent - Parse email
-            print("📖 Step 1: Reading and parsing email...")
-            reader_result = self.reader_agent.process(email_data)
-            if not reader_result.get("success"):
-                raise Exception(f"Reader Agent failed: {reader_result.get('error')}")
-            
-            parsed_email = reader_result["parsed_email"]
-            print(f"✅ Email parsed successfully")
-            print(f"   Sender: {parsed_email['sender']['name']} <{parsed_email['sender']['email']}>")
-            
-            # Step 2: Classifier Agent - Classify email
-            print("\n🏷️  Step 2: Classifying email...")
-            classifier_result = self.classifier_agent.process({"parsed_email": parsed_email})
-            if not classifier_result.get("success"):
-                raise Exception(f"Classifier Agent failed: {classifier_result.get('error')}")
-            
-            category = classifier_result["category"]
-            print(f"✅ Category: {category} (confidence: {classifier_result['confidence']:.2f})")
-            print(f"   Reasoning: {classifier_result['reasoning']}")
-            
-            # Step 3: Summarizer Agent - Create summary
-            print("\n📝 Step 3: Generating summary...")
-            context_for_summary = {"category": category}
-            summarizer_result = self.summarizer_agent.process(
-                {"parsed_email": parsed_email},
-                context=context_for_summary
-            )
-            if not summarizer_result.get("success"):
-                raise Exception(f"Summarizer Agent failed: {summarizer_result.get('error')}")
-            
-            summary = summarizer_result["summary"]
-            key_points = summarizer_result.get("key_points", [])
-            action_items = summarizer_result.get("action_items", [])
-            print(f"✅ Summary: {summary}")
-            if key_points:
-                print(f"   Key points: {', '.join(key_points[:3])}")
-            
-            # Step 4: Decision Agent - Decide actions
-            print("\n⚖️  Step 4: Making decisions...")
-            context_for_decision = {
-                "category": category,
-                "summary": summary
-            }
-            decision_result = self.decision_agent.process(
-                {"parsed_email": parsed_email},
-                context=context_for_decision
-            )
-            if not decision_result.get("success"):
-                raise Exception(f"Decision Agent failed: {decision_result.get('error')}")
-            
-            is_important = decision_result["is_important"]
-            importance_score = decision_result["importance_score"]
-            suggested_actions = decision_result["suggested_actions"]
-            tone = decision_result["tone"]
-            print(f"✅ Importance: {decision_result['importance_level']} (score: {importance_score})")
-            print(f"   Important: {'Yes' if is_important else 'No'}")
-            print(f"   Tone: {tone}")
-            print(f"   Actions: {', '.join(suggested_actions[:3])}")
-            
-            # Step 5: Reply Agent (optional) - Generate suggested reply
-            suggested_reply = None
-            if any(action in suggested_actions for action in ["needs_reply", "reply_asap"]):
-                print("\n💬 Step 5: Generating reply suggestions...")
-                context_for_reply = {
-                    "category": category,
-                    "tone": tone,
-                    "summary": summary,
-                    "action_items": action_items,
-                    "suggested_actions": suggested_actions
-                }
-                reply_result = self.reply_agent.process(
-                    {"parsed_email": parsed_email},
-                    context=context_for_reply
+        return run_sync(self.aprocess_email(email_data, user_id, mode))
+    
+    def process_batch(self, emails: List[Dict[str, Any]], user_id: str, mode: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Process several emails, classifying them together in batched prompts.
+        
+        Args:
+            emails: Raw email data
+            user_id: User ID
+            mode: "pipeline" or "fused" (defaults to COORDINATOR_MODE)
+            
+        Returns:
+            Results in the same order as emails
+        """
+        return run_sync(self.aprocess_batch(emails, user_id, mode))
+    
+    async def aprocess_batch(self, emails: List[Dict[str, Any]], user_id: str, mode: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Process several emails concurrently, classifying them together in
+        batched prompts.
+        
+        Up to BATCH_CONCURRENCY emails run their stage graphs at the same
+        time; provider calls are further capped by the adaptive
+        per-provider limit (at most LLM_MAX_IN_FLIGHT). Each
+        result carries its own elapsed_ms.
+        
+        In pipeline mode all emails are parsed first and classified with
+        ClassifierAgent.aclassify_many; each email's graph then starts with
+        parsed_email and classification precomputed.
+        
+        Args:
+            emails: Raw email data
+            user_id: User ID
+            mode: "pipeline" or "fused" (defaults to COORDINATOR_MODE)
+            
+        Returns:
+            Results in the same order as emails
+        """
+        mode = (mode or self.default_mode).lower()
+        precomputed: List[Dict[str, Any]] = [{} for _ in emails]
+        
+        if mode == "pipeline":
+            await asyncio.to_thread(self.duplicate_index.ensure_loaded, self.db)
+            reader_results = await asyncio.gather(*(self.reader_agent.aprocess(e) for e in emails))
+            parsed = [(i, r["parsed_email"]) for i, r in enumerate(reader_results) if r.get("success")]
+            try:
+                classifications = await self.classifier_agent.aclassify_many(
+                    [{"parsed_email": p} for _, p in parsed],
+                    context={"user_id": user_id}
                 )
-                if reply_result.get("success") and reply_result.get("needs_reply"):
-                    suggested_reply = reply_result["suggested_reply"]
-                    print(f"✅ Reply generated (3 versions available)")
-            
-            # Step 6: Save to database
-            print("\n💾 Step 6: Saving to database...")
-            email_to_save = {
-                "user_id": user_id,
-                "sender": parsed_email["sender"]["email"],
-                "subject": parsed_email["subject"],
-                "body": parsed_email["body"],
-                "received_date": parsed_email.get("received_date"),
-                "category": category,
-                "summary": summary,
-                "key_points": key_points,
-                "action_items": action_items,
-                "is_important": is_important,
-                "importance_score": importance_score,
-                "suggested_action": suggested_actions,
-                "suggested_reply": suggested_reply,
-                "tone": tone
-            }
+                for (i, parsed_email), classification in zip(parsed, classifications):
+                    precomputed[i] = {"parsed_email": parsed_email, "classification": classification}
+            except OpenAIAPIError as e:
+                # Leave the emails to the per-email path, which reports the error
+                log.error("email.batch_classification_failed", emails=len(parsed), error=str(e))
+        
+        slots = asyncio.Semaphore(max(1, self.batch_concurrency))
+        
+        async def run_one(email_data: Dict[str, Any], state: Dict[str, Any]) -> Dict[str, Any]:
+            async with slots:
+                started = time.perf_counter()
+                try:
+                    result = await self.aprocess_email(email_data, user_id, mode, precomputed=state)
+                except Exception as e:
+                    result = {
+                        "success": False,
+                        "error": str(e),
+                        "email_subject": email_data.get("subject", "Unknown")
+                    }
+                result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+                return result
+        
+        # gather keeps results in input order
+        return list(await asyncio.gather(*(
+            run_one(email_data, state) for email_data, state in zip(emails, precomputed)
+        )))
+    
+    async def aprocess_email(self,
+                             email_data: Dict[str, Any],
+                             user_id: str,
+                             mode: Optional[str] = None,
+                             precomputed: Optional[Dict[str, Any]] = None,
+                             on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Process a single email through the stage graph.
+        
+        Independent stages run concurrently, so latency is the critical path
+        rather than the sum of all agent calls.
+        
+        Args:
+            email_data: Raw email data
+            user_id: User ID
+            mode: "pipeline" or "fused" (defaults to COORDINATOR_MODE)
+            precomputed: Stage outputs already available (e.g. parsed_email,
+                classification); the stages producing them are skipped
+            on_event: Optional callback receiving (event name, data) as soon
+                as each result is ready; see STAGE_EVENTS
             
-            saved_email = self.db.save_email(email_to_save)
-            if not saved_email:
-                print("⚠️  Warning: Failed to save email to database")
-            else:
-                print(f"✅ Email saved with ID: {saved_email['email_id']}")
+        Returns:
+            Fully processed email with all analysis
+        """
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self.duplicate_index.ensure_loaded, self.db)
+            
+            mode = (mode or self.default_mode).lower()
+            if mode not in self.MODES:
+                raise ValueError(f"Unknown processing mode: {mode}")
+            scheduler = self.fused_scheduler if mode == "fused" else self.scheduler
+            
+            state = await scheduler.run({
+                **(precomputed or {}),
+                "email_data": email_data,
+                "user_id": user_id
+            }, on_stage=self._stage_event_emitter(on_event) if on_event else None)
+            
+            parsed_email = state["parsed_email"]
+            classifier_result = state["classification"]
+            summarizer_result = state["summarization"]
+            decision_result = state["decision"]
+            suggested_reply = state["reply"]
+            saved_email = state["saved_email"]
             
             # Return complete result
             result = {
                 "success": True,
                 "email_id": saved_email["email_id"] if saved_email else None,
                 "parsed_email": parsed_email,
-                "category": category,
+                "category": classifier_result["category"],
                 "classification_confidence": classifier_result["confidence"],
-                "summary": summary,
-                "key_points": key_points,
-                "action_items": action_items,
-                "is_important": is_important,
-                "importance_score": importance_score,
+                "classification_source": ClassifierAgent.classification_source(classifier_result),
+                "summary": summarizer_result["summary"],
+                "key_points": summarizer_result.get("key_points", []),
+                "action_items": summarizer_result.get("action_items", []),
+                "is_important": decision_result["is_important"],
+                "importance_score": decision_result["importance_score"],
                 "importance_level": decision_result["importance_level"],
-                "tone": tone,
+                "tone": decision_result["tone"],
                 "formality": decision_result.get("formality"),
-                "suggested_actions": suggested_actions,
+                "suggested_actions": decision_result["suggested_actions"],
                 "suggested_reply": suggested_reply,
+                "reply_pending": bool(state.get("reply_pending")),
+                "mode": mode,
+                "stage_timings_ms": state["_timings"],
+                "critical_path": scheduler.critical_path(state["_timings"]),
                 "agents_used": [
                     self.reader_agent.name,
                     self.classifier_agent.name,
                     self.summarizer_agent.name,
                     self.decision_agent.name,
                     self.reply_agent.name if suggested_reply else None
+                ] if mode == "pipeline" else [
+                    self.reader_agent.name,
+                    self.fused_agent.name,
+                    self.decision_agent.name
                 ]
             }
             
-            print(f"\n{'='*60}")
-            print("✅ Email processing completed successfully!")
-            print(f"{'='*60}\n")
+            log.info(
+                "email.processed",
+                email_id=result["email_id"],
+                mode=mode,
+                category=result["category"],
+                classification_source=result["classification_source"],
+                importance_level=result["importance_level"],
+                reply=("ready" if suggested_reply else "pending" if result["reply_pending"] else "none"),
+                stage_ms=state["_timings"],
+                critical_path=result["critical_path"],
+                total_ms=round((time.perf_counter() - started) * 1000, 2)
+            )
             
             return result
             
         except OpenAIAPIError as e:
-            print(f"\n❌ OpenAI API Error: {str(e)}", file=sys.stderr)
+            log.error("email.failed", error_type="ai_unavailable", error=str(e),
+                      total_ms=round((time.perf_counter() - started) * 1000, 2))
             raise
         except Exception as e:
-            print(f"\n❌ Error in Email Coordinator: {str(e)}", file=sys.stderr)
+            log.error("email.failed", error_type=type(e).__name__, error=str(e),
+                      total_ms=round((time.perf_counter() - started) * 1000, 2))
             return {
                 "success": False,
                 "error": str(e),
                 "agents_used": [self.name]
             }
     
+    async def astream_process_email(self,
+                                    email_data: Dict[str, Any],
+                                    user_id: str,
+                                    mode: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process a single email, yielding each stage result as it completes.
+        
+        Args:
+            email_data: Raw email data
+            user_id: User ID
+            mode: "pipeline" or "fused" (defaults to COORDINATOR_MODE)
+            
+        Yields:
+            {"event": name, ...} for each entry of STAGE_EVENTS as it becomes
+            ready, then {"event": "result", ...} with the same result as
+            aprocess_email, or {"event": "error", "error": ...}
+            
+        Raises:
+            OpenAIAPIError: If the AI service is unavailable
+        """
+        events: asyncio.Queue = asyncio.Queue()
+        task = asyncio.ensure_future(self.aprocess_email(
+            email_data, user_id, mode,
+            on_event=lambda name, data: events.put_nowait({"event": name, **data})
+        ))
+        task.add_done_callback(lambda _: events.put_nowait(None))
+        
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield event
+            
+            result = task.result()
+            if result.get("success"):
+                yield {"event": "result", **result}
+            else:
+                yield {"event": "error", "error": result.get("error", "Failed to process email")}
+        finally:
+            if not task.done():
+                task.cancel()
+    
+    def _stage_event_emitter(self, on_event: Callable[[str, Dict[str, Any]], None]):
+        """Adapt a scheduler on_stage callback to named progress events."""
+        def on_stage(stage_name: str, outputs: Dict[str, Any], elapsed_ms: float) -> None:
+            for key, event_name, build in self.STAGE_EVENTS:
+                if key in outputs:
+                    on_event(event_name, {"stage": stage_name, "elapsed_ms": elapsed_ms, **build(outputs)})
+        return on_stage
+    
+    # ------------------------------------------------------------------
+    # Stages
+    # ------------------------------------------------------------------
+    
+    async def _stage_user(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Ensure the user exists."""
+        user = await asyncio.to_thread(self.db.get_or_create_user, state["user_id"])
+        if not user:
+            raise Exception("Failed to create or retrieve user")
+        return {"user": user}
+    
+    async def _stage_read(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Step 1: Reader Agent - Parse email."""
+        reader_result = await self.reader_agent.aprocess(state["email_data"])
+        if not reader_result.get("success"):
+            raise Exception(f"Reader Agent failed: {reader_result.get('error')}")
+        
+        parsed_email = reader_result["parsed_email"]
+        log.debug("email.parsed", body_chars=len(parsed_email.get("body") or ""),
+                  fingerprinted=bool(parsed_email.get("fingerprint")))
+        return {"parsed_email": parsed_email}
+    
+    async def _stage_preclassify(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Step 2a: Classify with rules or near-duplicate reuse, if either is confident."""
+        if state.get("classification"):
+            # Precomputed by the batched classifier
+            return {"quick_classification": state["classification"]}
+        quick = self.classifier_agent.classify_cheaply(
+            {"parsed_email": state["parsed_email"]},
+            context={"user_id": state["user_id"]}
+        )
+        return {"quick_classification": quick}
+    
+    async def _stage_classify(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Step 2: Classifier Agent - Classify email."""
+        classifier_result = state["quick_classification"] or await self.classifier_agent.aprocess(
+            {"parsed_email": state["parsed_email"]},
+            context={"user_id": state["user_id"], "cheap_tiers_tried": True}
+        )
+        if not classifier_result.get("success"):
+            raise Exception(f"Classifier Agent failed: {classifier_result.get('error')}")
+        
+        log.debug("email.classified", category=classifier_result["category"],
+                  confidence=classifier_result["confidence"],
+                  source=ClassifierAgent.classification_source(classifier_result))
+        return {"classification": classifier_result}
+    
+    async def _stage_summarize(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Step 3: Summarizer Agent - Create summary."""
+        classification = state["quick_classification"]
+        context_for_summary = {
+            "category": classification["category"] if classification else None,
+            "user_id": state["user_id"]
+        }
+        summarizer_result = await self.summarizer_agent.aprocess(
+            {"parsed_email": state["parsed_email"]},
+            context=context_for_summary
+        )
+        if not summarizer_result.get("success"):
+            raise Exception(f"Summarizer Agent failed: {summarizer_result.get('error')}")
+        
+        log.debug("email.summarized", key_points=len(summarizer_result.get("key_points", [])),
+                  action_items=len(summarizer_result.get("action_items", [])))
+        return {"summarization": summarizer_result}
+    
+    async def _stage_decide(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Step 4: Decision Agent - Decide actions."""
+        context_for_decision = {"category": state["classification"]["category"]}
+        decision_result = await self.decision_agent.aprocess(
+            {"parsed_email": state["parsed_email"]},
+            context=context_for_decision
+        )
+        if not decision_result.get("success"):
+            raise Exception(f"Decision Agent failed: {decision_result.get('error')}")
+        
+        log.debug("email.decided", importance_level=decision_result["importance_level"],
+                  importance_score=decision_result["importance_score"],
+                  tone=decision_result["tone"], actions=decision_result["suggested_actions"])
+        return {"decision": decision_result}
+    
+    async def _stage_reply(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Step 5: Reply Agent (optional) - Generate suggested reply."""
+        decision_result = state["decision"]
+        suggested_actions = decision_result["suggested_actions"]
+        if not any(action in suggested_actions for action in ["needs_reply", "reply_asap"]):
+            return {"reply": None, "reply_pending": False}
+        
+        if decision_result["importance_score"] < self.reply_precompute_min_importance:
+            log.debug("email.reply_deferred", importance_score=decision_result["importance_score"])
+            return {"reply": None, "reply_pending": True}
+        
+        summarizer_result = state["summarization"]
+        context_for_reply = {
+            "category": state["classification"]["category"],
+            "tone": decision_result["tone"],
+            "summary": summarizer_result["summary"],
+            "action_items": summarizer_result.get("action_items", []),
+            "suggested_actions": suggested_actions,
+            "importance_level": decision_result["importance_level"]
+        }
+        suggested_reply = await self._generate_reply(state["parsed_email"], context_for_reply)
+        log.debug("email.reply_generated", generated=bool(suggested_reply))
+        return {"reply": suggested_reply, "reply_pending": False}
+    
+    async def _generate_reply(self, parsed_email: Dict[str, Any], context: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Run the Reply Agent and return the suggested reply, if any."""
+        reply_result = await self.reply_agent.aprocess(
+            {"parsed_email": parsed_email},
+            context=context
+        )
+        if reply_result.get("success") and reply_result.get("needs_reply"):
+            return reply_result["suggested_reply"]
+        return None
+    
+    def generate_reply(self, email_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the suggested reply of a stored email, generating it on first request.
+        
+        Args:
+            email_id: Email ID
+            user_id: User ID (must own the email)
+            
+        Returns:
+            {"email_id", "suggested_reply", "cached"}, or None if the email
+            does not exist or belongs to another user
+        """
+        return run_sync(self.agenerate_reply(email_id, user_id))
+    
+    async def agenerate_reply(self, email_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the suggested reply of a stored email, generating it on first request.
+        
+        The generated reply is written back to the email document. Concurrent
+        requests for the same email share one generation.
+        
+        Args:
+            email_id: Email ID
+            user_id: User ID (must own the email)
+            
+        Returns:
+            {"email_id", "suggested_reply", "cached"}, or None if the email
+            does not exist or belongs to another user
+        """
+        email = await asyncio.to_thread(self.db.get_email_by_id, email_id, user_id)
+        if not email:
+            return None
+        if email.get("suggested_reply"):
+            return {"email_id": email_id, "suggested_reply": email["suggested_reply"], "cached": True}
+        
+        in_flight = self._replies_in_flight.get(email_id)
+        if in_flight is None:
+            in_flight = asyncio.ensure_future(self._generate_stored_reply(email))
+            self._replies_in_flight[email_id] = in_flight
+            in_flight.add_done_callback(lambda _: self._replies_in_flight.pop(email_id, None))
+        
+        suggested_reply = await asyncio.shield(in_flight)
+        return {"email_id": email_id, "suggested_reply": suggested_reply, "cached": False}
+    
+    async def astream_reply(self, email: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream the suggested reply of a stored email as it is generated.
+        
+        A stored reply is sent as a single "done" event; otherwise the
+        ReplyAgent's delta/field events are forwarded and the finished reply
+        is written back to the email document.
+        
+        Args:
+            email: Email document (already checked to belong to the user)
+            
+        Yields:
+            ReplyAgent stream events; the last one is
+            {"event": "done", "email_id", "suggested_reply", "cached"}
+        """
+        if email.get("suggested_reply"):
+            yield {"event": "done", "email_id": email["email_id"],
+                   "suggested_reply": email["suggested_reply"], "cached": True}
+            return
+        
+        parsed_email, context_for_reply = self._stored_reply_input(email)
+        async for event in self.reply_agent.astream({"parsed_email": parsed_email}, context=context_for_reply):
+            if event["event"] != "done":
+                yield event
+                continue
+            
+            suggested_reply = event["suggested_reply"] if event.get("success") and event.get("needs_reply") else None
+            if suggested_reply:
+                await self._store_reply(email, suggested_reply)
+            yield {"event": "done", "email_id": email["email_id"],
+                   "suggested_reply": suggested_reply, "cached": False}
+    
+    async def _generate_stored_reply(self, email: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Generate a reply from a stored email document and save it."""
+        parsed_email, context_for_reply = self._stored_reply_input(email)
+        suggested_reply = await self._generate_reply(parsed_email, context_for_reply)
+        if suggested_reply:
+            await self._store_reply(email, suggested_reply)
+        return suggested_reply
+    
+    def _stored_reply_input(self, email: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Rebuild the Reply Agent input and context from a stored email document."""
+        parsed_email = {
+            "sender": {"email": email.get("sender", "")},
+            "subject": email.get("subject", ""),
+            "body": email.get("body", "")
+        }
+        context_for_reply = {
+            "category": email.get("category"),
+            "tone": email.get("tone"),
+            "summary": email.get("summary", ""),
+            "action_items": email.get("action_items", []),
+            "suggested_actions": email.get("suggested_action") or [],
+            "importance_level": email.get("importance_level")
+        }
+        return parsed_email, context_for_reply
+    
+    async def _store_reply(self, email: Dict[str, Any], suggested_reply: Dict[str, Any]) -> None:
+        """Write a generated reply back to the email document."""
+        saved = await asyncio.to_thread(
+            self.db.set_suggested_reply, email["email_id"], email["user_id"], suggested_reply
+        )
+        if not saved:
+            log.warning("email.reply_store_failed", email_id=email["email_id"])
+    
+    async def _stage_fused_analyze(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Steps 2+3 (fused): Classify, summarize and draft a reply in one AI call."""
+        fused_result = await self.fused_agent.aprocess({"parsed_email": state["parsed_email"]})
+        classification = fused_result["classification"]
+        summarization = fused_result["summarization"]
+        
+        log.debug("email.analyzed", category=classification["category"],
+                  confidence=classification["confidence"],
+                  fallback_fields=fused_result["fallback_fields"])
+        return {
+            "classification": classification,
+            "summarization": summarization,
+            "draft_reply": fused_result["draft_reply"]
+        }
+    
+    async def _stage_fused_reply(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Step 5 (fused): Use the drafted reply when a reply is needed.
+        
+        The draft was already paid for by the fused call, so it is kept
+        whatever the importance; REPLY_PRECOMPUTE_MIN_IMPORTANCE only defers
+        the separate reply call of the pipeline mode.
+        """
+        decision_result = state["decision"]
+        if not any(action in decision_result["suggested_actions"] for action in ["needs_reply", "reply_asap"]):
+            return {"reply": None, "reply_pending": False}
+        
+        context_for_reply = {
+            "category": state["classification"]["category"],
+            "tone": decision_result["tone"]
+        }
+        suggested_reply = self.fused_agent.complete_reply(
+            {"parsed_email": state["parsed_email"]},
+            state["draft_reply"],
+            context_for_reply
+        )
+        return {"reply": suggested_reply, "reply_pending": False}
+    
+    async def _stage_save(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Step 6: Save to database."""
+        parsed_email = state["parsed_email"]
+        summarizer_result = state["summarization"]
+        decision_result = state["decision"]
+        email_to_save = {
+            "user_id": state["user_id"],
+            "sender": parsed_email["sender"]["email"],
+            "subject": parsed_email["subject"],
+            "body": parsed_email["body"],
+            "received_date": parsed_email.get("received_date"),
+            "category": state["classification"]["category"],
+            "classification_confidence": state["classification"]["confidence"],
+            "classification_source": ClassifierAgent.classification_source(state["classification"]),
+            "summary": summarizer_result["summary"],
+            "key_points": summarizer_result.get("key_points", []),
+            "action_items": summarizer_result.get("action_items", []),
+            "is_important": decision_result["is_important"],
+            "importance_score": decision_result["importance_score"],
+            "importance_level": decision_result["importance_level"],
+            "suggested_action": decision_result["suggested_actions"],
+            "suggested_reply": state["reply"],
+            "reply_pending": bool(state.get("reply_pending")),
+            "tone": decision_result["tone"],
+            "fingerprint": parsed_email.get("fingerprint"),
+            "stripped_content": parsed_email.get("stripped_content", []),
+            "body_reduction": parsed_email.get("reduction")
+        }
+        
+        saved_email = await asyncio.to_thread(self.db.save_email, email_to_save)
+        if not saved_email:
+            log.warning("email.save_failed")
+        else:
+            self.duplicate_index.add(saved_email["email_id"], parsed_email.get("fingerprint"), {
+                "user_id": state["user_id"],
+                "sender": parsed_email["sender"]["email"],
+                "classification": state["classification"],
+                "summarization": summarizer_result
+            })
+        return {"saved_email": saved_email}
+    
+    def handle_job(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Job queue handler: process the email described by a job payload.
+        
+        Args:
+            payload: {"email_data": ..., "user_id": ..., "mode": ...}
+            
+        Returns:
+            The processing result
+            
+        Raises:
+            EmailProcessingError: If the email cannot be processed (not retried)
+        """
+        result = self.process_email(payload["email_data"], payload["user_id"], payload.get("mode"))
+        if not result.get("success"):
+            raise EmailProcessingError(result.get("error", "Failed to process email"))
+        return result
+    
     def process(self, data: Dict[str, Any], context: Dict[str, Any] = None) -> Dict[str, Any]:
         """
         Process method required by BaseAgent.
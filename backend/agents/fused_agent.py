@@ -0,0 +1,270 @@
+"""
+Fused Analysis Agent - Phân loại, tóm tắt và gợi ý reply trong một lần gọi AI.
+"""
+from typing import Dict, Any, Optional, Tuple
+from .base_agent import BaseAgent
+from .classifier_agent import ClassifierAgent
+from .summarizer_agent import SummarizerAgent
+from .reply_agent import ReplyAgent
+from utils.openai_client import OpenAIClient
+from utils.errors import OpenAIAPIError
+from utils.tokens import fit_to_budget, agent_budget
+from utils.prompts import PromptTemplate, PromptRegistry
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+FUSED_SYSTEM_TEMPLATE = """
+You are an expert email assistant. Analyze the email in ONE pass:
+1. Classify it into ONE of these categories: {category_list}
+2. Summarize it in 1-2 sentences, extract key points and action items
+3. If the email asks a question or requests something, draft 3 SPECIFIC and
+   ACTIONABLE reply versions (brief 2-3 sentences, standard 4-5, detailed 6-8)
+   in the language of the original email; otherwise set "reply" to null
+
+IMPORTANT: Your response MUST be a valid JSON object with these exact fields:
+{{
+    "category": "category name",
+    "confidence": 0.0-1.0,
+    "reasoning": "brief explanation",
+    "summary": "1-2 sentence summary",
+    "key_points": ["point 1", "point 2", ...],
+    "action_items": ["action 1", ...] (or empty array if none),
+    "reply": {{
+        "brief": "...",
+        "standard": "...",
+        "detailed": "...",
+        "subject_reply": "Re: ..."
+    }} or null
+}}
+
+Do not include any text before or after the JSON.
+"""
+
+FUSED_PROMPT_TEMPLATE = """
+Analyze this email:
+
+From: {sender_name} <{sender_email}>
+Subject: {subject}
+
+Body:
+{body}
+"""
+
+
+class FusedAnalysisAgent(BaseAgent):
+    """
+    Agent gộp Classifier + Summarizer + Reply thành một request duy nhất.
+
+    Nhiệm vụ:
+    - Gửi email body một lần với JSON schema kết hợp
+    - Validate từng phần của response
+    - Fallback từng field về fallback của agent tương ứng
+    """
+
+    CLASSIFICATION_FIELDS = ["category", "confidence", "reasoning"]
+    SUMMARY_FIELDS = ["summary", "key_points", "action_items"]
+    REPLY_FIELDS = ["brief", "standard", "detailed", "subject_reply"]
+
+    # Structured output schema (OpenAI strict json_schema / Gemini response_schema)
+    RESPONSE_SCHEMA = {
+        "title": "fused_analysis",
+        "type": "object",
+        "properties": {
+            **ClassifierAgent.RESPONSE_SCHEMA["properties"],
+            **SummarizerAgent.RESPONSE_SCHEMA["properties"],
+            "reply": {"anyOf": [
+                {key: value for key, value in ReplyAgent.RESPONSE_SCHEMA.items() if key != "title"},
+                {"type": "null"}
+            ]}
+        },
+        "required": CLASSIFICATION_FIELDS + SUMMARY_FIELDS + ["reply"],
+        "additionalProperties": False
+    }
+
+    def __init__(self,
+                 classifier_agent: ClassifierAgent,
+                 summarizer_agent: SummarizerAgent,
+                 reply_agent: ReplyAgent):
+        """
+        Initialize the Fused Analysis Agent.
+
+        Args:
+            classifier_agent: Provides the category list and classification fallback
+            summarizer_agent: Provides the summary fallback
+            reply_agent: Provides the template reply fallback
+        """
+        super().__init__(name="Fused Analysis Agent")
+
+        self.classifier_agent = classifier_agent
+        self.summarizer_agent = summarizer_agent
+        self.reply_agent = reply_agent
+
+        # Initialize OpenAI client
+        self.openai_client = OpenAIClient()
+        
+        # Token budget for the email body in the prompt
+        self.body_token_budget = agent_budget("fused")
+
+        # Compile the instructions once, with the category list baked into the stable prefix
+        self.template = PromptRegistry.get_instance().register(PromptTemplate(
+            "fused", FUSED_SYSTEM_TEMPLATE, FUSED_PROMPT_TEMPLATE,
+            {"category_list": ", ".join(cat["name"] for cat in classifier_agent.categories)}
+        ))
+
+    def process(self, data: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Classify, summarize and draft a reply with a single AI call.
+
+        Args:
+            data: Parsed email data
+            context: Optional context information
+
+        Returns:
+            Dictionary with "classification", "summarization" and "draft_reply"
+        """
+        system_instruction, prompt = self._build_prompt(data)
+        try:
+            response = self.openai_client.generate_text(
+                prompt=prompt,
+                system_instruction=system_instruction,
+                temperature=0.4,
+                max_tokens=2048,
+                cache_namespace="fused",
+                response_schema=self.RESPONSE_SCHEMA
+            )
+        except OpenAIAPIError:
+            raise
+        except Exception as e:
+            log.error("agent.failed", agent=self.name, error=str(e))
+            response = ""
+
+        return self._build_result(data, response)
+
+    async def aprocess(self, data: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Classify, summarize and draft a reply with a single AI call without
+        blocking the event loop.
+
+        Args:
+            data: Parsed email data
+            context: Optional context information
+
+        Returns:
+            Dictionary with "classification", "summarization" and "draft_reply"
+        """
+        system_instruction, prompt = self._build_prompt(data)
+        try:
+            response = await self.openai_client.agenerate_text(
+                prompt=prompt,
+                system_instruction=system_instruction,
+                temperature=0.4,
+                max_tokens=2048,
+                cache_namespace="fused",
+                response_schema=self.RESPONSE_SCHEMA
+            )
+        except OpenAIAPIError:
+            raise
+        except Exception as e:
+            log.error("agent.failed", agent=self.name, error=str(e))
+            response = ""
+
+        return self._build_result(data, response)
+
+    def complete_reply(self,
+                       data: Dict[str, Any],
+                       draft_reply: Optional[Dict[str, Any]],
+                       context: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Return the drafted reply, or the template fallback if the fused
+        response did not contain a valid one.
+
+        Args:
+            data: Parsed email data
+            draft_reply: Reply versions from the fused response, if any
+            context: Context including category and tone
+
+        Returns:
+            Suggested reply dictionary
+        """
+        if draft_reply:
+            return draft_reply
+        return self.reply_agent._fallback_reply(data, context)["suggested_reply"]
+
+    def _build_prompt(self, data: Dict[str, Any]) -> Tuple[str, str]:
+        """
+        Build the system instruction and prompt for the combined analysis.
+
+        Returns:
+            Tuple of (system_instruction, prompt)
+        """
+        parsed_email = data.get("parsed_email", data)
+        prompt = self.template.render(
+            sender_name=parsed_email.get('sender', {}).get('name', 'Unknown'),
+            sender_email=parsed_email.get('sender', {}).get('email', ''),
+            subject=parsed_email.get('subject', 'No subject'),
+            body=fit_to_budget(parsed_email.get('body', ''), self.body_token_budget)
+        )
+        return self.template.system, prompt
+
+    def _build_result(self, data: Dict[str, Any], response: str) -> Dict[str, Any]:
+        """
+        Validate each part of the combined response, falling back per field.
+        """
+        try:
+            combined = self.openai_client.parse_json_response(response, agent="fused") if response else {}
+        except ValueError as e:
+            log.error("agent.failed", agent=self.name, error=str(e))
+            combined = {}
+
+        fallback_fields = []
+
+        if self._has_fields(combined, self.CLASSIFICATION_FIELDS):
+            classification = {
+                "agent": self.name,
+                "success": True,
+                "category": combined["category"],
+                "confidence": combined["confidence"],
+                "reasoning": combined["reasoning"],
+                "tools_used": ["OpenAI"]
+            }
+        else:
+            classification = self.classifier_agent._fallback_classification(data)
+            fallback_fields.append("classification")
+
+        if self._has_fields(combined, self.SUMMARY_FIELDS):
+            summarization = {
+                "agent": self.name,
+                "success": True,
+                "summary": combined["summary"],
+                "key_points": combined["key_points"],
+                "action_items": combined["action_items"],
+                "tools_used": ["OpenAI"]
+            }
+        else:
+            summarization = self.summarizer_agent._fallback_summary(data)
+            fallback_fields.append("summarization")
+
+        draft_reply = None
+        reply = combined.get("reply")
+        if self._has_fields(reply, self.REPLY_FIELDS):
+            draft_reply = {
+                "brief": reply["brief"],
+                "standard": reply["standard"],
+                "detailed": reply["detailed"],
+                "subject": reply["subject_reply"]
+            }
+
+        return {
+            "agent": self.name,
+            "success": True,
+            "classification": classification,
+            "summarization": summarization,
+            "draft_reply": draft_reply,
+            "fallback_fields": fallback_fields,
+            "tools_used": ["OpenAI"]
+        }
+
+    def _has_fields(self, data: Any, fields: list) -> bool:
+        """Check that data is a dict with all fields present and non-null."""
+        return isinstance(data, dict) and all(data.get(field) is not None for field in fields)
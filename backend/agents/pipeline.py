@@ -0,0 +1,197 @@
+"""
+Pipeline - Dependency-graph scheduler cho các agent.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+
+StageFunc = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+StageCallback = Callable[[str, Dict[str, Any], float], None]
+
+
+class Stage:
+    """
+    A single step in the processing graph.
+
+    Each stage declares the keys it reads from the shared state and the keys
+    it writes back. The scheduler starts a stage as soon as all of its
+    required inputs are available.
+    """
+
+    def __init__(self,
+                 name: str,
+                 func: StageFunc,
+                 inputs: Iterable[str],
+                 outputs: Iterable[str]):
+        """
+        Initialize a stage.
+
+        Args:
+            name: Unique stage name
+            func: Async callable receiving a snapshot of the state and
+                returning a dict with the declared outputs
+            inputs: State keys that must be ready before the stage starts
+            outputs: State keys the stage produces
+        """
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+
+
+class PipelineScheduler:
+    """
+    Runs a set of stages, executing independent stages concurrently.
+
+    Wall-clock latency becomes the length of the critical path through the
+    graph rather than the sum of all stages.
+    """
+
+    def __init__(self, stages: List[Stage]):
+        """
+        Initialize the scheduler and validate the stage graph.
+
+        Args:
+            stages: The stages to run
+
+        Raises:
+            ValueError: If names or outputs are duplicated
+        """
+        self.stages = stages
+        self._producers: Dict[str, str] = {}
+
+        names = set()
+        for stage in stages:
+            if stage.name in names:
+                raise ValueError(f"Duplicate stage name: {stage.name}")
+            names.add(stage.name)
+            for key in stage.outputs:
+                if key in self._producers:
+                    raise ValueError(
+                        f"Key '{key}' produced by both '{self._producers[key]}' and '{stage.name}'"
+                    )
+                self._producers[key] = stage.name
+
+    def validate(self, initial_keys: Iterable[str]) -> None:
+        """
+        Check that every required input can be satisfied and there is no cycle.
+
+        Args:
+            initial_keys: Keys present in the initial state
+
+        Raises:
+            ValueError: If the graph cannot run to completion
+        """
+        available = set(initial_keys)
+        remaining = list(self.stages)
+
+        while remaining:
+            ready = [s for s in remaining if all(k in available for k in s.inputs)]
+            if not ready:
+                blocked = {s.name: [k for k in s.inputs if k not in available] for s in remaining}
+                raise ValueError(f"Unsatisfiable or cyclic stage inputs: {blocked}")
+            for stage in ready:
+                available.update(stage.outputs)
+                remaining.remove(stage)
+
+    async def run(self,
+                  initial_state: Dict[str, Any],
+                  on_stage: Optional[StageCallback] = None) -> Dict[str, Any]:
+        """
+        Run all stages and return the final state.
+
+        The returned state contains every produced key plus a "_timings" dict
+        with the duration of each stage in milliseconds. Stages whose outputs
+        are all present in initial_state (precomputed elsewhere, e.g. by a
+        batched call) are skipped.
+
+        Args:
+            initial_state: Keys available before any stage runs
+            on_stage: Optional callback invoked on the event loop as each stage
+                finishes, with (stage name, its outputs, duration in ms);
+                it must not block
+
+        Returns:
+            The final state
+
+        Raises:
+            Exception: The first exception raised by any stage; all other
+                running stages are cancelled
+        """
+        self.validate(initial_state.keys())
+
+        state = dict(initial_state)
+        timings: Dict[str, float] = {}
+        pending = [s for s in self.stages if not all(k in state for k in s.outputs)]
+        running: Dict[asyncio.Task, Stage] = {}
+
+        try:
+            while pending or running:
+                for stage in [s for s in pending if all(k in state for k in s.inputs)]:
+                    pending.remove(stage)
+                    task = asyncio.ensure_future(self._run_stage(stage, dict(state)))
+                    running[task] = stage
+
+                done, _ = await asyncio.wait(running.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stage = running.pop(task)
+                    outputs, elapsed_ms = task.result()
+                    timings[stage.name] = elapsed_ms
+                    for key in stage.outputs:
+                        state[key] = outputs.get(key)
+                    if on_stage:
+                        on_stage(stage.name, {key: state[key] for key in stage.outputs}, elapsed_ms)
+        finally:
+            for task in running:
+                task.cancel()
+
+        state["_timings"] = timings
+        return state
+
+    async def _run_stage(self, stage: Stage, snapshot: Dict[str, Any]) -> tuple:
+        """Run one stage and measure its duration."""
+        started = time.perf_counter()
+        outputs = await stage.func(snapshot) or {}
+        return outputs, round((time.perf_counter() - started) * 1000, 2)
+
+    def critical_path(self, timings: Optional[Dict[str, float]] = None) -> List[str]:
+        """
+        Get the longest dependency chain through the graph.
+
+        Args:
+            timings: Optional per-stage durations used as weights (defaults to 1)
+
+        Returns:
+            Stage names along the critical path, in execution order
+        """
+        by_name = {s.name: s for s in self.stages}
+        cost: Dict[str, float] = {}
+        prev: Dict[str, Optional[str]] = {}
+
+        def visit(name: str) -> float:
+            if name in cost:
+                return cost[name]
+            stage = by_name[name]
+            best, best_dep = 0.0, None
+            for key in stage.inputs:
+                dep = self._producers.get(key)
+                if dep and (visit(dep) > best or best_dep is None):
+                    best, best_dep = cost[dep], dep
+            weight = timings.get(name, 0.0) if timings else 1.0
+            cost[name] = best + weight
+            prev[name] = best_dep
+            return cost[name]
+
+        for name in by_name:
+            visit(name)
+
+        if not cost:
+            return []
+
+        node: Optional[str] = max(cost, key=cost.get)
+        path = []
+        while node:
+            path.append(node)
+            node = prev[node]
+        return list(reversed(path))
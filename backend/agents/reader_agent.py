@@ -1,10 +1,12 @@
 """
 Reader Agent - Đọc và parse email content.
 """
-import sys
 from typing import Dict, Any, Optional
 from .base_agent import BaseAgent
 from tools.email_parser import EmailParser
+from utils.logger import get_logger
+
+log = get_logger(__name__)
 
 
 class ReaderAgent(BaseAgent):
@@ -15,6 +17,7 @@ class ReaderAgent(BaseAgent):
     - Parse email structure (sender, subject, body, date)
     - Extract metadata (links, phone numbers, attachments)
     - Clean and normalize text
+    - Strip quoted history, signatures and boilerplate before the AI agents see the body
     """
     
     def __init__(self):
@@ -22,7 +25,8 @@ class ReaderAgent(BaseAgent):
         super().__init__(name="Reader Agent")
         
         # Register tools
-        self.register_tool(EmailParser())
+        self.email_parser = EmailParser()
+        self.register_tool(self.email_parser)
     
     def process(self, data: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
@@ -56,7 +60,7 @@ class ReaderAgent(BaseAgent):
             }
             
         except Exception as e:
-            print(f"Error in Reader Agent: {str(e)}", file=sys.stderr)
+            log.error("agent.failed", agent=self.name, error=str(e))
             return {
                 "agent": self.name,
                 "success": False,
@@ -1,13 +1,78 @@
 """
 Reply Agent - Tạo gợi ý email phản hồi.
 """
-import sys
 import json
 import os
-from typing import Dict, Any, Optional
+from typing import AsyncIterator, Dict, Any, Optional, Tuple
 from .base_agent import BaseAgent
 from utils.openai_client import OpenAIClient
 from utils.errors import OpenAIAPIError
+from utils.partial_json import PartialJSONObjectParser
+from utils.tokens import fit_to_budget, agent_budget
+from utils.prompts import PromptTemplate, PromptRegistry
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+REPLY_SYSTEM_TEMPLATE = """
+You are a professional email assistant that writes ACTIONABLE and SPECIFIC email replies.
+
+IMPORTANT RULES:
+1. DO NOT write generic responses like "I'll review and get back to you"
+2. DO provide SPECIFIC answers, solutions, or next steps
+3. Address the actual content and questions in the email
+4. Be professional but natural in Vietnamese context
+5. Match the tone given with the email
+6. Take the email category into account
+
+Generate 3 versions of the reply:
+1. Brief (2-3 sentences) - Quick but specific response
+2. Standard (4-5 sentences) - Professional with details
+3. Detailed (6-8 sentences) - Comprehensive with reasoning
+
+Your response MUST be a valid JSON object:
+{{
+    "brief": "Specific brief reply addressing the email content",
+    "standard": "Standard reply with actual answers/solutions",
+    "detailed": "Detailed reply with full context and reasoning",
+    "subject_reply": "Re: suggested subject"
+}}
+
+EXAMPLES OF GOOD VS BAD:
+❌ BAD: "Cảm ơn email. Tôi sẽ xem xét và phản hồi."
+✅ GOOD: "Về đề xuất ngân sách Q4, tôi đồng ý với số liệu dự kiến 500 triệu cho marketing. Tôi sẽ ký duyệt trong hôm nay."
+
+❌ BAD: "Nhận được email của bạn. Sẽ liên hệ lại sớm."
+✅ GOOD: "Mình rảnh thứ 7 chiều này! Hẹn 3h tại Highlands Coffee The Garden nhé. Mình sẽ book bàn trước."
+
+Write replies in Vietnamese when the original email is in Vietnamese.
+Do not include any text before or after the JSON.
+
+INSTRUCTIONS:
+- Read the email carefully
+- Address specific questions or requests
+- Provide concrete answers or next steps
+- If approvals needed: state your decision
+- If meetings requested: suggest specific time
+- If questions asked: provide actual answers
+- Match the language of the original email (Vietnamese/English)
+"""
+
+REPLY_PROMPT_TEMPLATE = """
+Generate a SPECIFIC and ACTIONABLE email reply for this email:
+
+Original Subject: {subject}
+From: {sender_name} <{sender_email}>
+Category: {category}
+Tone to match: {tone}
+
+Email Summary: {summary}
+
+Full Original Email Content:
+{body}
+
+Action Items Identified: {action_items}
+"""
 
 
 class ReplyAgent(BaseAgent):
@@ -20,6 +85,18 @@ class ReplyAgent(BaseAgent):
     - Tạo nhiều phiên bản reply (formal, casual, brief)
     """
     
+    # Reply fields forwarded while streaming, in the order the prompt asks for them
+    STREAMED_FIELDS = ("brief", "standard", "detailed", "subject_reply")
+    
+    # Structured output schema (OpenAI strict json_schema / Gemini response_schema)
+    RESPONSE_SCHEMA = {
+        "title": "reply",
+        "type": "object",
+        "properties": {field: {"type": "string"} for field in STREAMED_FIELDS},
+        "required": list(STREAMED_FIELDS),
+        "additionalProperties": False
+    }
+    
     def __init__(self):
         """Initialize the Reply Agent."""
         super().__init__(name="Reply Agent")
@@ -27,6 +104,14 @@ class ReplyAgent(BaseAgent):
         # Initialize OpenAI client
         self.openai_client = OpenAIClient()
         
+        # Token budget for the original email body in the prompt
+        self.body_token_budget = agent_budget("reply")
+        
+        # Compile the instructions once; tone and category go in the per-email suffix
+        self.template = PromptRegistry.get_instance().register(
+            PromptTemplate("reply", REPLY_SYSTEM_TEMPLATE, REPLY_PROMPT_TEMPLATE)
+        )
+        
         # Load tone templates
         self._load_templates()
     
@@ -41,7 +126,7 @@ class ReplyAgent(BaseAgent):
             with open(templates_path, 'r') as f:
                 self.templates = json.load(f)
         except Exception as e:
-            print(f"Error loading templates: {str(e)}", file=sys.stderr)
+            log.error("config.load_failed", config="tone_templates", error=str(e))
             self.templates = {}
     
     def process(self, data: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
@@ -56,109 +141,151 @@ class ReplyAgent(BaseAgent):
             Dictionary containing suggested replies
         """
         try:
-            parsed_email = data.get("parsed_email", data)
-            
-            # Extract context
-            category = context.get("category") if context else "Personal"
-            tone = context.get("tone") if context else "neutral"
-            summary = context.get("summary") if context else ""
-            action_items = context.get("action_items") if context else []
-            
-            # ALWAYS generate reply for all emails (not just when needs_reply)
-            # This allows users to have suggested replies ready for any email
-            
-            # Generate reply using OpenAI
-            system_instruction = f"""
-You are a professional email assistant that writes ACTIONABLE and SPECIFIC email replies.
-
-IMPORTANT RULES:
-1. DO NOT write generic responses like "I'll review and get back to you"
-2. DO provide SPECIFIC answers, solutions, or next steps
-3. Address the actual content and questions in the email
-4. Be professional but natural in Vietnamese context
-5. Match the tone: {tone}
-6. Category: {category}
-
-Generate 3 versions of the reply:
-1. Brief (2-3 sentences) - Quick but specific response
-2. Standard (4-5 sentences) - Professional with details
-3. Detailed (6-8 sentences) - Comprehensive with reasoning
-
-Your response MUST be a valid JSON object:
-{{
-    "brief": "Specific brief reply addressing the email content",
-    "standard": "Standard reply with actual answers/solutions",
-    "detailed": "Detailed reply with full context and reasoning",
-    "subject_reply": "Re: suggested subject"
-}}
-
-EXAMPLES OF GOOD VS BAD:
-❌ BAD: "Cảm ơn email. Tôi sẽ xem xét và phản hồi."
-✅ GOOD: "Về đề xuất ngân sách Q4, tôi đồng ý với số liệu dự kiến 500 triệu cho marketing. Tôi sẽ ký duyệt trong hôm nay."
-
-❌ BAD: "Nhận được email của bạn. Sẽ liên hệ lại sớm."
-✅ GOOD: "Mình rảnh thứ 7 chiều này! Hẹn 3h tại Highlands Coffee The Garden nhé. Mình sẽ book bàn trước."
-
-Write replies in Vietnamese when the original email is in Vietnamese.
-Do not include any text before or after the JSON.
-"""
-            
-            prompt = f"""
-Generate a SPECIFIC and ACTIONABLE email reply for this email:
-
-Original Subject: {parsed_email.get('subject', 'No subject')}
-From: {parsed_email.get('sender', {}).get('name', 'Unknown')} <{parsed_email.get('sender', {}).get('email', '')}>
-
-Email Summary: {summary}
-
-Full Original Email Content:
-{parsed_email.get('body', '')[:800]}
-
-Action Items Identified: {', '.join(action_items) if action_items else 'None'}
-
-INSTRUCTIONS:
-- Read the email carefully
-- Address specific questions or requests
-- Provide concrete answers or next steps
-- If approvals needed: state your decision
-- If meetings requested: suggest specific time
-- If questions asked: provide actual answers
-- Match the language of the original email (Vietnamese/English)
-"""
+            system_instruction, prompt = self._build_prompt(data, context)
             
             # Get reply from OpenAI
             response = self.openai_client.generate_text(
                 prompt=prompt,
                 system_instruction=system_instruction,
-                temperature=0.7
+                temperature=0.7,
+                cache_namespace="reply",
+                response_schema=self.RESPONSE_SCHEMA,
+                importance_level=context.get("importance_level") if context else None
             )
             
-            # Parse JSON response
-            reply_data = self.openai_client.parse_json_response(
-                response,
-                required_fields=["brief", "standard", "detailed", "subject_reply"]
+            return self._build_result(response)
+            
+        except OpenAIAPIError:
+            raise
+        except Exception as e:
+            log.error("agent.failed", agent=self.name, error=str(e))
+            # Fallback to template-based reply
+            return self._fallback_reply(data, context)
+    
+    async def aprocess(self, data: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Generate suggested reply for the email without blocking the event loop.
+        
+        Args:
+            data: Parsed email data
+            context: Context including category, tone, summary, action_items
+            
+        Returns:
+            Dictionary containing suggested replies
+        """
+        try:
+            system_instruction, prompt = self._build_prompt(data, context)
+            
+            response = await self.openai_client.agenerate_text(
+                prompt=prompt,
+                system_instruction=system_instruction,
+                temperature=0.7,
+                cache_namespace="reply",
+                response_schema=self.RESPONSE_SCHEMA,
+                importance_level=context.get("importance_level") if context else None
             )
             
-            return {
-                "agent": self.name,
-                "success": True,
-                "needs_reply": True,
-                "suggested_reply": {
-                    "brief": reply_data["brief"],
-                    "standard": reply_data["standard"],
-                    "detailed": reply_data["detailed"],
-                    "subject": reply_data["subject_reply"]
-                },
-                "tools_used": ["OpenAI"]
-            }
+            return self._build_result(response)
             
         except OpenAIAPIError:
             raise
         except Exception as e:
-            print(f"Error in Reply Agent: {str(e)}", file=sys.stderr)
-            # Fallback to template-based reply
+            log.error("agent.failed", agent=self.name, error=str(e))
             return self._fallback_reply(data, context)
     
+    async def astream(self, data: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Generate suggested replies, yielding each version as it is written.
+        
+        Args:
+            data: Parsed email data
+            context: Context including category, tone, summary, action_items
+            
+        Yields:
+            {"event": "delta", "field": ..., "text": ...} for new text of a
+            reply version, {"event": "field", "field": ..., "value": ...} when
+            a version is complete, and finally {"event": "done", ...} with
+            the same result process() would return
+        """
+        system_instruction, prompt = self._build_prompt(data, context)
+        parser = PartialJSONObjectParser()
+        chunks = []
+        
+        try:
+            async for chunk in self.openai_client.astream_text(
+                prompt=prompt,
+                system_instruction=system_instruction,
+                temperature=0.7,
+                cache_namespace="reply",
+                response_schema=self.RESPONSE_SCHEMA,
+                importance_level=context.get("importance_level") if context else None
+            ):
+                chunks.append(chunk)
+                for event in parser.feed(chunk):
+                    if event["field"] in self.STREAMED_FIELDS:
+                        yield {"event": event.pop("type"), **event}
+            
+            result = self._build_result(''.join(chunks))
+        except OpenAIAPIError:
+            raise
+        except Exception as e:
+            log.error("agent.failed", agent=self.name, error=str(e))
+            result = self._fallback_reply(data, context)
+        
+        yield {"event": "done", **result}
+    
+    def _build_prompt(self, data: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
+        """
+        Build the system instruction and prompt for reply generation.
+        
+        Returns:
+            Tuple of (system_instruction, prompt)
+        """
+        parsed_email = data.get("parsed_email", data)
+        
+        # Extract context
+        category = context.get("category") if context else "Personal"
+        tone = context.get("tone") if context else "neutral"
+        summary = context.get("summary") if context else ""
+        action_items = context.get("action_items") if context else []
+        
+        # ALWAYS generate reply for all emails (not just when needs_reply)
+        # This allows users to have suggested replies ready for any email
+        prompt = self.template.render(
+            subject=parsed_email.get('subject', 'No subject'),
+            sender_name=parsed_email.get('sender', {}).get('name', 'Unknown'),
+            sender_email=parsed_email.get('sender', {}).get('email', ''),
+            category=category,
+            tone=tone,
+            summary=summary,
+            body=fit_to_budget(parsed_email.get('body', ''), self.body_token_budget),
+            action_items=', '.join(action_items) if action_items else 'None'
+        )
+        return self.template.system, prompt
+    
+    def _build_result(self, response: str) -> Dict[str, Any]:
+        """
+        Parse the AI response into a reply result.
+        """
+        reply_data = self.openai_client.parse_json_response(
+            response,
+            required_fields=["brief", "standard", "detailed", "subject_reply"],
+            agent="reply"
+        )
+        
+        return {
+            "agent": self.name,
+            "success": True,
+            "needs_reply": True,
+            "suggested_reply": {
+                "brief": reply_data["brief"],
+                "standard": reply_data["standard"],
+                "detailed": reply_data["detailed"],
+                "subject": reply_data["subject_reply"]
+            },
+            "tools_used": ["OpenAI"]
+        }
+    
     def _fallback_reply(self, data: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
         """
         Fallback reply using templates - Creates SPECIFIC replies based on category.
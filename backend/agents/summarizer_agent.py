@@ -1,11 +1,42 @@
 """
 Summarizer Agent - Tóm tắt nội dung email.
 """
-import sys
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 from .base_agent import BaseAgent
 from utils.openai_client import OpenAIClient
 from utils.errors import OpenAIAPIError
+from utils.near_duplicate import NearDuplicateIndex
+from utils.tokens import fit_to_budget, agent_budget
+from utils.prompts import PromptTemplate, PromptRegistry
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+SUMMARIZE_SYSTEM_TEMPLATE = """
+You are an expert email summarizer.
+Create a concise summary of the email in 1-2 sentences.
+Extract key points and action items if any.
+
+IMPORTANT: Your response MUST be a valid JSON object with these exact fields:
+{{
+    "summary": "1-2 sentence summary",
+    "key_points": ["point 1", "point 2", ...],
+    "action_items": ["action 1", "action 2", ...] (or empty array if none)
+}}
+
+Do not include any text before or after the JSON.
+"""
+
+SUMMARIZE_PROMPT_TEMPLATE = """
+Summarize this email:
+
+Subject: {subject}
+From: {sender}
+Category: {category}
+
+Body:
+{body}
+"""
 
 
 class SummarizerAgent(BaseAgent):
@@ -18,12 +49,33 @@ class SummarizerAgent(BaseAgent):
     - Highlight action items nếu có
     """
     
+    # Structured output schema (OpenAI strict json_schema / Gemini response_schema)
+    RESPONSE_SCHEMA = {
+        "title": "summary",
+        "type": "object",
+        "properties": {
+            "summary": {"type": "string"},
+            "key_points": {"type": "array", "items": {"type": "string"}},
+            "action_items": {"type": "array", "items": {"type": "string"}}
+        },
+        "required": ["summary", "key_points", "action_items"],
+        "additionalProperties": False
+    }
+    
     def __init__(self):
         """Initialize the Summarizer Agent."""
         super().__init__(name="Summarizer Agent")
         
         # Initialize OpenAI client
         self.openai_client = OpenAIClient()
+        
+        # Token budget for the email body in the prompt
+        self.body_token_budget = agent_budget("summarizer")
+        
+        # Compile the instructions once; only the email varies per call
+        self.template = PromptRegistry.get_instance().register(
+            PromptTemplate("summarizer", SUMMARIZE_SYSTEM_TEMPLATE, SUMMARIZE_PROMPT_TEMPLATE)
+        )
     
     def process(self, data: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
@@ -37,65 +89,132 @@ class SummarizerAgent(BaseAgent):
             Dictionary containing summary
         """
         try:
-            parsed_email = data.get("parsed_email", data)
-            category = context.get("category") if context else None
+            reused = self._reuse_near_duplicate(data, context)
+            if reused:
+                return reused
             
-            # Create summarization prompt
-            system_instruction = """
-            You are an expert email summarizer.
-            Create a concise summary of the email in 1-2 sentences.
-            Extract key points and action items if any.
+            system_instruction, prompt = self._build_prompt(data, context)
             
-            IMPORTANT: Your response MUST be a valid JSON object with these exact fields:
-            {
-                "summary": "1-2 sentence summary",
-                "key_points": ["point 1", "point 2", ...],
-                "action_items": ["action 1", "action 2", ...] (or empty array if none)
-            }
+            # Get summary from OpenAI
+            response = self.openai_client.generate_text(
+                prompt=prompt,
+                system_instruction=system_instruction,
+                temperature=0.5,
+                cache_namespace="summarizer",
+                response_schema=self.RESPONSE_SCHEMA
+            )
             
-            Do not include any text before or after the JSON.
-            """
+            return self._build_result(response)
             
-            prompt = f"""
-            Summarize this email:
+        except OpenAIAPIError:
+            raise
+        except Exception as e:
+            log.error("agent.failed", agent=self.name, error=str(e))
+            # Fallback to simple summary
+            return self._fallback_summary(data)
+    
+    async def aprocess(self, data: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Create a summary of the email without blocking the event loop.
+        
+        Args:
+            data: Parsed email data
+            context: Optional context information (may include category)
             
-            Subject: {parsed_email.get('subject', 'No subject')}
-            From: {parsed_email.get('sender', {}).get('name', 'Unknown')}
-            Category: {category or 'Unknown'}
+        Returns:
+            Dictionary containing summary
+        """
+        try:
+            reused = self._reuse_near_duplicate(data, context)
+            if reused:
+                return reused
             
-            Body:
-            {parsed_email.get('body', '')}
-            """
+            system_instruction, prompt = self._build_prompt(data, context)
             
-            # Get summary from OpenAI
-            response = self.openai_client.generate_text(
+            response = await self.openai_client.agenerate_text(
                 prompt=prompt,
                 system_instruction=system_instruction,
-                temperature=0.5
-            )
-            
-            # Parse JSON response
-            summary_data = self.openai_client.parse_json_response(
-                response,
-                required_fields=["summary", "key_points", "action_items"]
+                temperature=0.5,
+                cache_namespace="summarizer",
+                response_schema=self.RESPONSE_SCHEMA
             )
             
-            return {
-                "agent": self.name,
-                "success": True,
-                "summary": summary_data["summary"],
-                "key_points": summary_data["key_points"],
-                "action_items": summary_data["action_items"],
-                "tools_used": ["OpenAI"]
-            }
+            return self._build_result(response)
             
         except OpenAIAPIError:
             raise
         except Exception as e:
-            print(f"Error in Summarizer Agent: {str(e)}", file=sys.stderr)
-            # Fallback to simple summary
+            log.error("agent.failed", agent=self.name, error=str(e))
             return self._fallback_summary(data)
     
+    def _reuse_near_duplicate(self, data: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Reuse the summary of a near-duplicate email, skipping the AI call.
+        
+        Summaries can contain personal details, so only emails of the same
+        user (context["user_id"]) are considered.
+        
+        Returns:
+            Summary result, or None if no close enough match exists
+        """
+        user_id = context.get("user_id") if context else None
+        if not user_id:
+            return None
+        
+        parsed_email = data.get("parsed_email", data)
+        index = NearDuplicateIndex.get_instance()
+        match = index.find(parsed_email.get("fingerprint"), index.summary_threshold, "summarization", user_id=user_id)
+        if not match:
+            return None
+        
+        summarization = match["summarization"]
+        return {
+            "agent": self.name,
+            "success": True,
+            "summary": summarization["summary"],
+            "key_points": summarization.get("key_points", []),
+            "action_items": summarization.get("action_items", []),
+            "reused_from": match["email_id"],
+            "tools_used": ["NearDuplicateIndex"]
+        }
+    
+    def _build_prompt(self, data: Dict[str, Any], context: Optional[Dict[str, Any]] = None) -> Tuple[str, str]:
+        """
+        Build the system instruction and prompt for summarization.
+        
+        Returns:
+            Tuple of (system_instruction, prompt)
+        """
+        parsed_email = data.get("parsed_email", data)
+        category = context.get("category") if context else None
+        
+        prompt = self.template.render(
+            subject=parsed_email.get('subject', 'No subject'),
+            sender=parsed_email.get('sender', {}).get('name', 'Unknown'),
+            category=category or 'Unknown',
+            body=fit_to_budget(parsed_email.get('body', ''), self.body_token_budget)
+        )
+        return self.template.system, prompt
+    
+    def _build_result(self, response: str) -> Dict[str, Any]:
+        """
+        Parse the AI response into a summary result.
+        """
+        summary_data = self.openai_client.parse_json_response(
+            response,
+            required_fields=["summary", "key_points", "action_items"],
+            agent="summarizer"
+        )
+        
+        return {
+            "agent": self.name,
+            "success": True,
+            "summary": summary_data["summary"],
+            "key_points": summary_data["key_points"],
+            "action_items": summary_data["action_items"],
+            "tools_used": ["OpenAI"]
+        }
+    
     def _fallback_summary(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Fallback summary using simple text truncation.
@@ -1,18 +1,42 @@
 """
 AI Email Assistant Flask Application.
 """
+import time
+# Startup milestones (utils.startup) are measured from here
+BOOT_STARTED = time.perf_counter()
+
 import os
-import sys
-from flask import Flask, request, jsonify
+import json
+import logging
+import concurrent.futures
+from flask import Flask, request, jsonify, Response, g, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 from utils.errors import APIError, OpenAIAPIError, EmailProcessingError
 from utils.db import MongoDB
 from utils.json_encoder import MongoJSONEncoder
 from utils.rate_limiter import init_limiter
+from utils.llm_cache import LLMCache
+from utils.near_duplicate import NearDuplicateIndex
+from utils.job_queue import get_job_queue, JobWorkerPool
+from utils.async_runner import submit, iterate_sync
+from utils.openai_client import OpenAIClient
+from utils.client_registry import ClientRegistry
+from utils.tokens import TokenUsage
+from utils.json_repair import JSONRepairStats
+from utils.prompts import PromptRegistry
+from utils.context_cache import GeminiContextCache
+from utils import startup
+from utils.logger import get_logger, new_request_id, set_request_id, reset_request_id
+from utils.logger import get_stats as get_logging_stats
 from agents.email_coordinator import EmailCoordinator
 from flask_limiter.errors import RateLimitExceeded
 
+startup.begin(BOOT_STARTED)
+startup.mark("imports")
+
+log = get_logger(__name__)
+
 # Load environment variables
 load_dotenv()
 
@@ -28,14 +52,91 @@ CORS(app, resources={
     r"/*": {
         "origins": [os.environ.get('FRONTEND_URL', 'http://localhost:3000')],
         "methods": ["GET", "POST", "DELETE"],
-        "allow_headers": ["Content-Type"]
+        "allow_headers": ["Content-Type", "X-Request-ID"],
+        "expose_headers": ["X-Request-ID"]
     }
 })
 
-# Initialize Email Coordinator and MongoDB
+# Probes logged at DEBUG so they do not drown out real traffic
+QUIET_ROUTES = {'/api/v1/health', '/api/v1/ready'}
+
+# Maximum number of emails accepted by the batch endpoint
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', '100'))
+
+# Page size of the email list: default and largest accepted limit
+EMAIL_PAGE_SIZE = int(os.environ.get('EMAIL_PAGE_SIZE', '50'))
+EMAIL_PAGE_MAX_SIZE = int(os.environ.get('EMAIL_PAGE_MAX_SIZE', '200'))
+
+# Maximum emails processed at once by the NDJSON streaming endpoint
+STREAM_CONCURRENCY = int(os.environ.get('STREAM_CONCURRENCY', '8'))
+
+# Initialize Email Coordinator and MongoDB (agents and the server connection
+# are created on first use)
 email_coordinator = EmailCoordinator()
 db = MongoDB.get_instance()
 
+# Initialize job queue; in-process workers drain it unless JOB_WORKERS=0
+# (run worker.py to scale workers out separately)
+job_queue = get_job_queue(db)
+job_workers = JobWorkerPool(job_queue, email_coordinator.handle_job)
+
+
+def _ensure_indexes():
+    """Create the email and job queue indexes."""
+    return all([db.ensure_indexes(), job_queue.ensure_indexes()])
+
+
+def _warm_up_ai():
+    """Create the agents (and so the provider clients), then open their connections."""
+    email_coordinator.load_agents()
+    ClientRegistry.get_instance().warm_up()
+
+
+def start_process_services():
+    """
+    Start this process's background work: job workers, index creation
+    (DB_ENSURE_INDEXES) and AI connection warm-up (LLM_WARMUP_ENABLED).
+    
+    Threads do not survive fork(), so under the prefork server
+    (gunicorn.conf.py) this runs in each worker after init_worker_process.
+    """
+    if job_workers.concurrency > 0:
+        job_workers.start()
+    
+    # Index creation runs in the background; with DB_ENSURE_INDEXES=off run migrate.py instead
+    if os.environ.get('DB_ENSURE_INDEXES', 'background').lower() == 'background':
+        startup.run_in_background("indexes", _ensure_indexes)
+    
+    if ClientRegistry.get_instance().warmup_enabled:
+        startup.run_in_background("ai_warmup", _warm_up_ai)
+
+
+def init_worker_process():
+    """
+    Re-initialize process-local state in a freshly forked worker: the
+    MongoDB client, AI provider clients and limiters, the response cache's
+    SQLite connections, rate limit storage and the agents holding clients.
+    """
+    MongoDB.reset_after_fork()
+    OpenAIClient.reset_after_fork()
+    LLMCache.reset_after_fork()
+    rate_limiter.reset_after_fork()
+    email_coordinator.reset_agents()
+    start_process_services()
+
+
+def stop_process_services():
+    """Let this worker's in-flight jobs finish before it exits (graceful reload/shutdown)."""
+    if job_workers.concurrency > 0:
+        job_workers.stop(timeout=float(os.environ.get('JOB_STOP_TIMEOUT', '25')))
+
+
+# The prefork server starts these in each worker instead of the master
+if os.environ.get('SERVER_PREFORK') != '1':
+    start_process_services()
+
+startup.mark("boot")
+
 
 # ============================================================================
 # ERROR HANDLERS
@@ -45,8 +146,7 @@ db = MongoDB.get_instance()
 def handle_exception(e):
     """Global exception handler for all routes."""
     import traceback
-    print(f"Unhandled error: {str(e)}", file=sys.stderr)
-    print(traceback.format_exc(), file=sys.stderr)
+    log.exception("http.unhandled_error", error_type=type(e).__name__)
     
     # In debug mode, return more detailed error information
     if app.debug:
@@ -83,10 +183,56 @@ def handle_api_error(e):
     }), e.status_code
 
 
+# ============================================================================
+# REQUEST LOGGING
+# ============================================================================
+
+@app.before_request
+def start_request_log():
+    """Tag the request's log lines with its X-Request-ID (or a new id)."""
+    g.request_started = time.perf_counter()
+    g.request_id = new_request_id(request.headers.get('X-Request-ID'))
+    g.request_id_token = set_request_id(g.request_id)
+
+
+@app.after_request
+def finish_request_log(response):
+    """
+    Return the request id and log one line per request. For streamed
+    responses ms is the time until the stream starts.
+    """
+    request_id = g.get('request_id')
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    route = request.url_rule.rule if request.url_rule else None
+    log.log(
+        logging.DEBUG if route in QUIET_ROUTES else logging.INFO,
+        "http.request",
+        method=request.method,
+        route=route,
+        status=response.status_code,
+        ms=round((time.perf_counter() - g.get('request_started', time.perf_counter())) * 1000, 2)
+    )
+    return response
+
+
+@app.teardown_request
+def end_request_log(exc):
+    """Clear the request id once the request (and any stream) is done."""
+    token = g.pop('request_id_token', None)
+    if token is not None:
+        reset_request_id(token)
+
+
 # ============================================================================
 # API ROUTES
 # ============================================================================
 
+def _sse(event, data):
+    """Encode one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, cls=MongoJSONEncoder, ensure_ascii=False)}\n\n"
+
+
 @app.route('/', methods=['GET'])
 def root():
     """Root endpoint - API information."""
@@ -97,12 +243,20 @@ def root():
         "description": "Multi-agent system for intelligent email processing",
         "endpoints": {
             "health": "/api/v1/health",
+            "ready": "/api/v1/ready",
             "process_email": "/api/v1/email/process (POST)",
+            "process_email_stream": "/api/v1/email/process/stream (POST, SSE)",
             "batch_process": "/api/v1/email/batch (POST)",
+            "stream_process": "/api/v1/email/stream (POST, NDJSON)",
+            "submit_job": "/api/v1/jobs (POST)",
+            "get_job": "/api/v1/jobs/<job_id> (GET)",
             "list_emails": "/api/v1/emails (GET)",
             "get_email": "/api/v1/emails/<email_id> (GET)",
             "delete_email": "/api/v1/emails/<email_id> (DELETE)",
-            "stats": "/api/v1/stats (GET)"
+            "get_reply": "/api/v1/emails/<email_id>/reply (GET)",
+            "stream_reply": "/api/v1/emails/<email_id>/reply/stream (GET, SSE)",
+            "stats": "/api/v1/stats (GET)",
+            "metrics": "/api/v1/metrics (GET)"
         }
     }), 200
 
@@ -110,26 +264,21 @@ def root():
 @app.route('/api/v1/health', methods=['GET'])
 @rate_limiter.limit_health_check
 def health_check():
-    """Health check endpoint to verify the API is running."""
+    """
+    Liveness check: the process is up and serving. Does not touch MongoDB or
+    create agents; use /api/v1/ready before routing traffic to a worker.
+    """
     try:
-        # Test MongoDB connection
-        db_status = "connected" if db.db is not None else "disconnected"
-        
-        # Test OpenAI client initialization
-        ai_status = "initialized" if email_coordinator.classifier_agent.openai_client is not None else "not initialized"
+        loaded = email_coordinator.loaded_agents()
         
         return jsonify({
             "status": "healthy",
             "message": "AI Email Assistant is running",
-            "database": db_status,
-            "ai_service": ai_status,
+            "database": "configured" if db.db is not None else "disconnected",
+            "ai_service": "initialized" if "classifier_agent" in loaded else "not initialized",
             "agents": {
                 "coordinator": email_coordinator.name,
-                "reader": email_coordinator.reader_agent.name,
-                "classifier": email_coordinator.classifier_agent.name,
-                "summarizer": email_coordinator.summarizer_agent.name,
-                "decision": email_coordinator.decision_agent.name,
-                "reply": email_coordinator.reply_agent.name
+                **{attr[:-len("_agent")]: name for attr, name in loaded.items()}
             }
         }), 200
     except Exception as e:
@@ -139,6 +288,34 @@ def health_check():
         }), 500
 
 
+@app.route('/api/v1/ready', methods=['GET'])
+@rate_limiter.limit_health_check
+def readiness_check():
+    """
+    Readiness check: MongoDB answers a ping and every agent (and so the AI
+    provider clients) can be created. The first call creates the agents.
+    """
+    checks = {"database": db.ping()}
+    if checks["database"] and startup.task_status("indexes") == "failed":
+        # MongoDB was down when the startup task ran
+        startup.run_in_background("indexes", _ensure_indexes)
+    try:
+        email_coordinator.load_agents()
+        checks["agents"] = True
+    except Exception as e:
+        log.error("startup.agents_failed", error=str(e))
+        checks["agents"] = False
+    
+    ready = all(checks.values())
+    if ready:
+        startup.mark("ready")
+    return jsonify({
+        "status": "ready" if ready else "not ready",
+        "checks": checks,
+        "indexes": startup.task_status("indexes")
+    }), 200 if ready else 503
+
+
 @app.route('/api/v1/email/process', methods=['POST'])
 @rate_limiter.limit_email_processing
 def process_email():
@@ -151,7 +328,8 @@ def process_email():
         "sender": "john@example.com",
         "subject": "Meeting tomorrow",
         "body": "Email body content...",
-        "received_date": "2025-10-19T10:00:00Z" (optional)
+        "received_date": "2025-10-19T10:00:00Z" (optional),
+        "mode": "pipeline" | "fused" (optional)
     }
     """
     try:
@@ -177,7 +355,11 @@ def process_email():
         }
         
         # Process email through coordinator
-        result = email_coordinator.process_email(email_data, user_id)
+        mode = data.get("mode")
+        if mode and mode not in EmailCoordinator.MODES:
+            return jsonify({"error": f"mode must be one of: {', '.join(EmailCoordinator.MODES)}", "status": "error"}), 400
+        
+        result = email_coordinator.process_email(email_data, user_id, mode=mode)
         
         if not result.get("success"):
             raise EmailProcessingError(result.get("error", "Failed to process email"))
@@ -199,19 +381,74 @@ def process_email():
             "status": "error"
         }), e.status_code
     except Exception as e:
-        print(f"Error processing email: {str(e)}", file=sys.stderr)
+        log.error("api.failed", operation="email.process", error=str(e))
         return jsonify({
             "error": "Failed to process email",
             "status": "error"
         }), 500
 
 
+@app.route('/api/v1/email/process/stream', methods=['POST'])
+@rate_limiter.limit_email_processing
+def process_email_stream():
+    """
+    Process a single email, streaming each stage result as Server-Sent Events.
+    
+    Accepts the same JSON as /api/v1/email/process. Events, in completion
+    order: parsed, category, summary, decision, reply, saved (each with
+    "stage" and "elapsed_ms"), then "result" with the full processing
+    result, or "error".
+    """
+    data = request.json
+    if not data:
+        return jsonify({"error": "No data provided", "status": "error"}), 400
+    
+    if not data.get('user_id'):
+        return jsonify({"error": "Missing required field: user_id", "status": "error"}), 400
+    
+    if not data.get('subject') and not data.get('body'):
+        return jsonify({"error": "Email must have either subject or body", "status": "error"}), 400
+    
+    mode = data.get("mode")
+    if mode and mode not in EmailCoordinator.MODES:
+        return jsonify({"error": f"mode must be one of: {', '.join(EmailCoordinator.MODES)}", "status": "error"}), 400
+    
+    user_id = data['user_id']
+    email_data = {
+        "sender": data.get("sender", "unknown@example.com"),
+        "subject": data.get("subject", ""),
+        "body": data.get("body", ""),
+        "received_date": data.get("received_date"),
+        "has_attachments": data.get("has_attachments", False)
+    }
+    
+    def generate():
+        try:
+            for event in iterate_sync(email_coordinator.astream_process_email(email_data, user_id, mode)):
+                name = event.pop("event")
+                yield _sse(name, event)
+        except OpenAIAPIError as e:
+            yield _sse("error", {"error": e.message})
+        except Exception as e:
+            log.error("api.failed", operation="email.process_stream", error=str(e))
+            yield _sse("error", {"error": "Failed to process email"})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.route('/api/v1/email/batch', methods=['POST'])
 @rate_limiter.limit_batch_processing
 def batch_process_emails():
     """
     Process multiple emails at once.
     
+    Emails are processed concurrently; results keep the input order and
+    include per-email elapsed_ms. At most BATCH_MAX_SIZE emails per request.
+    
     Expected JSON:
     {
         "user_id": "user123",
@@ -238,45 +475,213 @@ def batch_process_emails():
         if not isinstance(emails, list):
             return jsonify({"error": "emails must be an array", "status": "error"}), 400
         
-        # Process each email
-        results = []
-        for email_data in emails[:10]:  # Limit to 10 emails per batch
-            try:
-                result = email_coordinator.process_email(email_data, user_id)
-                results.append(result)
-            except Exception as e:
-                results.append({
-                    "success": False,
-                    "error": str(e),
-                    "email_subject": email_data.get("subject", "Unknown")
-                })
+        if len(emails) > BATCH_MAX_SIZE:
+            return jsonify({
+                "error": f"Too many emails: {len(emails)} (maximum {BATCH_MAX_SIZE} per batch)",
+                "status": "error"
+            }), 400
+        
+        if not all(isinstance(email_data, dict) for email_data in emails):
+            return jsonify({"error": "Each email must be an object", "status": "error"}), 400
+        
+        # Process emails concurrently; classification is batched into shared prompts
+        started = time.perf_counter()
+        results = email_coordinator.process_batch(emails, user_id)
         
         return jsonify({
             "status": "success",
             "total": len(results),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
             "processed": sum(1 for r in results if r.get("success")),
             "failed": sum(1 for r in results if not r.get("success")),
             "results": results
         }), 200
         
     except Exception as e:
-        print(f"Error in batch processing: {str(e)}", file=sys.stderr)
+        log.error("api.failed", operation="email.batch", error=str(e))
         return jsonify({
             "error": "Failed to process batch",
             "status": "error"
         }), 500
 
 
+@app.route('/api/v1/email/stream', methods=['POST'])
+@rate_limiter.limit_batch_processing
+def stream_process_emails():
+    """
+    Process newline-delimited JSON emails and stream results as they finish.
+    
+    Request body: one JSON email per line (same fields as /api/v1/email/process).
+    user_id comes from each line or from the user_id query parameter.
+    
+    Response: application/x-ndjson, one line per email in completion order,
+    each carrying the input line "index". At most STREAM_CONCURRENCY emails
+    are in progress, so memory stays constant regardless of upload size.
+    """
+    default_user_id = request.args.get('user_id')
+    mode = request.args.get('mode')
+    if mode and mode not in EmailCoordinator.MODES:
+        return jsonify({"error": f"mode must be one of: {', '.join(EmailCoordinator.MODES)}", "status": "error"}), 400
+    
+    def encode(line_result):
+        return json.dumps(line_result, cls=MongoJSONEncoder, ensure_ascii=False) + "\n"
+    
+    def finished(future, index, started):
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        return encode({
+            "index": index,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+            **result
+        })
+    
+    def generate():
+        in_flight = {}
+        
+        def drain(wait_for_all=False):
+            # Emit every result that is already done; block only while the
+            # window is full (or at end of input) so results go out as they finish
+            while in_flight:
+                done = [future for future in in_flight if future.done()]
+                if not done:
+                    if not wait_for_all and len(in_flight) < STREAM_CONCURRENCY:
+                        return
+                    done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    index, started = in_flight.pop(future)
+                    yield finished(future, index, started)
+        
+        for index, raw_line in enumerate(request.stream):
+            if not raw_line.strip():
+                continue
+            try:
+                data = json.loads(raw_line)
+                if not isinstance(data, dict):
+                    raise ValueError("line is not a JSON object")
+            except ValueError as e:
+                yield encode({"index": index, "success": False, "error": f"Invalid JSON: {str(e)}"})
+                continue
+            
+            user_id = data.get('user_id') or default_user_id
+            if not user_id:
+                yield encode({"index": index, "success": False, "error": "Missing required field: user_id"})
+                continue
+            
+            if not data.get('subject') and not data.get('body'):
+                yield encode({"index": index, "success": False, "error": "Email must have either subject or body"})
+                continue
+            
+            email_data = {
+                "sender": data.get("sender", "unknown@example.com"),
+                "subject": data.get("subject", ""),
+                "body": data.get("body", ""),
+                "received_date": data.get("received_date"),
+                "has_attachments": data.get("has_attachments", False)
+            }
+            future = submit(email_coordinator.aprocess_email(email_data, user_id, mode))
+            in_flight[future] = (index, time.perf_counter())
+            
+            yield from drain()
+        
+        yield from drain(wait_for_all=True)
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.route('/api/v1/jobs', methods=['POST'])
+@rate_limiter.limit_email_processing
+def submit_job():
+    """
+    Queue an email for asynchronous processing.
+    
+    Accepts the same JSON as /api/v1/email/process and returns immediately
+    with a job ID; poll /api/v1/jobs/<job_id> for the result.
+    """
+    try:
+        data = request.json
+        if not data:
+            return jsonify({"error": "No data provided", "status": "error"}), 400
+        
+        if not data.get('user_id'):
+            return jsonify({"error": "Missing required field: user_id", "status": "error"}), 400
+        
+        if not data.get('subject') and not data.get('body'):
+            return jsonify({"error": "Email must have either subject or body", "status": "error"}), 400
+        
+        mode = data.get("mode")
+        if mode and mode not in EmailCoordinator.MODES:
+            return jsonify({"error": f"mode must be one of: {', '.join(EmailCoordinator.MODES)}", "status": "error"}), 400
+        
+        job_id = job_queue.enqueue({
+            "user_id": data['user_id'],
+            "mode": mode,
+            "email_data": {
+                "sender": data.get("sender", "unknown@example.com"),
+                "subject": data.get("subject", ""),
+                "body": data.get("body", ""),
+                "received_date": data.get("received_date"),
+                "has_attachments": data.get("has_attachments", False)
+            }
+        })
+        
+        return jsonify({
+            "status": "success",
+            "job_id": job_id,
+            "job_status": "queued"
+        }), 202
+        
+    except Exception as e:
+        log.error("api.failed", operation="jobs.submit", error=str(e))
+        return jsonify({
+            "error": "Failed to submit job",
+            "status": "error"
+        }), 500
+
+
+@app.route('/api/v1/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get the status and result of a queued job."""
+    try:
+        user_id = request.args.get('user_id')
+        if not user_id:
+            return jsonify({"error": "Missing required parameter: user_id", "status": "error"}), 400
+        
+        job = job_queue.get(job_id)
+        if not job or job["user_id"] != user_id:
+            return jsonify({"error": "Job not found or access denied", "status": "error"}), 404
+        
+        return jsonify({
+            "status": "success",
+            "data": job
+        }), 200
+        
+    except Exception as e:
+        log.error("api.failed", operation="jobs.get", error=str(e))
+        return jsonify({
+            "error": "Failed to retrieve job",
+            "status": "error"
+        }), 500
+
+
 @app.route('/api/v1/emails', methods=['GET'])
 @rate_limiter.limit_email_list
 def get_emails():
     """
-    Get list of processed emails.
+    Get one page of processed emails, newest first.
     
     Query params:
     - user_id (required)
     - category (optional): filter by category
     - is_important (optional): true/false
+    - limit (optional): page size, 1 to EMAIL_PAGE_MAX_SIZE (default EMAIL_PAGE_SIZE)
+    - cursor (optional): next_cursor of the previous page
+    - fields (optional): comma-separated fields to return; by default
+      everything except body and suggested_reply (use GET /emails/<email_id>)
+    
+    "total" is the number of emails in this page; next_cursor is null on
+    the last page.
     """
     try:
         user_id = request.args.get('user_id')
@@ -290,17 +695,33 @@ def get_emails():
         if request.args.get('is_important'):
             filters['is_important'] = request.args.get('is_important').lower() == 'true'
         
+        try:
+            limit = int(request.args.get('limit', EMAIL_PAGE_SIZE))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= EMAIL_PAGE_MAX_SIZE:
+            return jsonify({
+                "error": f"limit must be between 1 and {EMAIL_PAGE_MAX_SIZE}",
+                "status": "error"
+            }), 400
+        fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+        
         # Get emails from database
-        emails = db.get_emails(user_id, filters)
+        try:
+            page = db.get_emails(user_id, filters, limit=limit,
+                                 cursor=request.args.get('cursor') or None, fields=fields or None)
+        except ValueError as e:
+            return jsonify({"error": str(e), "status": "error"}), 400
         
         return jsonify({
             "status": "success",
-            "total": len(emails),
-            "data": emails
+            "total": len(page["emails"]),
+            "data": page["emails"],
+            "next_cursor": page["next_cursor"]
         }), 200
         
     except Exception as e:
-        print(f"Error getting emails: {str(e)}", file=sys.stderr)
+        log.error("api.failed", operation="emails.list", error=str(e))
         return jsonify({
             "error": "Failed to retrieve emails",
             "status": "error"
@@ -309,13 +730,21 @@ def get_emails():
 
 @app.route('/api/v1/emails/<email_id>', methods=['GET'])
 def get_email(email_id):
-    """Get a specific email by ID."""
+    """
+    Get a specific email by ID.
+    
+    Query parameters:
+    - user_id: required
+    - include_stripped: "true" to also return the quoted history, signatures
+      and boilerplate removed from the body
+    """
     try:
         user_id = request.args.get('user_id')
         if not user_id:
             return jsonify({"error": "Missing required parameter: user_id", "status": "error"}), 400
         
-        email = db.get_email_by_id(email_id, user_id)
+        include_stripped = request.args.get('include_stripped', 'false').lower() == 'true'
+        email = db.get_email_by_id(email_id, user_id, include_stripped=include_stripped)
         if not email:
             return jsonify({
                 "error": "Email not found or access denied",
@@ -328,7 +757,7 @@ def get_email(email_id):
         }), 200
         
     except Exception as e:
-        print(f"Error getting email: {str(e)}", file=sys.stderr)
+        log.error("api.failed", operation="emails.get", error=str(e))
         return jsonify({
             "error": "Failed to retrieve email",
             "status": "error"
@@ -356,13 +785,95 @@ def delete_email(email_id):
         }), 200
         
     except Exception as e:
-        print(f"Error deleting email: {str(e)}", file=sys.stderr)
+        log.error("api.failed", operation="emails.delete", error=str(e))
         return jsonify({
             "error": "Failed to delete email",
             "status": "error"
         }), 500
 
 
+@app.route('/api/v1/emails/<email_id>/reply', methods=['GET'])
+@rate_limiter.limit_reply_generation
+def get_email_reply(email_id):
+    """
+    Get the suggested reply of an email.
+    
+    Replies of lower-importance emails are not generated during processing
+    ("reply_pending": true); the first request generates and stores them.
+    """
+    try:
+        user_id = request.args.get('user_id')
+        if not user_id:
+            return jsonify({"error": "Missing required parameter: user_id", "status": "error"}), 400
+        
+        result = email_coordinator.generate_reply(email_id, user_id)
+        if not result:
+            return jsonify({
+                "error": "Email not found or access denied",
+                "status": "error"
+            }), 404
+        
+        return jsonify({
+            "status": "success",
+            "data": result
+        }), 200
+        
+    except OpenAIAPIError as e:
+        return jsonify({
+            "error": e.message,
+            "status": "error"
+        }), e.status_code
+    except Exception as e:
+        log.error("api.failed", operation="emails.reply", error=str(e))
+        return jsonify({
+            "error": "Failed to generate reply",
+            "status": "error"
+        }), 500
+
+
+@app.route('/api/v1/emails/<email_id>/reply/stream', methods=['GET'])
+@rate_limiter.limit_reply_generation
+def stream_email_reply(email_id):
+    """
+    Stream the suggested reply of an email as Server-Sent Events.
+    
+    Events:
+    - delta: {"field", "text"} new text of a reply version
+      ("brief", "standard", "detailed" or "subject_reply")
+    - field: {"field", "value"} a reply version is complete
+    - done: {"email_id", "suggested_reply", "cached"} final reply, stored
+      in the email document
+    - error: {"error"} generation failed
+    """
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Missing required parameter: user_id", "status": "error"}), 400
+    
+    email = db.get_email_by_id(email_id, user_id)
+    if not email:
+        return jsonify({
+            "error": "Email not found or access denied",
+            "status": "error"
+        }), 404
+    
+    def generate():
+        try:
+            for event in iterate_sync(email_coordinator.astream_reply(email)):
+                name = event.pop("event")
+                yield _sse(name, event)
+        except OpenAIAPIError as e:
+            yield _sse("error", {"error": e.message})
+        except Exception as e:
+            log.error("api.failed", operation="emails.reply_stream", error=str(e))
+            yield _sse("error", {"error": "Failed to generate reply"})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.route('/api/v1/stats', methods=['GET'])
 def get_stats():
     """Get email statistics for a user."""
@@ -379,13 +890,59 @@ def get_stats():
         }), 200
         
     except Exception as e:
-        print(f"Error getting stats: {str(e)}", file=sys.stderr)
+        log.error("api.failed", operation="emails.stats", error=str(e))
         return jsonify({
             "error": "Failed to retrieve statistics",
             "status": "error"
         }), 500
 
 
+@app.route('/api/v1/metrics', methods=['GET'])
+@rate_limiter.limit_health_check
+def get_metrics():
+    """
+    Get process-level performance metrics: AI response cache, near-duplicate
+    reuse, rule tier, email body reduction, AI provider retries/failovers/
+    circuit breakers, token usage per agent (including provider-cached
+    prompt tokens), how many JSON responses parsed cleanly, were repaired or
+    were lost, the compiled prompt prefixes, the observed per-model latency
+    and error rates used for model routing, the shared AI client pools and
+    startup milestones. Agent metrics are null until the agent is created.
+    """
+    try:
+        loaded = email_coordinator.loaded_agents()
+        return jsonify({
+            "status": "success",
+            "data": {
+                "llm_cache": LLMCache.get_instance().get_stats(),
+                "near_duplicates": NearDuplicateIndex.get_instance().get_stats(),
+                "rule_classifier": (email_coordinator.classifier_agent.rule_classifier.get_stats()
+                                    if "classifier_agent" in loaded else None),
+                "email_reducer": (email_coordinator.reader_agent.email_parser.get_stats()
+                                  if "reader_agent" in loaded else None),
+                "ai_providers": OpenAIClient.get_resilience_stats(),
+                "model_routing": OpenAIClient.get_routing_stats(),
+                "ai_clients": OpenAIClient.get_client_stats(),
+                "startup": startup.get_stats(),
+                "logging": get_logging_stats(),
+                "token_usage": TokenUsage.get_instance().get_stats(),
+                "json_responses": JSONRepairStats.get_instance().get_stats(),
+                "prompts": {
+                    "templates": PromptRegistry.get_instance().get_stats(),
+                    "gemini_context_cache": GeminiContextCache.get_instance().get_stats()
+                }
+            }
+        }), 200
+        
+    except Exception as e:
+        log.error("api.failed", operation="metrics", error=str(e))
+        return jsonify({
+            "error": "Failed to retrieve metrics",
+            "status": "error"
+        }), 500
+
+
 if __name__ == '__main__':
+    # Development server; in production use: gunicorn -c gunicorn.conf.py app:app
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    app.run(host='0.0.0.0', port=port, debug=os.environ.get('FLASK_DEBUG', '0') == '1')
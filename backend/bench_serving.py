@@ -0,0 +1,74 @@
+"""
+Serving throughput benchmark for the AI Email Assistant.
+
+Sends requests from concurrent keep-alive connections to a running server
+for a fixed time and reports throughput and latency percentiles. Start the
+server to compare first, with rate limiting off, e.g.:
+
+    RATE_LIMIT_ENABLED=false JOB_WORKERS=0 python run.py
+    RATE_LIMIT_ENABLED=false JOB_WORKERS=0 gunicorn -c gunicorn.conf.py app:app
+
+then run:
+
+    python bench_serving.py [url] [concurrency] [seconds]
+
+Defaults: http://127.0.0.1:5000/api/v1/health, 32 connections, 10 seconds.
+"""
+import sys
+import time
+import threading
+import statistics
+import http.client
+from urllib.parse import urlparse
+
+
+def worker(url, deadline, latencies, errors, lock):
+    """Send requests on one keep-alive connection until the deadline."""
+    parsed = urlparse(url)
+    path = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=30)
+    local_latencies = []
+    local_errors = 0
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                local_errors += 1
+            local_latencies.append(time.perf_counter() - started)
+        except Exception:
+            local_errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=30)
+    conn.close()
+    with lock:
+        latencies.extend(local_latencies)
+        errors.append(local_errors)
+
+
+if __name__ == '__main__':
+    url = sys.argv[1] if len(sys.argv) > 1 else "http://127.0.0.1:5000/api/v1/health"
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    latencies, errors, lock = [], [], threading.Lock()
+    deadline = time.perf_counter() + seconds
+    threads = [
+        threading.Thread(target=worker, args=(url, deadline, latencies, errors, lock))
+        for _ in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    count = len(latencies)
+    print(f"⏱️  {url} with {concurrency} connections for {seconds:.0f}s")
+    print(f"   requests     {count} ({sum(errors)} errors)")
+    print(f"   throughput   {count / seconds:.1f} req/s")
+    if count:
+        print(f"   latency p50  {statistics.median(latencies) * 1000:.1f} ms")
+        print(f"   latency p99  {latencies[int(count * 0.99) - 1 if count > 1 else 0] * 1000:.1f} ms")
@@ -0,0 +1,54 @@
+"""
+Startup benchmark for the AI Email Assistant.
+
+Boots the app in fresh interpreters and reports how long the imports, the
+module-level boot and the first readiness work (creating every agent) take,
+in milliseconds. Run it before and after changes that touch startup:
+
+    python bench_startup.py [runs]
+
+MongoDB does not need to be running: booting must not wait for it. Job
+workers and AI warm-up are disabled so only startup itself is measured.
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+PROBE = """
+import time
+started = time.perf_counter()
+import app
+from utils import startup
+boot_ms = (time.perf_counter() - started) * 1000
+agents_started = time.perf_counter()
+app.email_coordinator.load_agents()
+agents_ms = (time.perf_counter() - agents_started) * 1000
+marks = startup.get_stats()["marks_ms"]
+print(json.dumps({"imports": marks["imports"], "boot": boot_ms, "agents": agents_ms}))
+"""
+
+
+def run_once():
+    """Boot the app in a new interpreter and return its timings."""
+    env = dict(os.environ, JOB_WORKERS='0', LLM_WARMUP_ENABLED='false', DB_ENSURE_INDEXES='off')
+    output = subprocess.run(
+        [sys.executable, '-c', 'import json\n' + PROBE],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    samples = [run_once() for _ in range(runs)]
+
+    print(f"⏱️  Startup over {runs} runs (median / max, ms)")
+    for phase, label in (("imports", "imports"), ("boot", "import app"), ("agents", "create agents")):
+        values = [sample[phase] for sample in samples]
+        print(f"   {label:<14} {statistics.median(values):8.1f} / {max(values):8.1f}")
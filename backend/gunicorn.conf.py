@@ -0,0 +1,58 @@
+"""
+Production server configuration (prefork, one worker process per core).
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once in the master (preload_app) and forked into
+workers, which share its memory copy-on-write. Nothing fork-unsafe is
+opened at import: each worker re-initializes its MongoDB client, AI provider
+clients, rate limit storage and agents in post_fork, then starts its job
+workers and startup tasks.
+
+Graceful reload:
+- kill -HUP <master>: restart workers one by one with the current config;
+  in-flight requests get graceful_timeout to finish. With preload_app the
+  master keeps the already-imported code, so to deploy new code either set
+  GUNICORN_PRELOAD=false (HUP then reloads code too) or do a zero-downtime
+  binary upgrade: kill -USR2 <master>, then kill -QUIT <old master>.
+- kill -TERM <master>: graceful shutdown.
+
+Configuration (environment variables):
+- PORT: listen port (default 5000)
+- WEB_CONCURRENCY: worker processes (default: CPU count)
+- GUNICORN_THREADS: request threads per worker; AI calls and SSE/NDJSON
+  streams hold a thread while they wait (default 8)
+- GUNICORN_TIMEOUT: seconds before a silent worker is killed (default 120)
+- GUNICORN_GRACEFUL_TIMEOUT: seconds for in-flight work on reload/shutdown (default 30)
+- GUNICORN_MAX_REQUESTS: recycle a worker after this many requests, 0 = never (default 0)
+- GUNICORN_PRELOAD: import the app in the master before forking (default true)
+"""
+import os
+import multiprocessing
+
+# Tells app.py to leave background threads to the workers (see post_fork)
+os.environ['SERVER_PREFORK'] = '1'
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    """Give the new worker its own connections, then start its background work."""
+    import app
+    app.init_worker_process()
+
+
+def worker_exit(server, worker):
+    """Let the worker's running jobs finish before it exits."""
+    import app
+    app.stop_process_services()
@@ -0,0 +1,24 @@
+"""
+Database migrations for the AI Email Assistant.
+
+Creates the MongoDB indexes for emails, users and the job queue. The API
+does this in a background thread at startup unless DB_ENSURE_INDEXES=off;
+with it off, run this once per deploy instead:
+
+    python migrate.py
+"""
+import sys
+from dotenv import load_dotenv
+from utils.db import MongoDB
+from utils.job_queue import get_job_queue
+
+load_dotenv()
+
+if __name__ == '__main__':
+    db = MongoDB.get_instance()
+    if not db.ping():
+        print("❌ MongoDB is not reachable")
+        sys.exit(1)
+    ok = db.ensure_indexes()
+    ok = get_job_queue(db).ensure_indexes() and ok
+    sys.exit(0 if ok else 1)
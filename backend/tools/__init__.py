@@ -3,5 +3,6 @@ from .base_tool import BaseTool
 from .email_parser import EmailParser
 from .importance_scorer import ImportanceScorer
 from .tone_analyzer import ToneAnalyzer
+from .rule_classifier import RuleClassifier
 
-__all__ = ['BaseTool', 'EmailParser', 'ImportanceScorer', 'ToneAnalyzer']
+__all__ = ['BaseTool', 'EmailParser', 'ImportanceScorer', 'ToneAnalyzer', 'RuleClassifier']
@@ -1,15 +1,92 @@
 """
 Email parser tool for extracting structured information from email content.
 """
+import os
 import re
+import threading
 from email.utils import parseaddr
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 from .base_tool import BaseTool
+from utils.near_duplicate import compute_fingerprint
+from utils.tokens import count_tokens
+
+# Content reducer patterns (English and Vietnamese), compiled once at import
+
+# "On Mon, 20 Oct 2025 at 10:00, John <john@x.com> wrote:" / Gmail (vi) "Vào ... đã viết:"
+_QUOTE_HEADER_RE = re.compile(r'^\s*(?:On|Vào)\s.{0,300}?(?:wrote|đã viết)\s*:\s*$', re.IGNORECASE)
+_QUOTE_HEADER_START_RE = re.compile(r'^\s*(?:On|Vào)\s', re.IGNORECASE)
+_ORIGINAL_MESSAGE_RE = re.compile(
+    r'^\s*-{2,}\s*(?:Original Message|Tin nhắn gốc|Thư gốc)\s*-{2,}\s*$', re.IGNORECASE
+)
+# Outlook reply header: "From: ..." followed by "Sent:"/"Date:" a few lines later
+_HEADER_FROM_RE = re.compile(r'^\s*\*?(?:From|Từ)\s*:\*?\s*\S', re.IGNORECASE)
+_HEADER_SENT_RE = re.compile(r'^\s*\*?(?:Sent|Date|Đã gửi|Ngày)\s*:', re.IGNORECASE)
+_HEADER_LINE_RE = re.compile(
+    r'^\s*\*?(?:From|To|Cc|Bcc|Date|Sent|Subject|Reply-To|Từ|Đến|Đã gửi|Ngày|Gửi|Chủ đề|Tiêu đề)\s*:',
+    re.IGNORECASE
+)
+_RULE_LINE_RE = re.compile(r'^\s*_{10,}\s*$')
+_QUOTED_LINE_RE = re.compile(r'^\s*>')
+
+_FORWARD_MARKER_RE = re.compile(
+    r'^\s*(?:-{2,}\s*(?:Forwarded message|Thư được chuyển tiếp|Tin nhắn được chuyển tiếp)\s*-{2,}'
+    r'|Begin forwarded message:)\s*$',
+    re.IGNORECASE
+)
+
+_FORWARD_SUBJECT_RE = re.compile(r'^\s*(?:Fwd?|TV|Chuyển tiếp)\s*:', re.IGNORECASE)
+
+_SIGNATURE_DELIMITER_RE = re.compile(r'^--\s*$')
+_MOBILE_SIGNATURE_RE = re.compile(
+    r'^\s*(?:Sent from my \w+.*|Sent from (?:Mail|Outlook) for .+|Get Outlook for \w+.*'
+    r'|Được gửi từ .+ của tôi\.?)\s*$',
+    re.IGNORECASE
+)
+_SIGN_OFF_RE = re.compile(
+    r'^\s*(?:best(?: regards| wishes)?|kind regards|warm regards|regards|thanks(?: and regards)?|thank you'
+    r'|many thanks|cheers|sincerely|trân trọng|thân ái|thân mến|cảm ơn|xin cảm ơn|chân thành cảm ơn)'
+    r'[\s,.!]*$',
+    re.IGNORECASE
+)
+# Lines after a sign-off treated as a signature block (name, title, phone)
+_SIGNATURE_MAX_LINES = 6
+_SIGNATURE_MAX_LINE_LENGTH = 80
+# Every line of such a block must look like one: a short name, title or
+# contact line, not a sentence (which would be real content after "Thanks!")
+_SIGNATURE_MAX_WORDS = 8
+_SENTENCE_END_RE = re.compile(r'[.!?…]["\')\]]*\s*$')
+_ABBREVIATION_END_RE = re.compile(r'\b(?:Inc|Ltd|LLC|Co|Corp|JSC|Jr|Sr|Dr|Ph\.?D)\.\s*$', re.IGNORECASE)
+_URL_RE = re.compile(r'https?://|www\.', re.IGNORECASE)
+
+_DISCLAIMER_RE = re.compile(
+    r'confidentiality notice|this (?:e-?mail|message)(?: and any attachments?)? (?:is|are|may be) confidential'
+    r'|if you (?:are not|have received this).{0,40}(?:intended recipient|in error)'
+    r'|(?:thư|email) này.{0,60}(?:bảo mật|thông tin mật)|nếu (?:bạn|quý vị) không phải là người nhận',
+    re.IGNORECASE
+)
+_FOOTER_RE = re.compile(
+    r'unsubscribe|view (?:it |this email )?in (?:your )?browser|manage (?:your )?(?:subscription|preferences)'
+    r'|you (?:are )?receiv(?:ed|ing) this (?:e-?mail|message) because|update your preferences'
+    r'|hủy đăng ký|bạn nhận được (?:email|thư) này vì|xem trên trình duyệt',
+    re.IGNORECASE
+)
+# Footer matches only remove short paragraphs, not a paragraph that happens to mention them
+_FOOTER_MAX_LENGTH = 400
+
+_WHITESPACE_RE = re.compile(r'\s+')
 
 
 class EmailParser(BaseTool):
     """
     A tool for parsing and extracting information from email content.
+    
+    The body sent to the agents is reduced: quoted reply history, forwarded
+    message headers, signatures, legal disclaimers and newsletter footers
+    are removed (English and Vietnamese patterns). The removed spans are
+    kept in "stripped_content" and the savings in "reduction".
+    
+    Configuration (environment variables):
+    - EMAIL_REDUCER_ENABLED: "false" to only normalize whitespace (default true)
     """
     
     def __init__(self):
@@ -18,6 +95,14 @@ class EmailParser(BaseTool):
             name="EmailParser",
             description="Parses email content and extracts structured information"
         )
+        self.reducer_enabled = os.environ.get('EMAIL_REDUCER_ENABLED', 'true').lower() == 'true'
+        self._lock = threading.Lock()
+        self._stats = {
+            "parsed": 0, "reduced": 0,
+            "original_bytes": 0, "reduced_bytes": 0,
+            "original_tokens": 0, "reduced_tokens": 0,
+            "spans": {}
+        }
     
     def execute(self, email_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -25,25 +110,31 @@ class EmailParser(BaseTool):
         
         Args:
             email_data: Dictionary containing email fields
-            
+        
         Returns:
             Parsed and structured email data
         """
         try:
+            raw_body = email_data.get("body", "")
+            body, stripped = self._reduce_body(raw_body, email_data.get("subject", ""))
+            
             parsed_data = {
                 "sender": self._parse_sender(email_data.get("sender", "")),
                 "subject": self._clean_subject(email_data.get("subject", "")),
-                "body": self._clean_body(email_data.get("body", "")),
+                "body": body,
                 "received_date": email_data.get("received_date"),
                 "has_attachments": email_data.get("has_attachments", False),
-                "metadata": self._extract_metadata(email_data.get("body", ""))
+                "metadata": self._extract_metadata(raw_body),
+                "fingerprint": compute_fingerprint(email_data.get("subject", ""), raw_body),
+                "stripped_content": stripped,
+                "reduction": self._measure_reduction(raw_body, body, stripped)
             }
             
             return {
                 "success": True,
                 "parsed_data": parsed_data
             }
-            
+        
         except Exception as e:
             return {
                 "success": False,
@@ -56,7 +147,7 @@ class EmailParser(BaseTool):
         
         Args:
             sender: Sender email string
-            
+        
         Returns:
             Dictionary with name and email
         """
@@ -72,7 +163,7 @@ class EmailParser(BaseTool):
         
         Args:
             subject: Raw email subject
-            
+        
         Returns:
             Cleaned subject
         """
@@ -86,15 +177,201 @@ class EmailParser(BaseTool):
         
         Args:
             body: Raw email body
-            
+        
         Returns:
             Cleaned body text
         """
         # Remove excessive whitespace
-        body = re.sub(r'\s+', ' ', body)
-        # Remove common email signatures
-        body = re.sub(r'-{2,}.*$', '', body, flags=re.DOTALL)
-        return body.strip()
+        return _WHITESPACE_RE.sub(' ', body).strip()
+    
+    def _reduce_body(self, body: str, subject: str = "") -> Tuple[str, List[Dict[str, str]]]:
+        """
+        Remove quoted history, forwarded headers, signatures, disclaimers and
+        footers from an email body.
+        
+        Args:
+            body: Raw email body
+            subject: Raw subject, used to tell forwards from replies
+        
+        Returns:
+            Tuple of (cleaned body, stripped spans as {"kind", "text"} in
+            body order). If nothing would be left, the whole body is kept.
+        """
+        if not body or not self.reducer_enabled:
+            return self._clean_body(body or ""), []
+        
+        lines = body.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+        kinds: List[Optional[str]] = [None] * len(lines)
+        
+        self._mark_forward_headers(lines, kinds)
+        self._mark_quoted_history(lines, kinds, bool(_FORWARD_SUBJECT_RE.match(subject or "")))
+        self._mark_signature(lines, kinds)
+        self._mark_paragraphs(lines, kinds)
+        
+        kept = self._clean_body('\n'.join(line for line, kind in zip(lines, kinds) if kind is None))
+        if not kept:
+            return self._clean_body(body), []
+        return kept, self._collect_spans(lines, kinds)
+    
+    def _mark_forward_headers(self, lines: List[str], kinds: List[Optional[str]]) -> None:
+        """Mark forward markers and the header lines below them; the forwarded text is kept."""
+        for i, line in enumerate(lines):
+            if kinds[i] is not None or not _FORWARD_MARKER_RE.match(line):
+                continue
+            kinds[i] = "forwarded_header"
+            j = i + 1
+            while j < len(lines) and (not lines[j].strip() or _HEADER_LINE_RE.match(lines[j])):
+                kinds[j] = "forwarded_header"
+                j += 1
+    
+    def _mark_quoted_history(self, lines: List[str], kinds: List[Optional[str]], forwarded: bool) -> None:
+        """
+        Mark everything from the first reply header (or trailing "> " block)
+        to the end. In a forwarded email an Outlook header block introduces
+        the forwarded message, so only the header lines are marked.
+        """
+        start = None
+        for i, line in enumerate(lines):
+            if kinds[i] is not None:
+                continue
+            if _QUOTE_HEADER_RE.match(line) or _ORIGINAL_MESSAGE_RE.match(line):
+                start = i
+            elif (_QUOTE_HEADER_START_RE.match(line) and i + 1 < len(lines)
+                  and _QUOTE_HEADER_RE.match(f"{line} {lines[i + 1]}")):
+                # Header wrapped over two lines
+                start = i
+            elif _HEADER_FROM_RE.match(line) and any(
+                _HEADER_SENT_RE.match(following) for following in lines[i + 1:i + 5]
+            ):
+                header_start = i - 1 if i > 0 and _RULE_LINE_RE.match(lines[i - 1]) else i
+                if not forwarded:
+                    start = header_start
+                else:
+                    j = header_start
+                    while j < len(lines) and (j <= i or not lines[j].strip() or _HEADER_LINE_RE.match(lines[j])):
+                        kinds[j] = "forwarded_header"
+                        j += 1
+            if start is not None:
+                break
+        
+        if start is None:
+            # Bottom-posted quote without a header
+            end = len(lines)
+            while end > 0 and (not lines[end - 1].strip() or _QUOTED_LINE_RE.match(lines[end - 1])):
+                end -= 1
+            if any(_QUOTED_LINE_RE.match(line) for line in lines[end:]):
+                start = end
+        
+        if start is not None:
+            for i in range(start, len(lines)):
+                if kinds[i] is None:
+                    kinds[i] = "quoted"
+    
+    def _mark_signature(self, lines: List[str], kinds: List[Optional[str]]) -> None:
+        """Mark the signature: "-- " delimiter blocks, mobile footers and contact blocks after a sign-off."""
+        remaining = [i for i, kind in enumerate(kinds) if kind is None]
+        
+        for position, i in enumerate(remaining):
+            if _SIGNATURE_DELIMITER_RE.match(lines[i]):
+                for j in remaining[position:]:
+                    kinds[j] = "signature"
+                remaining = remaining[:position]
+                break
+        
+        for i in remaining:
+            if _MOBILE_SIGNATURE_RE.match(lines[i]):
+                kinds[i] = "signature"
+        
+        # Contact block after the last sign-off (the sign-off itself is kept)
+        tail = [i for i in remaining if kinds[i] is None and lines[i].strip()]
+        for position in range(len(tail) - 1, max(len(tail) - _SIGNATURE_MAX_LINES - 2, -1), -1):
+            if _SIGN_OFF_RE.match(lines[tail[position]]):
+                block = tail[position + 1:]
+                if block and len(block) <= _SIGNATURE_MAX_LINES and all(
+                    self._is_signature_line(lines[j]) for j in block
+                ):
+                    for j in range(block[0], block[-1] + 1):
+                        if kinds[j] is None:
+                            kinds[j] = "signature"
+                break
+    
+    @staticmethod
+    def _is_signature_line(line: str) -> bool:
+        """Whether a line after a sign-off looks like a name, title, phone, URL or email line."""
+        text = line.strip()
+        if len(text) > _SIGNATURE_MAX_LINE_LENGTH or len(text.split()) > _SIGNATURE_MAX_WORDS:
+            return False
+        if _SENTENCE_END_RE.search(text) and not _ABBREVIATION_END_RE.search(text):
+            return False
+        # A question is content; "?" only appears in a signature inside a URL
+        return '?' not in text or bool(_URL_RE.search(text))
+    
+    def _mark_paragraphs(self, lines: List[str], kinds: List[Optional[str]]) -> None:
+        """Mark disclaimer paragraphs and short newsletter footer paragraphs."""
+        paragraph: List[int] = []
+        for i in range(len(lines) + 1):
+            if i < len(lines) and kinds[i] is None and lines[i].strip():
+                paragraph.append(i)
+                continue
+            if paragraph:
+                text = ' '.join(lines[j] for j in paragraph)
+                kind = None
+                if _DISCLAIMER_RE.search(text):
+                    kind = "disclaimer"
+                elif len(text) <= _FOOTER_MAX_LENGTH and _FOOTER_RE.search(text):
+                    kind = "footer"
+                if kind:
+                    for j in paragraph:
+                        kinds[j] = kind
+                paragraph = []
+    
+    def _collect_spans(self, lines: List[str], kinds: List[Optional[str]]) -> List[Dict[str, str]]:
+        """Group consecutive stripped lines of the same kind into spans."""
+        spans: List[Dict[str, str]] = []
+        current: Optional[str] = None
+        block: List[str] = []
+        for line, kind in zip(lines, kinds):
+            if kind != current:
+                if current is not None and '\n'.join(block).strip():
+                    spans.append({"kind": current, "text": '\n'.join(block).strip()})
+                current, block = kind, []
+            block.append(line)
+        if current is not None and '\n'.join(block).strip():
+            spans.append({"kind": current, "text": '\n'.join(block).strip()})
+        return spans
+    
+    def _measure_reduction(self, raw_body: str, body: str, stripped: List[Dict[str, str]]) -> Dict[str, Any]:
+        """
+        Measure how much smaller the reduced body is than the raw one and
+        add it to the running totals.
+        
+        Returns:
+            Bytes and tokens before/after and the saved fraction
+        """
+        original_bytes = len(raw_body.encode('utf-8'))
+        reduced_bytes = len(body.encode('utf-8'))
+        original_tokens = count_tokens(raw_body)
+        reduced_tokens = count_tokens(body)
+        
+        with self._lock:
+            self._stats["parsed"] += 1
+            self._stats["reduced"] += bool(stripped)
+            self._stats["original_bytes"] += original_bytes
+            self._stats["reduced_bytes"] += reduced_bytes
+            self._stats["original_tokens"] += original_tokens
+            self._stats["reduced_tokens"] += reduced_tokens
+            for span in stripped:
+                self._stats["spans"][span["kind"]] = self._stats["spans"].get(span["kind"], 0) + 1
+        
+        return {
+            "original_bytes": original_bytes,
+            "reduced_bytes": reduced_bytes,
+            "original_tokens": original_tokens,
+            "reduced_tokens": reduced_tokens,
+            "tokens_saved": original_tokens - reduced_tokens,
+            "saved_ratio": round(1 - reduced_tokens / original_tokens, 4) if original_tokens else 0.0,
+            "stripped_kinds": sorted({span["kind"] for span in stripped})
+        }
     
     def _extract_metadata(self, body: str) -> Dict[str, Any]:
         """
@@ -102,7 +379,7 @@ class EmailParser(BaseTool):
         
         Args:
             body: Email body text
-            
+        
         Returns:
             Dictionary of metadata
         """
@@ -113,3 +390,15 @@ class EmailParser(BaseTool):
             "has_question": '?' in body
         }
         return metadata
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get how much the content reducer has shrunk email bodies so far."""
+        with self._lock:
+            stats = {**self._stats, "spans": dict(self._stats["spans"])}
+        stats["enabled"] = self.reducer_enabled
+        stats["bytes_saved"] = stats["original_bytes"] - stats["reduced_bytes"]
+        stats["tokens_saved"] = stats["original_tokens"] - stats["reduced_tokens"]
+        stats["token_saved_ratio"] = (
+            round(stats["tokens_saved"] / stats["original_tokens"], 4) if stats["original_tokens"] else 0.0
+        )
+        return stats
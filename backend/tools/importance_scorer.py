@@ -5,6 +5,9 @@ import json
 import os
 from typing import Dict, Any
 from .base_tool import BaseTool
+from utils.logger import get_logger
+
+log = get_logger(__name__)
 
 
 class ImportanceScorer(BaseTool):
@@ -32,7 +35,7 @@ class ImportanceScorer(BaseTool):
                 data = json.load(f)
                 self.categories = data['categories']
         except Exception as e:
-            print(f"Error loading categories: {str(e)}")
+            log.error("config.load_failed", config="categories", error=str(e))
             self.categories = []
     
     def execute(self, email_data: Dict[str, Any], category: str = None) -> Dict[str, Any]:
@@ -0,0 +1,145 @@
+"""
+Rule-based classifier tool for obvious emails that do not need the AI service.
+"""
+import os
+import re
+import json
+import threading
+from typing import Dict, Any, List, Optional
+from .base_tool import BaseTool
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+
+class RuleClassifier(BaseTool):
+    """
+    A tool that classifies emails using sender, subject and keyword rules.
+
+    Rules are loaded from data/classification_rules.json. A rule matches when
+    every condition it defines matches:
+    - sender_patterns: any regex matches the sender address
+    - sender_domains: the sender domain is (a subdomain of) any listed domain
+    - subject_keywords: any keyword appears in the subject
+    - body_keywords: any keyword appears in the body
+    - text_keywords: at least min_keyword_matches keywords appear in subject + body
+    """
+
+    def __init__(self):
+        """Initialize the Rule Classifier tool."""
+        super().__init__(
+            name="RuleClassifier",
+            description="Classifies obvious emails with header, sender and keyword rules"
+        )
+        self._lock = threading.Lock()
+        self._stats = {"evaluated": 0, "matched": 0, "short_circuited": 0}
+        self._load_rules()
+
+    def _load_rules(self):
+        """Load and precompile classification rules."""
+        try:
+            rules_path = os.path.join(
+                os.path.dirname(os.path.dirname(__file__)),
+                'data',
+                'classification_rules.json'
+            )
+            with open(rules_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.min_confidence = float(
+                os.environ.get('RULE_CLASSIFIER_MIN_CONFIDENCE') or data.get('min_confidence', 0.85)
+            )
+            self.rules = [self._compile_rule(rule) for rule in data.get('rules', [])]
+        except Exception as e:
+            log.error("config.load_failed", config="classification_rules", error=str(e))
+            self.min_confidence = 1.0
+            self.rules = []
+
+    def _compile_rule(self, rule: Dict[str, Any]) -> Dict[str, Any]:
+        """Precompile the regexes and normalize the keywords of one rule."""
+        return {
+            **rule,
+            "sender_patterns": [re.compile(p, re.IGNORECASE) for p in rule.get("sender_patterns", [])],
+            "sender_domains": [d.lower() for d in rule.get("sender_domains", [])],
+            "subject_keywords": [k.lower() for k in rule.get("subject_keywords", [])],
+            "body_keywords": [k.lower() for k in rule.get("body_keywords", [])],
+            "text_keywords": [k.lower() for k in rule.get("text_keywords", [])],
+            "min_keyword_matches": int(rule.get("min_keyword_matches", 1))
+        }
+
+    def execute(self, email_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Find the most confident matching rule.
+
+        Args:
+            email_data: Parsed email data
+
+        Returns:
+            Dictionary with category, confidence, rule name and whether it is
+            confident enough to skip the AI service; None if no rule matches
+        """
+        sender = (email_data.get("sender", {}).get("email") or "").lower()
+        subject = (email_data.get("subject") or "").lower()
+        body = (email_data.get("body") or "").lower()
+        # Footers (e.g. "unsubscribe") are stripped from the body but still identify bulk mail
+        footers = " ".join(
+            span["text"] for span in email_data.get("stripped_content") or [] if span["kind"] == "footer"
+        )
+        if footers:
+            body = f"{body} {footers.lower()}"
+
+        best = None
+        for rule in self.rules:
+            if self._matches(rule, sender, subject, body):
+                if best is None or rule["confidence"] > best["confidence"]:
+                    best = rule
+
+        is_confident = best is not None and best["confidence"] >= self.min_confidence
+        with self._lock:
+            self._stats["evaluated"] += 1
+            self._stats["matched"] += best is not None
+            self._stats["short_circuited"] += is_confident
+
+        if best is None:
+            return None
+
+        return {
+            "category": best["category"],
+            "confidence": best["confidence"],
+            "rule": best["name"],
+            "is_confident": is_confident
+        }
+
+    def _matches(self, rule: Dict[str, Any], sender: str, subject: str, body: str) -> bool:
+        """Check whether every condition defined by a rule matches."""
+        if rule["sender_patterns"] and not any(p.search(sender) for p in rule["sender_patterns"]):
+            return False
+
+        if rule["sender_domains"]:
+            domain = sender.rsplit('@', 1)[-1]
+            if not any(domain == d or domain.endswith('.' + d) for d in rule["sender_domains"]):
+                return False
+
+        if rule["subject_keywords"] and not self._count(rule["subject_keywords"], subject):
+            return False
+
+        if rule["body_keywords"] and not self._count(rule["body_keywords"], body):
+            return False
+
+        if rule["text_keywords"]:
+            if self._count(rule["text_keywords"], f"{subject} {body}") < rule["min_keyword_matches"]:
+                return False
+
+        return True
+
+    def _count(self, keywords: List[str], text: str) -> int:
+        """Count how many keywords appear in the text."""
+        return sum(1 for keyword in keywords if keyword in text)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get rule counts and how often the AI call was skipped."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["rules"] = len(self.rules)
+        stats["min_confidence"] = self.min_confidence
+        stats["skip_rate"] = round(stats["short_circuited"] / stats["evaluated"], 4) if stats["evaluated"] else 0.0
+        return stats
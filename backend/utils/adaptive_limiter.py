@@ -0,0 +1,258 @@
+"""
+Adaptive (AIMD) concurrency limiter for AI provider calls.
+
+A fixed cap either wastes provider capacity or causes 429 storms when many
+batches run at once. Each provider/model gets its own limit that grows by
+about one slot per round trip while calls are fast and succeed, and is cut
+in half when the provider signals overload (429, 503/504, timeouts).
+Retry-After is honoured by pausing new calls until the requested time.
+"""
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+from utils.resilience import status_code_of, retry_after_seconds
+
+OVERLOAD_STATUS = {429, 503, 504}
+
+
+def is_overload(error: BaseException) -> bool:
+    """Whether an error means the provider is overloaded or rate limiting us."""
+    status = status_code_of(error)
+    if status is not None:
+        return status in OVERLOAD_STATUS
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return True
+    name = type(error).__name__
+    return "Timeout" in name or "ResourceExhausted" in name or "DeadlineExceeded" in name
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limiter shared by all threads and the async runner loop.
+
+    Configuration (environment variables):
+    - LLM_LIMIT_INITIAL: starting concurrency per provider/model (default 4)
+    - LLM_LIMIT_MIN: lowest concurrency (default 1)
+    - LLM_MAX_IN_FLIGHT: highest concurrency (default 16)
+    - LLM_LIMIT_BACKOFF: multiplier applied on overload (default 0.5)
+    - LLM_LIMIT_LATENCY_TOLERANCE: a call is healthy if its latency is within
+      this factor of the fastest recent call (default 2.0)
+    """
+
+    _registry: Dict[Tuple[str, str], "AdaptiveLimiter"] = {}
+    _registry_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, provider: str, model: str) -> "AdaptiveLimiter":
+        """Get the process-wide limiter of a provider/model."""
+        key = (provider, model)
+        with cls._registry_lock:
+            if key not in cls._registry:
+                cls._registry[key] = cls(f"{provider}:{model}")
+            return cls._registry[key]
+
+    @classmethod
+    def reset_after_fork(cls) -> None:
+        """Start a forked worker process with fresh limiters (no inherited locks or in-flight counts)."""
+        cls._registry = {}
+        cls._registry_lock = threading.Lock()
+
+    @classmethod
+    def get_all_stats(cls) -> Dict[str, Any]:
+        """Get the stats of every limiter."""
+        with cls._registry_lock:
+            limiters = list(cls._registry.values())
+        return {limiter.name: limiter.get_stats() for limiter in limiters}
+
+    def __init__(self, name: str):
+        self.name = name
+        self.min_limit = int(os.environ.get('LLM_LIMIT_MIN', '1'))
+        self.max_limit = int(os.environ.get('LLM_MAX_IN_FLIGHT', '16'))
+        self.backoff = float(os.environ.get('LLM_LIMIT_BACKOFF', '0.5'))
+        self.latency_tolerance = float(os.environ.get('LLM_LIMIT_LATENCY_TOLERANCE', '2.0'))
+        initial = int(os.environ.get('LLM_LIMIT_INITIAL', '4'))
+
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._waiters: deque = deque()
+        self._latencies: deque = deque(maxlen=100)
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"increases": 0, "decreases": 0, "overloads": 0, "retry_after_pauses": 0}
+
+    @property
+    def limit(self) -> int:
+        with self._lock:
+            return int(self._limit)
+
+    def slot(self, track_latency: bool = True) -> "_Slot":
+        """
+        Context manager holding one slot for a provider call.
+
+        Use "with" from threads and "async with" on the event loop. The call
+        outcome (latency, or the exception raised) adjusts the limit.
+
+        Args:
+            track_latency: False for calls whose duration is not a latency
+                signal (e.g. streaming); they can still cause a backoff
+        """
+        return _Slot(self, track_latency)
+
+    # ------------------------------------------------------------------
+    # Acquire / release
+    # ------------------------------------------------------------------
+
+    def acquire(self) -> None:
+        """Block the calling thread until a slot is free."""
+        delay = self._retry_after_delay()
+        if delay > 0:
+            time.sleep(delay)
+
+        with self._lock:
+            if not self._waiters and self._in_flight < int(self._limit):
+                self._in_flight += 1
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        # The releasing side counts the slot as ours before waking us
+        event.wait()
+
+    async def acquire_async(self) -> None:
+        """Wait on the event loop until a slot is free."""
+        delay = self._retry_after_delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._waiters and self._in_flight < int(self._limit):
+                self._in_flight += 1
+                return
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if (loop, future) in self._waiters:
+                    self._waiters.remove((loop, future))
+            # Otherwise the slot was already handed over; _wake_future returns it
+            raise
+
+    def release(self) -> None:
+        """Return a slot and hand it to the next waiter if the limit allows."""
+        with self._lock:
+            self._in_flight -= 1
+            self._dispatch_locked()
+
+    def _dispatch_locked(self) -> None:
+        while self._waiters and self._in_flight < int(self._limit):
+            waiter = self._waiters.popleft()
+            self._in_flight += 1
+            if isinstance(waiter, threading.Event):
+                waiter.set()
+            else:
+                loop, future = waiter
+                loop.call_soon_threadsafe(self._wake_future, future)
+
+    def _wake_future(self, future: asyncio.Future) -> None:
+        if future.done():
+            # The waiter was cancelled after being given a slot
+            self.release()
+        else:
+            future.set_result(None)
+
+    def _retry_after_delay(self) -> float:
+        with self._lock:
+            return max(self._blocked_until - time.monotonic(), 0.0)
+
+    # ------------------------------------------------------------------
+    # AIMD
+    # ------------------------------------------------------------------
+
+    def on_success(self, latency: Optional[float]) -> None:
+        """
+        Grow the limit additively (about +1 per limit's worth of calls) when a
+        call was healthy and the limit was actually in use.
+        """
+        if latency is None:
+            return
+        with self._lock:
+            self._latencies.append(latency)
+            baseline = min(self._latencies)
+            saturated = self._in_flight + len(self._waiters) + 1 >= int(self._limit)
+            if saturated and latency <= baseline * self.latency_tolerance and self._limit < self.max_limit:
+                before = int(self._limit)
+                self._limit = min(self._limit + 1.0 / self._limit, float(self.max_limit))
+                if int(self._limit) > before:
+                    self._stats["increases"] += 1
+                    self._dispatch_locked()
+
+    def on_error(self, error: BaseException) -> None:
+        """Cut the limit multiplicatively on overload and honour Retry-After."""
+        if not is_overload(error):
+            return
+        retry_after = retry_after_seconds(error)
+        now = time.monotonic()
+        with self._lock:
+            self._stats["overloads"] += 1
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+                self._stats["retry_after_pauses"] += 1
+
+            # One decrease per round trip, so a burst of concurrent failures
+            # does not collapse the limit to the minimum at once
+            window = min(self._latencies) if self._latencies else 0.5
+            if now - self._last_decrease >= window:
+                self._limit = max(self._limit * self.backoff, float(self.min_limit))
+                self._last_decrease = now
+                self._stats["decreases"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "limit": int(self._limit),
+                "in_flight": self._in_flight,
+                "waiting": len(self._waiters),
+                "paused_for_s": round(max(self._blocked_until - time.monotonic(), 0.0), 2),
+                **self._stats
+            }
+
+
+class _Slot:
+    """One held limiter slot; records the call outcome on exit."""
+
+    def __init__(self, limiter: AdaptiveLimiter, track_latency: bool):
+        self.limiter = limiter
+        self.track_latency = track_latency
+        self.started = 0.0
+
+    def __enter__(self):
+        self.limiter.acquire()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._finish(exc)
+        return False
+
+    async def __aenter__(self):
+        await self.limiter.acquire_async()
+        self.started = time.perf_counter()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._finish(exc)
+        return False
+
+    def _finish(self, exc: Optional[BaseException]) -> None:
+        self.limiter.release()
+        if exc is None:
+            self.limiter.on_success(time.perf_counter() - self.started if self.track_latency else None)
+        elif isinstance(exc, Exception):
+            self.limiter.on_error(exc)
@@ -0,0 +1,111 @@
+"""
+Background event loop for running async agent code from synchronous callers.
+
+Async SDK clients (AsyncOpenAI, Gemini aio) bind their connection pools to the
+event loop they were first used on, so calling asyncio.run() per request would
+break them. Instead, a single long-lived loop runs in a daemon thread and
+synchronous code (Flask views) submits coroutines to it.
+"""
+import asyncio
+import threading
+import queue
+import concurrent.futures
+from typing import Any, AsyncIterator, Awaitable, Iterator, Optional
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_thread: Optional[threading.Thread] = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Get the shared background event loop, starting it on first use.
+
+    Returns:
+        The running background event loop
+    """
+    global _loop, _thread
+
+    if _loop is not None and _thread is not None and _thread.is_alive():
+        return _loop
+
+    with _lock:
+        if _loop is None or _thread is None or not _thread.is_alive():
+            _loop = asyncio.new_event_loop()
+            _thread = threading.Thread(
+                target=_loop.run_forever,
+                name="async-runner",
+                daemon=True
+            )
+            _thread.start()
+    return _loop
+
+
+def submit(coro: Awaitable[Any]) -> concurrent.futures.Future:
+    """
+    Schedule a coroutine on the background loop without waiting for it.
+
+    Args:
+        coro: The coroutine to run
+
+    Returns:
+        A concurrent.futures.Future for the coroutine's result
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+def run_sync(coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+    """
+    Run a coroutine on the background loop and block until it finishes.
+
+    Args:
+        coro: The coroutine to run
+        timeout: Optional timeout in seconds
+
+    Returns:
+        The coroutine's result
+    """
+    return submit(coro).result(timeout)
+
+
+_END = object()
+
+
+def iterate_sync(agen: AsyncIterator[Any], timeout: Optional[float] = None) -> Iterator[Any]:
+    """
+    Consume an async generator on the background loop from synchronous code.
+
+    Items are handed over through a queue as they are produced, so a Flask
+    streaming response can forward them without waiting for the end. If the
+    consumer stops early (e.g. the client disconnects), the generator is
+    cancelled.
+
+    Args:
+        agen: The async generator to run
+        timeout: Optional maximum wait in seconds for each item
+
+    Yields:
+        Items produced by the generator; its exception is re-raised here
+    """
+    items: "queue.Queue" = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in agen:
+                items.put((item, None))
+        except Exception as e:
+            items.put((_END, e))
+            return
+        items.put((_END, None))
+
+    future = submit(pump())
+    try:
+        while True:
+            item, error = items.get(timeout=timeout)
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        future.cancel()
@@ -0,0 +1,207 @@
+"""
+Process-wide registry of AI provider SDK clients.
+
+Every agent's OpenAIClient used to build its own SDK clients: one HTTP
+connection pool per agent for OpenAI and a genai.configure() per agent for
+Gemini (which also discards the gRPC channels already opened). The registry
+builds each provider's clients once, with bounded keep-alive pools and
+explicit timeouts, and hands out one ProviderBackend per provider/model.
+
+Provider SDKs are imported on first use, and only for configured providers:
+importing google.generativeai alone takes most of a second.
+"""
+import os
+import time
+import threading
+from typing import Any, Dict, Tuple
+from utils.adaptive_limiter import AdaptiveLimiter
+from utils.context_cache import GeminiContextCache
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+
+class ProviderBackend:
+    """One configured AI provider (Gemini or OpenAI) model and its SDK clients."""
+
+    def __init__(self, name: str, model: str, client: Any, async_client: Any):
+        self.name = name
+        self.model = model
+        self.client = client
+        self.async_client = async_client
+        # Process-wide AIMD concurrency limit for this provider/model, shared
+        # by every agent's client and by both sync and async callers
+        self.limiter = AdaptiveLimiter.get(name, model)
+
+
+class ClientRegistry:
+    """
+    Hands out shared ProviderBackends, building SDK clients on first use.
+
+    OpenAI clients use one pooled httpx client (sync and async) per process,
+    shared by all OpenAI models since the model is chosen per request. The
+    SDK's own retries are disabled: ResiliencePolicy retries and fails over.
+    Gemini is configured once; its models share the SDK's gRPC channel,
+    which multiplexes requests over one HTTP/2 connection.
+
+    Configuration (environment variables):
+    - LLM_POOL_MAX_CONNECTIONS: open connections per OpenAI client (default 32)
+    - LLM_POOL_MAX_KEEPALIVE: idle connections kept open (default 16)
+    - LLM_POOL_KEEPALIVE_EXPIRY: seconds an idle connection is kept (default 60)
+    - LLM_CONNECT_TIMEOUT: connect timeout in seconds (default 5)
+    - LLM_READ_TIMEOUT: read timeout in seconds (default 60)
+    - LLM_WARMUP_ENABLED: "true" to open provider connections at startup (default false)
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self.max_connections = int(os.environ.get('LLM_POOL_MAX_CONNECTIONS', '32'))
+        self.max_keepalive = int(os.environ.get('LLM_POOL_MAX_KEEPALIVE', '16'))
+        self.keepalive_expiry = float(os.environ.get('LLM_POOL_KEEPALIVE_EXPIRY', '60'))
+        self.connect_timeout = float(os.environ.get('LLM_CONNECT_TIMEOUT', '5'))
+        self.read_timeout = float(os.environ.get('LLM_READ_TIMEOUT', '60'))
+        self.warmup_enabled = os.environ.get('LLM_WARMUP_ENABLED', 'false').lower() == 'true'
+
+        self._lock = threading.Lock()
+        self._providers: Dict[str, Tuple[Any, Any]] = {}
+        self._backends: Dict[Tuple[str, str], ProviderBackend] = {}
+        self._warmup: Dict[str, Any] = {}
+
+    @classmethod
+    def reset_after_fork(cls) -> None:
+        """
+        Forget the clients inherited from the parent process: HTTP pools and
+        gRPC channels cannot be shared across fork(). Also resets the
+        concurrency limiters and Gemini cached-content models bound to them.
+        """
+        cls._instance = None
+        cls._instance_lock = threading.Lock()
+        AdaptiveLimiter.reset_after_fork()
+        GeminiContextCache.reset_after_fork()
+
+    def backend(self, provider: str, model: str) -> ProviderBackend:
+        """
+        Get the shared backend for a provider's model.
+
+        Raises:
+            ValueError: If the provider has no API key or SDK installed
+        """
+        key = (provider, model)
+        backend = self._backends.get(key)
+        if backend is not None:
+            return backend
+        with self._lock:
+            backend = self._backends.get(key)
+            if backend is None:
+                client, async_client = self._provider_clients(provider)
+                if provider == 'gemini':
+                    import google.generativeai as genai
+                    # GenerativeModel exposes both generate_content and generate_content_async
+                    client = async_client = genai.GenerativeModel(f'models/{model}')
+                backend = ProviderBackend(provider, model, client, async_client)
+                self._backends[key] = backend
+            return backend
+
+    def _provider_clients(self, provider: str) -> Tuple[Any, Any]:
+        """Build a provider's SDK clients once (caller holds the lock)."""
+        if provider in self._providers:
+            return self._providers[provider]
+
+        if provider == 'gemini':
+            api_key = os.environ.get('GEMINI_API_KEY')
+            if not api_key:
+                raise ValueError("Gemini is not configured")
+            try:
+                import google.generativeai as genai
+            except ImportError as e:
+                raise ValueError("google-generativeai is not installed") from e
+            genai.configure(api_key=api_key)
+            clients = (None, None)
+            log.info("ai.provider_ready", provider="gemini")
+        elif provider == 'openai':
+            api_key = os.environ.get('OPENAI_API_KEY')
+            if not api_key:
+                raise ValueError("OpenAI is not configured")
+            try:
+                import httpx
+                from openai import OpenAI, AsyncOpenAI
+            except ImportError as e:
+                raise ValueError("openai is not installed") from e
+            limits = httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry
+            )
+            timeout = httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+            clients = (
+                OpenAI(api_key=api_key, max_retries=0, timeout=timeout,
+                       http_client=httpx.Client(limits=limits, timeout=timeout)),
+                AsyncOpenAI(api_key=api_key, max_retries=0, timeout=timeout,
+                            http_client=httpx.AsyncClient(limits=limits, timeout=timeout))
+            )
+            log.info("ai.provider_ready", provider="openai")
+        else:
+            raise ValueError(f"Unknown AI provider: {provider}")
+
+        self._providers[provider] = clients
+        return clients
+
+    def warm_up(self) -> Dict[str, Any]:
+        """
+        Open a connection to each built backend with a free request (model
+        lookup), so the first agent call does not pay DNS, TCP and TLS setup.
+
+        Returns:
+            Per-provider warm-up time in milliseconds, or the error
+        """
+        from utils.async_runner import run_sync
+
+        with self._lock:
+            backends = list({b.name: b for b in self._backends.values()}.values())
+        for backend in backends:
+            started = time.perf_counter()
+            try:
+                if backend.name == 'gemini':
+                    backend.client.count_tokens("ping")
+                    run_sync(backend.async_client.count_tokens_async("ping"), timeout=self.read_timeout)
+                else:
+                    backend.client.models.retrieve(backend.model)
+                    # The async pool belongs to the shared background loop that runs agent calls
+                    run_sync(backend.async_client.models.retrieve(backend.model), timeout=self.read_timeout)
+                result = {"ms": round((time.perf_counter() - started) * 1000, 1)}
+            except Exception as e:
+                if getattr(e, 'status_code', None) or getattr(e, 'code', None):
+                    # The provider answered (e.g. model not visible to this key): the connection is open
+                    result = {"ms": round((time.perf_counter() - started) * 1000, 1)}
+                else:
+                    log.warning("ai.warmup_failed", provider=backend.name, error=str(e))
+                    result = {"error": str(e)}
+            with self._lock:
+                self._warmup[backend.name] = result
+        return dict(self._warmup)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get pool settings, the backends built so far and warm-up results."""
+        with self._lock:
+            return {
+                "pool": {
+                    "max_connections": self.max_connections,
+                    "max_keepalive": self.max_keepalive,
+                    "keepalive_expiry": self.keepalive_expiry,
+                    "connect_timeout": self.connect_timeout,
+                    "read_timeout": self.read_timeout
+                },
+                "providers": sorted(self._providers),
+                "backends": sorted(f"{name}:{model}" for name, model in self._backends),
+                "warmup": dict(self._warmup)
+            }
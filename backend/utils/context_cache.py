@@ -0,0 +1,145 @@
+"""
+Gemini context caching for stable prompt prefixes.
+
+A compiled system instruction (utils.prompts) is uploaded once as Gemini
+cached content; calls then send only the per-email suffix and are billed
+the cached rate for the prefix. Prefixes below the provider's minimum
+cacheable size, or SDKs without the caching API (google-generativeai <
+0.7), fall back to sending the whole prompt, where the byte-stable prefix
+still benefits from Gemini's implicit caching.
+"""
+import os
+import time
+import hashlib
+import datetime
+import threading
+from typing import Any, Dict, Optional, Set, Tuple
+from utils.tokens import count_tokens
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+
+class GeminiContextCache:
+    """
+    Process-wide map of system instruction -> Gemini model bound to cached content.
+
+    Configuration (environment variables):
+    - GEMINI_CONTEXT_CACHE_ENABLED: "false" to disable (default true)
+    - GEMINI_CONTEXT_CACHE_TTL: cached content lifetime in seconds (default 3600)
+    - GEMINI_CONTEXT_CACHE_MIN_TOKENS: smallest prefix worth caching; the
+      API rejects smaller ones (default 4096)
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def reset_after_fork(cls) -> None:
+        """Drop cached-content models built on the parent process's gRPC channel."""
+        cls._instance = None
+        cls._instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.enabled = os.environ.get('GEMINI_CONTEXT_CACHE_ENABLED', 'true').lower() == 'true'
+        self.ttl = int(os.environ.get('GEMINI_CONTEXT_CACHE_TTL', '3600'))
+        self.min_tokens = int(os.environ.get('GEMINI_CONTEXT_CACHE_MIN_TOKENS', '4096'))
+
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[Any, float]] = {}
+        self._prefix_tokens: Dict[str, int] = {}
+        self._creating: Set[str] = set()
+        self._failed: Set[str] = set()
+        self._stats = {"created": 0, "hits": 0, "failures": 0}
+        # Whether the installed SDK has the caching API; checked on the first Gemini call
+        self._sdk_available: Optional[bool] = None
+
+    def _available(self) -> bool:
+        if self._sdk_available is None:
+            try:
+                from google.generativeai import caching  # noqa: F401
+                self._sdk_available = True
+            except ImportError:
+                self._sdk_available = False
+        return self._sdk_available
+
+    def _key(self, model: str, system_instruction: str) -> str:
+        return hashlib.sha256(f"{model}\x00{system_instruction}".encode('utf-8')).hexdigest()
+
+    def lookup(self, model: str, system_instruction: Optional[str]) -> Optional[Any]:
+        """Get the cached-content model for a prefix if one is live (no network call)."""
+        if not self.enabled or not system_instruction or not self._available():
+            return None
+        key = self._key(model, system_instruction)
+        with self._lock:
+            entry = self._entries.get(key)
+            # Refresh a little before the provider expires it
+            if entry and entry[1] - 60 > time.time():
+                self._stats["hits"] += 1
+                return entry[0]
+        return None
+
+    def should_create(self, model: str, system_instruction: Optional[str]) -> bool:
+        """Whether a prefix is cacheable and not cached, failed or being created."""
+        if not self.enabled or not system_instruction or not self._available():
+            return False
+        key = self._key(model, system_instruction)
+        with self._lock:
+            if key in self._failed or key in self._creating:
+                return False
+            tokens = self._prefix_tokens.get(key)
+        if tokens is None:
+            tokens = count_tokens(system_instruction)
+            with self._lock:
+                self._prefix_tokens[key] = tokens
+        return tokens >= self.min_tokens
+
+    def create(self, model: str, system_instruction: str) -> Optional[Any]:
+        """
+        Upload a prefix as cached content (blocking) and get a model bound to it.
+
+        Returns:
+            The model, or None if the provider refused (the prefix is then
+            not retried)
+        """
+        key = self._key(model, system_instruction)
+        with self._lock:
+            if key in self._creating:
+                return None
+            self._creating.add(key)
+        try:
+            import google.generativeai as genai
+            from google.generativeai import caching as genai_caching
+            cached = genai_caching.CachedContent.create(
+                model=f"models/{model}",
+                system_instruction=system_instruction,
+                ttl=datetime.timedelta(seconds=self.ttl)
+            )
+            bound = genai.GenerativeModel.from_cached_content(cached_content=cached)
+            with self._lock:
+                self._entries[key] = (bound, time.time() + self.ttl)
+                self._stats["created"] += 1
+            return bound
+        except Exception as e:
+            log.warning("context_cache.disabled_for_prefix", error=str(e))
+            with self._lock:
+                self._failed.add(key)
+                self._stats["failures"] += 1
+            return None
+        finally:
+            with self._lock:
+                self._creating.discard(key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            live = sum(1 for _, expires_at in self._entries.values() if expires_at > time.time())
+            return {"enabled": self.enabled and self._sdk_available is not False,
+                    "live_prefixes": live, **self._stats}
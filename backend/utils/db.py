@@ -5,18 +5,40 @@ from pymongo import MongoClient
 from bson import ObjectId
 from dotenv import load_dotenv
 import os
+import json
+import base64
+import threading
 from datetime import datetime
+from utils.logger import get_logger
+
+log = get_logger(__name__)
 
 load_dotenv()
 
 MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
 DATABASE_NAME = os.getenv('DATABASE_NAME', 'email_assistant')
+# How long an operation waits for a reachable server before failing
+MONGODB_TIMEOUT_MS = int(os.getenv('MONGODB_TIMEOUT_MS', '5000'))
+
+# Email fields that can be selected with get_emails(fields=...)
+EMAIL_FIELDS = frozenset([
+    "email_id", "user_id", "sender", "subject", "body", "received_date",
+    "category", "classification_confidence", "classification_source",
+    "summary", "key_points", "action_items", "is_important",
+    "importance_score", "importance_level", "suggested_action",
+    "suggested_reply", "reply_pending", "tone", "user_action", "fingerprint",
+    "body_reduction", "created_at", "updated_at"
+])
+# Large fields left out of email lists unless selected; stripped_content is
+# only returned by get_email_by_id
+EMAIL_LIST_EXCLUDED = ("body", "suggested_reply", "stripped_content")
 
 
 class MongoDB:
     _instance = None
     _client = None
     _db = None
+    _lock = threading.Lock()
 
     @classmethod
     def get_instance(cls):
@@ -25,25 +47,61 @@ class MongoDB:
         return cls._instance
 
     def __init__(self):
-        if MongoDB._client is None:
-            MongoDB._client = MongoClient(MONGODB_URI)
-            MongoDB._db = MongoDB._client[DATABASE_NAME]
-            self._create_indexes()
+        MongoDB._connect()
+
+    @classmethod
+    def _connect(cls):
+        # connect=False: no sockets or monitor threads until the first
+        # operation, so the client is safe to create before a prefork server forks
+        with cls._lock:
+            if cls._client is None:
+                cls._client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=MONGODB_TIMEOUT_MS, connect=False)
+                cls._db = cls._client[DATABASE_NAME]
+
+    @classmethod
+    def reset_after_fork(cls):
+        """
+        Drop the client inherited from the parent process (pymongo clients
+        must not be shared across fork()); the next operation reconnects.
+        """
+        cls._client = None
+        cls._db = None
+        cls._lock = threading.Lock()
+
+    def ensure_indexes(self):
+        """
+        Create necessary indexes for better query performance.
 
-    def _create_indexes(self):
-        """Create necessary indexes for better query performance."""
+        Run by migrate.py or the startup task (utils.startup), not on
+        construction, so importing the app does not wait for MongoDB.
+        """
         try:
             self.db.users.create_index("user_id", unique=True)
-            self.db.emails.create_index([("user_id", 1), ("created_at", -1)])
+            # Serves get_emails' keyset pagination: filter, sort and range on one index
+            self.db.emails.create_index([("user_id", 1), ("created_at", -1), ("_id", -1)])
             self.db.emails.create_index("email_id", unique=True)
             self.db.emails.create_index([("category", 1)])
             self.db.emails.create_index([("is_important", 1)])
-            print("✅ MongoDB indexes created successfully")
+            self.db.emails.create_index([("fingerprint", 1), ("created_at", -1)], sparse=True)
+            log.info("db.indexes_created")
+            return True
         except Exception as e:
-            print(f"❌ Error creating MongoDB indexes: {str(e)}")
+            log.error("db.indexes_failed", error=str(e))
+            return False
+
+    def ping(self):
+        """Check that the server is reachable."""
+        try:
+            self.db.client.admin.command('ping')
+            return True
+        except Exception as e:
+            log.warning("db.ping_failed", error=str(e))
+            return False
 
     @property
     def db(self):
+        if MongoDB._db is None:
+            MongoDB._connect()
         return MongoDB._db
 
     def _serialize_document(self, doc):
@@ -74,7 +132,7 @@ class MongoDB:
             )
             return self._serialize_document(user)
         except Exception as e:
-            print(f"Error in get_or_create_user: {str(e)}")
+            log.error("db.failed", operation="get_or_create_user", error=str(e))
             return None
 
     # Email Management
@@ -91,11 +149,21 @@ class MongoDB:
                 "body": email_data.get("body"),
                 "received_date": email_data.get("received_date"),
                 "category": email_data.get("category"),
+                "classification_confidence": email_data.get("classification_confidence"),
+                "classification_source": email_data.get("classification_source"),
                 "summary": email_data.get("summary"),
+                "key_points": email_data.get("key_points", []),
+                "action_items": email_data.get("action_items", []),
                 "is_important": email_data.get("is_important", False),
+                "importance_score": email_data.get("importance_score"),
+                "importance_level": email_data.get("importance_level"),
                 "suggested_action": email_data.get("suggested_action"),
                 "suggested_reply": email_data.get("suggested_reply"),
+                "reply_pending": email_data.get("reply_pending", False),
                 "tone": email_data.get("tone"),
+                "fingerprint": email_data.get("fingerprint"),
+                "stripped_content": email_data.get("stripped_content", []),
+                "body_reduction": email_data.get("body_reduction"),
                 "created_at": datetime.utcnow(),
                 "updated_at": datetime.utcnow()
             }
@@ -105,36 +173,122 @@ class MongoDB:
                 return self._serialize_document(email_doc)
             return None
         except Exception as e:
-            print(f"Error in save_email: {str(e)}")
+            log.error("db.failed", operation="save_email", error=str(e))
             return None
 
-    def get_emails(self, user_id, filters=None):
-        """Get emails for a user with optional filters."""
+    def get_emails(self, user_id, filters=None, limit=50, cursor=None, fields=None):
+        """
+        Get one page of a user's emails, newest first, with optional filters.
+
+        Pages are keyset-paginated on (created_at, _id): each page is an index
+        range scan that starts after the previous page's last email, so every
+        page costs the same however deep it is, and emails added meanwhile
+        do not shift later pages.
+
+        Args:
+            user_id: User ID
+            filters: Optional {"category": ..., "is_important": ...}
+            limit: Page size
+            cursor: next_cursor of the previous page, or None for the first page
+            fields: Fields to return (see EMAIL_FIELDS); by default every
+                field except EMAIL_LIST_EXCLUDED. email_id and created_at
+                are always returned.
+
+        Returns:
+            {"emails": [...], "next_cursor": str, or None on the last page}
+
+        Raises:
+            ValueError: If the cursor or a field is invalid
+        """
+        query = {"user_id": user_id}
+        if filters:
+            if filters.get("category"):
+                query["category"] = filters["category"]
+            if filters.get("is_important") is not None:
+                query["is_important"] = filters["is_important"]
+        if cursor:
+            created_at, last_id = self._decode_cursor(cursor)
+            query["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "_id": {"$lt": last_id}}
+            ]
+
+        if fields:
+            unknown = set(fields) - EMAIL_FIELDS
+            if unknown:
+                raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+            projection = {field: 1 for field in fields}
+            projection.update({"email_id": 1, "created_at": 1})
+        else:
+            projection = {field: 0 for field in EMAIL_LIST_EXCLUDED}
+
         try:
-            query = {"user_id": user_id}
-            
-            if filters:
-                if filters.get("category"):
-                    query["category"] = filters["category"]
-                if filters.get("is_important") is not None:
-                    query["is_important"] = filters["is_important"]
-            
-            emails = list(self.db.emails.find(query).sort("created_at", -1))
-            return [self._serialize_document(email) for email in emails]
+            # One extra document tells whether there is a next page
+            emails = list(
+                self.db.emails.find(query, projection)
+                .sort([("created_at", -1), ("_id", -1)])
+                .limit(limit + 1)
+            )
         except Exception as e:
-            print(f"Error in get_emails: {str(e)}")
-            return []
+            log.error("db.failed", operation="get_emails", error=str(e))
+            return {"emails": [], "next_cursor": None}
+
+        next_cursor = None
+        if len(emails) > limit:
+            emails = emails[:limit]
+            next_cursor = self._encode_cursor(emails[-1])
+        return {
+            "emails": [self._serialize_document(email) for email in emails],
+            "next_cursor": next_cursor
+        }
+
+    @staticmethod
+    def _encode_cursor(email):
+        """Opaque cursor pointing after an email: its (created_at, _id)."""
+        position = json.dumps([email["created_at"].isoformat(), str(email["_id"])])
+        return base64.urlsafe_b64encode(position.encode()).decode().rstrip("=")
 
-    def get_email_by_id(self, email_id, user_id):
-        """Get a specific email by ID."""
+    @staticmethod
+    def _decode_cursor(cursor):
+        """Decode a cursor made by _encode_cursor into (created_at, ObjectId)."""
         try:
-            email = self.db.emails.find_one({
-                "email_id": email_id,
-                "user_id": user_id
-            })
+            padded = cursor + "=" * (-len(cursor) % 4)
+            created_at, last_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            return datetime.fromisoformat(created_at), ObjectId(last_id)
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    def get_fingerprinted_emails(self, limit=10000):
+        """Get the most recent emails that have a near-duplicate fingerprint (None if the query failed)."""
+        try:
+            cursor = self.db.emails.find(
+                {"fingerprint": {"$ne": None}},
+                {
+                    "_id": 0, "email_id": 1, "user_id": 1, "sender": 1, "fingerprint": 1,
+                    "category": 1, "classification_confidence": 1,
+                    "summary": 1, "key_points": 1, "action_items": 1
+                }
+            ).sort("created_at", -1).limit(limit)
+            return list(cursor)
+        except Exception as e:
+            log.error("db.failed", operation="get_fingerprinted_emails", error=str(e))
+            return None
+
+    def get_email_by_id(self, email_id, user_id, include_stripped=False):
+        """
+        Get a specific email by ID.
+        
+        The quoted history and boilerplate removed from the body are only
+        returned when include_stripped is True.
+        """
+        try:
+            email = self.db.emails.find_one(
+                {"email_id": email_id, "user_id": user_id},
+                None if include_stripped else {"stripped_content": 0}
+            )
             return self._serialize_document(email)
         except Exception as e:
-            print(f"Error in get_email_by_id: {str(e)}")
+            log.error("db.failed", operation="get_email_by_id", error=str(e))
             return None
 
     def delete_email(self, email_id, user_id):
@@ -146,7 +300,7 @@ class MongoDB:
             })
             return result.deleted_count > 0
         except Exception as e:
-            print(f"Error in delete_email: {str(e)}")
+            log.error("db.failed", operation="delete_email", error=str(e))
             return False
 
     def update_email_action(self, email_id, user_id, action):
@@ -163,7 +317,25 @@ class MongoDB:
             )
             return result.modified_count > 0
         except Exception as e:
-            print(f"Error in update_email_action: {str(e)}")
+            log.error("db.failed", operation="update_email_action", error=str(e))
+            return False
+
+    def set_suggested_reply(self, email_id, user_id, suggested_reply):
+        """Store a reply generated after the email was saved."""
+        try:
+            result = self.db.emails.update_one(
+                {"email_id": email_id, "user_id": user_id},
+                {
+                    "$set": {
+                        "suggested_reply": suggested_reply,
+                        "reply_pending": False,
+                        "updated_at": datetime.utcnow()
+                    }
+                }
+            )
+            return result.matched_count > 0
+        except Exception as e:
+            log.error("db.failed", operation="set_suggested_reply", error=str(e))
             return False
 
     def get_email_stats(self, user_id):
@@ -179,14 +351,25 @@ class MongoDB:
             
             category_stats = {cat["_id"]: cat["count"] for cat in categories}
             
+            sources = self.db.emails.aggregate([
+                {"$match": {"user_id": user_id, "classification_source": {"$ne": None}}},
+                {"$group": {"_id": "$classification_source", "count": {"$sum": 1}}}
+            ])
+            
+            source_stats = {src["_id"]: src["count"] for src in sources}
+            tracked = sum(source_stats.values())
+            
             return {
                 "total": total,
                 "important": important,
-                "by_category": category_stats
+                "by_category": category_stats,
+                "by_classification_source": source_stats,
+                "rule_skip_rate": round(source_stats.get("rules", 0) / tracked, 4) if tracked else 0.0
             }
         except Exception as e:
-            print(f"Error in get_email_stats: {str(e)}")
-            return {"total": 0, "important": 0, "by_category": {}}
+            log.error("db.failed", operation="get_email_stats", error=str(e))
+            return {"total": 0, "important": 0, "by_category": {},
+                    "by_classification_source": {}, "rule_skip_rate": 0.0}
 
     def close(self):
         if MongoDB._client:
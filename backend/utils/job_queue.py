@@ -0,0 +1,644 @@
+"""
+Persistent job queue for asynchronous email processing.
+
+Jobs are leased by workers for a visibility timeout; a job whose lease expires
+before it is completed becomes visible again, so workers can run on any number
+of hosts and a crashed worker never loses a job. A job whose lease expires
+on its last attempt (its worker crashed or hung every time) is failed
+rather than leased again.
+
+Backends (JOB_QUEUE_BACKEND): "mongo" (default), "sqlite", "redis".
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+from utils.errors import EmailProcessingError
+from utils.logger import get_logger, set_request_id, reset_request_id
+
+log = get_logger(__name__)
+
+load_dotenv()
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+DEFAULT_SQLITE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)),
+    'data',
+    'jobs.sqlite3'
+)
+
+
+def _new_job(payload: Dict[str, Any], max_attempts: int) -> Dict[str, Any]:
+    """Build a new job record."""
+    now = time.time()
+    return {
+        "job_id": uuid.uuid4().hex,
+        "status": JOB_QUEUED,
+        "payload": payload,
+        "result": None,
+        "error": None,
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "lease_id": None,
+        "lease_expires_at": None,
+        "worker_id": None,
+        "created_at": now,
+        "updated_at": now
+    }
+
+
+def _public_view(job: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Strip internal lease fields from a job record."""
+    if job is None:
+        return None
+    return {
+        "job_id": job["job_id"],
+        "user_id": job["payload"].get("user_id"),
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "created_at": datetime.utcfromtimestamp(job["created_at"]).isoformat() + "Z",
+        "updated_at": datetime.utcfromtimestamp(job["updated_at"]).isoformat() + "Z"
+    }
+
+
+class JobQueue(ABC):
+    """
+    Abstract base class for job queue backends.
+    """
+
+    def __init__(self):
+        self.max_attempts = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+
+    @abstractmethod
+    def enqueue(self, payload: Dict[str, Any]) -> str:
+        """
+        Add a job to the queue.
+
+        Args:
+            payload: JSON-serializable job input
+
+        Returns:
+            The new job ID
+        """
+        pass
+
+    @abstractmethod
+    def lease(self, worker_id: str, visibility_timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Take the oldest visible job and hide it for visibility_timeout seconds.
+
+        Args:
+            worker_id: ID of the leasing worker
+            visibility_timeout: Seconds before the job becomes visible again
+
+        Returns:
+            The leased job record (with "lease_id"), or None if the queue is empty
+        """
+        pass
+
+    @abstractmethod
+    def complete(self, job: Dict[str, Any], result: Dict[str, Any]) -> bool:
+        """
+        Mark a leased job as succeeded.
+
+        Returns:
+            False if the lease was lost (the job was re-leased elsewhere)
+        """
+        pass
+
+    @abstractmethod
+    def fail(self, job: Dict[str, Any], error: str, retry: bool = True) -> bool:
+        """
+        Record a failed attempt; requeue if attempts remain and retry is set.
+
+        Returns:
+            False if the lease was lost
+        """
+        pass
+
+    @abstractmethod
+    def _get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get the full job record."""
+        pass
+
+    def ensure_indexes(self) -> bool:
+        """
+        Create the backend's indexes (run by migrate.py or the startup task,
+        not at import).
+
+        Returns:
+            False if index creation failed
+        """
+        return True
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a job's status and result.
+
+        Returns:
+            Public job view, or None if not found
+        """
+        return _public_view(self._get(job_id))
+
+    def _final_status(self, job: Dict[str, Any], retry: bool) -> str:
+        """Status after a failed attempt."""
+        return JOB_QUEUED if retry and job["attempts"] < job["max_attempts"] else JOB_FAILED
+
+    @staticmethod
+    def _lease_expired_error(job: Dict[str, Any]) -> str:
+        """Error recorded when the last attempt's lease expires (worker crashed or hung)."""
+        return f"Lease expired after {job['attempts']} attempts"
+
+
+class MongoJobQueue(JobQueue):
+    """Job queue stored in the MongoDB "jobs" collection."""
+
+    def __init__(self, db):
+        super().__init__()
+        self.db = db
+
+    @property
+    def collection(self):
+        # Looked up per use: the client is replaced after a prefork server forks
+        return self.db.db.jobs
+
+    def ensure_indexes(self):
+        try:
+            self.collection.create_index("job_id", unique=True)
+            self.collection.create_index([("status", 1), ("lease_expires_at", 1), ("created_at", 1)])
+            return True
+        except Exception as e:
+            log.error("jobs.indexes_failed", error=str(e))
+            return False
+
+    def enqueue(self, payload):
+        job = _new_job(payload, self.max_attempts)
+        self.collection.insert_one(dict(job))
+        return job["job_id"]
+
+    def _fail_exhausted(self, now: float) -> None:
+        """Fail jobs whose last attempt's lease expired, instead of re-leasing them."""
+        exhausted = {
+            "status": JOB_RUNNING,
+            "lease_expires_at": {"$lt": now},
+            "$expr": {"$gte": ["$attempts", "$max_attempts"]}
+        }
+        for job in self.collection.find(exhausted, {"_id": 0, "job_id": 1, "attempts": 1}):
+            self.collection.update_one(
+                {"job_id": job["job_id"], **exhausted},
+                {"$set": {
+                    "status": JOB_FAILED,
+                    "error": self._lease_expired_error(job),
+                    "lease_id": None,
+                    "lease_expires_at": None,
+                    "updated_at": now
+                }}
+            )
+
+    def lease(self, worker_id, visibility_timeout):
+        now = time.time()
+        self._fail_exhausted(now)
+        lease_id = uuid.uuid4().hex
+        job = self.collection.find_one_and_update(
+            {"$or": [
+                {"status": JOB_QUEUED},
+                {"status": JOB_RUNNING, "lease_expires_at": {"$lt": now},
+                 "$expr": {"$lt": ["$attempts", "$max_attempts"]}}
+            ]},
+            {
+                "$set": {
+                    "status": JOB_RUNNING,
+                    "lease_id": lease_id,
+                    "lease_expires_at": now + visibility_timeout,
+                    "worker_id": worker_id,
+                    "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", 1)],
+            projection={"_id": 0},
+            return_document=True
+        )
+        return job
+
+    def complete(self, job, result):
+        updated = self.collection.update_one(
+            {"job_id": job["job_id"], "lease_id": job["lease_id"]},
+            {"$set": {
+                "status": JOB_SUCCEEDED,
+                "result": result,
+                "error": None,
+                "lease_id": None,
+                "updated_at": time.time()
+            }}
+        )
+        return updated.modified_count > 0
+
+    def fail(self, job, error, retry=True):
+        updated = self.collection.update_one(
+            {"job_id": job["job_id"], "lease_id": job["lease_id"]},
+            {"$set": {
+                "status": self._final_status(job, retry),
+                "error": error,
+                "lease_id": None,
+                "lease_expires_at": None,
+                "updated_at": time.time()
+            }}
+        )
+        return updated.modified_count > 0
+
+    def _get(self, job_id):
+        return self.collection.find_one({"job_id": job_id}, {"_id": 0})
+
+
+class SQLiteJobQueue(JobQueue):
+    """Job queue stored in a local SQLite file (single host)."""
+
+    def __init__(self, path: Optional[str] = None):
+        super().__init__()
+        self.path = path or os.environ.get('JOB_QUEUE_SQLITE_PATH') or DEFAULT_SQLITE_PATH
+        self._local = threading.local()
+        self._connection().executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " data TEXT NOT NULL,"
+            " lease_id TEXT,"
+            " lease_expires_at REAL,"
+            " created_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_jobs_visible ON jobs (status, lease_expires_at, created_at);"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get a SQLite connection for the current thread and process."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _save(self, conn: sqlite3.Connection, job: Dict[str, Any]) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs (job_id, status, data, lease_id, lease_expires_at, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (job["job_id"], job["status"], json.dumps(job, default=str),
+             job["lease_id"], job["lease_expires_at"], job["created_at"])
+        )
+
+    def enqueue(self, payload):
+        job = _new_job(payload, self.max_attempts)
+        self._save(self._connection(), job)
+        return job["job_id"]
+
+    def lease(self, worker_id, visibility_timeout):
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs whose last attempt's lease expired fail instead of being re-leased
+            for (data,) in conn.execute(
+                "SELECT data FROM jobs WHERE status = ? AND lease_expires_at < ?",
+                (JOB_RUNNING, now)
+            ).fetchall():
+                expired = json.loads(data)
+                if expired["attempts"] >= expired["max_attempts"]:
+                    expired.update({
+                        "status": JOB_FAILED,
+                        "error": self._lease_expired_error(expired),
+                        "lease_id": None,
+                        "lease_expires_at": None,
+                        "updated_at": now
+                    })
+                    self._save(conn, expired)
+            row = conn.execute(
+                "SELECT data FROM jobs WHERE status = ? OR (status = ? AND lease_expires_at < ?)"
+                " ORDER BY created_at LIMIT 1",
+                (JOB_QUEUED, JOB_RUNNING, now)
+            ).fetchone()
+            if not row:
+                conn.execute("COMMIT")
+                return None
+            job = json.loads(row[0])
+            job.update({
+                "status": JOB_RUNNING,
+                "lease_id": uuid.uuid4().hex,
+                "lease_expires_at": now + visibility_timeout,
+                "worker_id": worker_id,
+                "attempts": job["attempts"] + 1,
+                "updated_at": now
+            })
+            self._save(conn, job)
+            conn.execute("COMMIT")
+            return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _finish(self, job: Dict[str, Any], updates: Dict[str, Any]) -> bool:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT data FROM jobs WHERE job_id = ? AND lease_id = ?",
+                (job["job_id"], job["lease_id"])
+            ).fetchone()
+            if not row:
+                conn.execute("COMMIT")
+                return False
+            stored = json.loads(row[0])
+            stored.update(updates, lease_id=None, updated_at=time.time())
+            self._save(conn, stored)
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def complete(self, job, result):
+        return self._finish(job, {"status": JOB_SUCCEEDED, "result": result, "error": None})
+
+    def fail(self, job, error, retry=True):
+        return self._finish(job, {
+            "status": self._final_status(job, retry),
+            "error": error,
+            "lease_expires_at": None
+        })
+
+    def _get(self, job_id):
+        row = self._connection().execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+class RedisJobQueue(JobQueue):
+    """
+    Job queue stored in Redis.
+
+    Job records live in "jobs:<id>" keys; visible job IDs in the "jobs:queued"
+    list; leased IDs in the "jobs:leased" sorted set scored by lease expiry.
+    A job ID moves between the two in one step (a Lua script or a
+    WATCH/MULTI transaction), so it is always in one of them until the job
+    finishes, whenever a worker dies.
+    """
+
+    QUEUED_KEY = "jobs:queued"
+    LEASED_KEY = "jobs:leased"
+
+    # Pop the oldest visible job ID and mark it leased until ARGV[1]
+    LEASE_SCRIPT = """
+local job_id = redis.call('RPOP', KEYS[1])
+if job_id then
+    redis.call('ZADD', KEYS[2], ARGV[1], job_id)
+end
+return job_id
+"""
+
+    def __init__(self):
+        super().__init__()
+        import redis
+        self.redis = redis.Redis(
+            host=os.environ.get('REDIS_HOST', 'localhost'),
+            port=int(os.environ.get('REDIS_PORT', '6379')),
+            password=os.environ.get('REDIS_PASSWORD') or None,
+            db=int(os.environ.get('REDIS_DB', '0')),
+            decode_responses=True
+        )
+        self.result_ttl = int(os.environ.get('JOB_RESULT_TTL', str(7 * 24 * 3600)))
+        self._lease_script = self.redis.register_script(self.LEASE_SCRIPT)
+
+    def _key(self, job_id: str) -> str:
+        return f"jobs:{job_id}"
+
+    def _save(self, job: Dict[str, Any], client=None) -> None:
+        ttl = self.result_ttl if job["status"] in (JOB_SUCCEEDED, JOB_FAILED) else None
+        (client or self.redis).set(self._key(job["job_id"]), json.dumps(job, default=str), ex=ttl)
+
+    def enqueue(self, payload):
+        job = _new_job(payload, self.max_attempts)
+        self._save(job)
+        self.redis.lpush(self.QUEUED_KEY, job["job_id"])
+        return job["job_id"]
+
+    def _transaction(self, job_id: str, update: Callable[[Any, Dict[str, Any]], bool]) -> bool:
+        """
+        Change a job atomically: update(pipe, job) reads what it needs through
+        pipe, calls pipe.multi() and queues its commands, or returns False to
+        abort. Every change to a job rewrites its record, so watching the
+        record discards the commands (returning False) if another worker
+        changed the job in between.
+        """
+        import redis
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(self._key(job_id))
+                data = pipe.get(self._key(job_id))
+                if not data or not update(pipe, json.loads(data)):
+                    return False
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                return False
+
+    def _requeue_expired(self) -> None:
+        """
+        Make jobs with expired leases visible again, or fail them when their
+        last attempt's lease expired. The expired lease is revoked, so its
+        worker can no longer record a result.
+        """
+        now = time.time()
+        for job_id in self.redis.zrangebyscore(self.LEASED_KEY, 0, now):
+            def update(pipe, job):
+                expires_at = pipe.zscore(self.LEASED_KEY, job_id)
+                if expires_at is None or expires_at > now:
+                    # Another worker requeued or finished it first
+                    return False
+                pipe.multi()
+                pipe.zrem(self.LEASED_KEY, job_id)
+                if job["attempts"] >= job["max_attempts"]:
+                    job.update(status=JOB_FAILED, error=self._lease_expired_error(job))
+                else:
+                    job["status"] = JOB_QUEUED
+                    pipe.rpush(self.QUEUED_KEY, job_id)
+                job.update(lease_id=None, lease_expires_at=None, updated_at=now)
+                self._save(job, pipe)
+                return True
+            self._transaction(job_id, update)
+
+    def lease(self, worker_id, visibility_timeout):
+        self._requeue_expired()
+        now = time.time()
+        # Popped and added to the leased set in one step: if this worker dies
+        # before the record is updated, the lease expires and the job is requeued
+        job_id = self._lease_script(keys=[self.QUEUED_KEY, self.LEASED_KEY], args=[now + visibility_timeout])
+        if not job_id:
+            return None
+        leased = {}
+
+        def update(pipe, job):
+            if job["status"] != JOB_QUEUED:
+                return False
+            job.update({
+                "status": JOB_RUNNING,
+                "lease_id": uuid.uuid4().hex,
+                "lease_expires_at": now + visibility_timeout,
+                "worker_id": worker_id,
+                "attempts": job["attempts"] + 1,
+                "updated_at": now
+            })
+            pipe.multi()
+            self._save(job, pipe)
+            leased.update(job)
+            return True
+        if not self._transaction(job_id, update):
+            # Stale ID of a finished or missing job
+            self.redis.zrem(self.LEASED_KEY, job_id)
+            return None
+        return leased
+
+    def _finish(self, job: Dict[str, Any], updates: Dict[str, Any]) -> bool:
+        def update(pipe, stored):
+            if stored.get("lease_id") != job["lease_id"]:
+                return False
+            stored.update(updates, lease_id=None, updated_at=time.time())
+            pipe.multi()
+            pipe.zrem(self.LEASED_KEY, job["job_id"])
+            self._save(stored, pipe)
+            if stored["status"] == JOB_QUEUED:
+                pipe.rpush(self.QUEUED_KEY, job["job_id"])
+            return True
+        return self._transaction(job["job_id"], update)
+
+    def complete(self, job, result):
+        return self._finish(job, {"status": JOB_SUCCEEDED, "result": result, "error": None})
+
+    def fail(self, job, error, retry=True):
+        return self._finish(job, {
+            "status": self._final_status(job, retry),
+            "error": error,
+            "lease_expires_at": None
+        })
+
+    def _get(self, job_id):
+        data = self.redis.get(self._key(job_id))
+        return json.loads(data) if data else None
+
+
+def get_job_queue(db=None) -> JobQueue:
+    """
+    Create the job queue configured by JOB_QUEUE_BACKEND.
+
+    Args:
+        db: MongoDB instance (required for the "mongo" backend)
+
+    Returns:
+        A JobQueue instance
+    """
+    backend = os.environ.get('JOB_QUEUE_BACKEND', 'mongo').lower()
+    if backend == 'sqlite':
+        return SQLiteJobQueue()
+    if backend == 'redis':
+        return RedisJobQueue()
+    if backend == 'mongo':
+        if db is None:
+            from utils.db import MongoDB
+            db = MongoDB.get_instance()
+        return MongoJobQueue(db)
+    raise ValueError(f"Unknown JOB_QUEUE_BACKEND: {backend}")
+
+
+class JobWorkerPool:
+    """
+    Pool of worker threads that lease jobs and run a handler on their payload.
+
+    Handlers raising EmailProcessingError fail the job immediately; any other
+    exception is retried until the job's max_attempts is reached.
+    """
+
+    def __init__(self,
+                 queue: JobQueue,
+                 handler: Callable[[Dict[str, Any]], Dict[str, Any]],
+                 concurrency: Optional[int] = None):
+        """
+        Initialize the pool.
+
+        Args:
+            queue: The job queue to drain
+            handler: Called with the job payload; returns the job result
+            concurrency: Number of worker threads (default JOB_WORKERS or 2)
+        """
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency if concurrency is not None else int(os.environ.get('JOB_WORKERS', '2'))
+        self.visibility_timeout = float(os.environ.get('JOB_VISIBILITY_TIMEOUT', '120'))
+        self.poll_interval = float(os.environ.get('JOB_POLL_INTERVAL', '0.5'))
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """Start the worker threads."""
+        self._stop.clear()
+        for i in range(self.concurrency):
+            thread = threading.Thread(
+                target=self._run,
+                args=(f"{socket.gethostname()}:{os.getpid()}:{i}",),
+                name=f"job-worker-{i}",
+                daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop leasing new jobs and wait for running ones to finish."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self, worker_id: str) -> None:
+        while not self._stop.is_set():
+            try:
+                job = self.queue.lease(worker_id, self.visibility_timeout)
+            except Exception as e:
+                log.error("jobs.lease_failed", error=str(e))
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+
+            # Log lines of the job share its id as their request id
+            token = set_request_id(job["job_id"])
+            try:
+                self._handle(job)
+            except Exception as e:
+                log.error("jobs.record_failed", job_id=job["job_id"], error=str(e))
+            finally:
+                reset_request_id(token)
+
+    def _handle(self, job: Dict[str, Any]) -> None:
+        """Run the handler for one leased job and record the outcome."""
+        try:
+            result = self.handler(job["payload"])
+        except EmailProcessingError as e:
+            self.queue.fail(job, e.message, retry=False)
+            return
+        except Exception as e:
+            log.error("jobs.failed", job_id=job["job_id"], error=str(e))
+            self.queue.fail(job, str(e))
+            return
+
+        if not self.queue.complete(job, result):
+            log.warning("jobs.lease_lost", job_id=job["job_id"])
@@ -0,0 +1,245 @@
+"""
+Tolerant JSON parsing for model output, and counters of how often it was
+needed.
+
+Models wrap JSON in ```json fences, add prose around it, leave trailing
+commas, print Python literals, put raw newlines inside strings or get cut
+off by max_tokens in the middle of an array. Each of these used to throw
+away a paid-for response; repair_json recovers what is there instead.
+"""
+import json
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+_FENCE_RE = re.compile(r'```(?:json|JSON)?\s*\n?(.*?)(?:```|$)', re.DOTALL)
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_CLOSERS = {'{': '}', '[': ']'}
+
+
+def repair_json(text: Optional[str], expected_type: Optional[type] = None) -> Tuple[Any, bool]:
+    """
+    Parse the first JSON object or array in a model response.
+
+    Brackets in prose before the JSON ("see [1]: {...}") are skipped: each
+    "{" or "[" is tried in turn until one starts a value of the expected
+    type, first as is, then with repairs.
+
+    Args:
+        text: Raw model output
+        expected_type: If given (e.g. dict), values of other types are skipped
+
+    Returns:
+        Tuple of (parsed value, whether it had to be repaired). Extracting
+        the JSON from fences or surrounding prose does not count as a repair.
+
+    Raises:
+        ValueError: If no JSON value can be recovered
+    """
+    if not text or not text.strip():
+        raise ValueError("Empty response")
+
+    fenced = _FENCE_RE.search(text)
+    if fenced and fenced.group(1).strip():
+        text = fenced.group(1)
+
+    starts = [i for i, char in enumerate(text) if char in _CLOSERS]
+    if not starts:
+        raise ValueError("No JSON object found in response")
+
+    def wanted(value: Any) -> bool:
+        return expected_type is None or isinstance(value, expected_type)
+
+    spans = {}
+    for start in starts:
+        spans[start] = candidate = _balanced_span(text, start)
+        if candidate is None:
+            continue
+        try:
+            value = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if wanted(value):
+            return value, False
+
+    # Repair from each start that is not inside a value already tried
+    tried_until = -1
+    for start in starts:
+        if start < tried_until:
+            continue
+        candidate = spans[start]
+        tried_until = start + len(candidate) if candidate is not None else len(text)
+        for attempt in _repair_candidates(candidate if candidate is not None else text[start:]):
+            try:
+                value = json.loads(attempt)
+            except json.JSONDecodeError:
+                continue
+            if wanted(value):
+                return value, True
+    raise ValueError("Could not repair JSON response")
+
+
+def _balanced_span(text: str, start: int) -> Optional[str]:
+    """Get the text of the value starting at start up to its matching closer, or None if truncated."""
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            depth += 1
+        elif char in '}]':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+
+def _repair_candidates(text: str) -> List[str]:
+    """
+    Rewrite a broken JSON value into candidates to try, best first.
+
+    Fixes trailing commas, Python literals and raw control characters in
+    strings. If the value is truncated, the first candidate closes the open
+    string and containers as they are (keeping a partial last string); the
+    second cuts back to the last complete element before closing.
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    # (output length, open containers) at points where the value so far is complete
+    safe_point: Tuple[int, List[str]] = (0, [])
+    in_string = False
+    escaped = False
+    i = 0
+
+    while i < len(text):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+                out.append(char)
+            elif char == '\\':
+                escaped = True
+                out.append(char)
+            elif char == '"':
+                in_string = False
+                out.append(char)
+            elif char == '\n':
+                out.append('\\n')
+            elif char == '\r':
+                out.append('\\r')
+            elif char == '\t':
+                out.append('\\t')
+            else:
+                out.append(char)
+            i += 1
+            continue
+
+        if char == '"':
+            in_string = True
+            out.append(char)
+        elif char in '{[':
+            stack.append(char)
+            out.append(char)
+            safe_point = (len(out), list(stack))
+        elif char in '}]':
+            _strip_trailing_comma(out)
+            if not stack:
+                break
+            stack.pop()
+            out.append(char)
+            safe_point = (len(out), list(stack))
+            if not stack:
+                break
+        elif char == ',':
+            safe_point = (len(out), list(stack))
+            out.append(char)
+        elif char.isascii() and char.isalpha():
+            word = re.match(r'[A-Za-z]+', text[i:]).group(0)
+            out.append(_PY_LITERALS.get(word, word))
+            i += len(word)
+            continue
+        else:
+            out.append(char)
+        i += 1
+
+    if not stack and not in_string:
+        return [''.join(out)]
+
+    candidates = []
+    as_is = list(out)
+    if in_string:
+        if escaped:
+            as_is.pop()
+        as_is.append('"')
+    _strip_trailing_comma(as_is)
+    candidates.append(''.join(as_is) + _closing(stack))
+
+    length, open_stack = safe_point
+    cut = out[:length]
+    _strip_trailing_comma(cut)
+    candidates.append(''.join(cut) + _closing(open_stack))
+    return candidates
+
+
+def _strip_trailing_comma(out: List[str]) -> None:
+    """Drop whitespace and a dangling comma from the end of the output."""
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ',':
+        out.pop()
+
+
+def _closing(stack: List[str]) -> str:
+    return ''.join(_CLOSERS[opener] for opener in reversed(stack))
+
+
+class JSONRepairStats:
+    """
+    Per-agent counts of model responses that parsed cleanly, needed repair,
+    or were lost (the agent fell back to its non-AI result).
+    """
+
+    OUTCOMES = ("clean", "repaired", "lost")
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = {}
+
+    def record(self, agent: Optional[str], outcome: str) -> None:
+        """Count one parse outcome ("clean", "repaired" or "lost")."""
+        with self._lock:
+            counts = self._counts.setdefault(agent or "other", dict.fromkeys(self.OUTCOMES, 0))
+            counts[outcome] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get per-agent and total outcome counts."""
+        with self._lock:
+            by_agent = {agent: dict(counts) for agent, counts in self._counts.items()}
+        totals = {outcome: sum(counts[outcome] for counts in by_agent.values()) for outcome in self.OUTCOMES}
+        parsed = sum(totals.values())
+        return {
+            **totals,
+            "lost_rate": round(totals["lost"] / parsed, 4) if parsed else 0.0,
+            "by_agent": by_agent
+        }
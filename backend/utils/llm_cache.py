@@ -0,0 +1,246 @@
+"""
+Content-addressed cache for AI responses.
+
+Responses are keyed by a hash of everything that determines the output
+(model, system instruction, prompt, temperature, max tokens and, for
+structured output, the response schema). Lookups go
+through a bounded in-memory LRU first, then a SQLite file shared by all
+worker processes on the host.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Any
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)),
+    'data',
+    'llm_cache.sqlite3'
+)
+
+
+class LLMCache:
+    """
+    Two-tier (memory LRU + SQLite) cache for AI responses.
+
+    Configuration (environment variables):
+    - LLM_CACHE_ENABLED: "true" to enable caching (default true)
+    - LLM_CACHE_AGENTS: comma-separated agents that opt in (default "classifier,summarizer")
+    - LLM_CACHE_DISK_ENABLED: "false" keeps the cache in memory only (default true)
+    - LLM_CACHE_PATH: SQLite file path (default data/llm_cache.sqlite3)
+    - LLM_CACHE_TTL: entry lifetime in seconds (default 7 days)
+    - LLM_CACHE_MAX_ENTRIES: size of the in-memory LRU (default 2048)
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def reset_after_fork(cls) -> None:
+        """SQLite connections must not cross fork(); a forked worker opens its own."""
+        cls._instance = None
+        cls._instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.enabled = os.environ.get('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+        self.agents = {
+            name.strip()
+            for name in os.environ.get('LLM_CACHE_AGENTS', 'classifier,summarizer').split(',')
+            if name.strip()
+        }
+        self.ttl = int(os.environ.get('LLM_CACHE_TTL', str(7 * 24 * 3600)))
+        self.max_entries = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', '2048'))
+        self.path = ''
+        if os.environ.get('LLM_CACHE_DISK_ENABLED', 'true').lower() == 'true':
+            self.path = os.environ.get('LLM_CACHE_PATH') or DEFAULT_CACHE_PATH
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+        if self.enabled and self.path:
+            try:
+                self._connection().execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    " key TEXT PRIMARY KEY,"
+                    " namespace TEXT,"
+                    " response TEXT NOT NULL,"
+                    " expires_at REAL NOT NULL)"
+                )
+                self._connection().execute(
+                    "CREATE INDEX IF NOT EXISTS idx_llm_cache_expires ON llm_cache (expires_at)"
+                )
+            except sqlite3.Error as e:
+                log.error("llm_cache.init_failed", path=self.path, error=str(e))
+                self.path = ''
+
+    @staticmethod
+    def make_key(model: str,
+                 system_instruction: Optional[str],
+                 prompt: str,
+                 temperature: float,
+                 max_tokens: int,
+                 response_format: Any = None) -> str:
+        """
+        Build the content-addressed key for a request.
+
+        Args:
+            response_format: JSON-serializable description of the requested
+                output format (schema and structured-output mode), if any
+
+        Returns:
+            Hex SHA-256 digest of the request parameters
+        """
+        params = [model, system_instruction or '', prompt, round(float(temperature), 4), int(max_tokens)]
+        if response_format is not None:
+            params.append(response_format)
+        payload = json.dumps(params, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def enabled_for(self, namespace: Optional[str]) -> bool:
+        """Check whether caching applies to the given agent namespace."""
+        return self.enabled and bool(namespace) and namespace in self.agents
+
+    def get(self, key: str, namespace: str) -> Optional[str]:
+        """
+        Look up a cached response.
+
+        Args:
+            key: Key from make_key
+            namespace: Agent namespace, used for hit/miss counters
+
+        Returns:
+            The cached response text, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                response, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._count(namespace, 'memory_hits')
+                    return response
+                del self._memory[key]
+
+        if self.path:
+            try:
+                row = self._connection().execute(
+                    "SELECT response, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?",
+                    (key, now)
+                ).fetchone()
+            except sqlite3.Error as e:
+                log.error("llm_cache.read_failed", error=str(e))
+                row = None
+            if row:
+                self._remember(key, row[0], row[1])
+                with self._lock:
+                    self._count(namespace, 'disk_hits')
+                return row[0]
+
+        with self._lock:
+            self._count(namespace, 'misses')
+        return None
+
+    def set(self, key: str, namespace: str, response: str) -> None:
+        """
+        Store a response in both tiers.
+
+        Args:
+            key: Key from make_key
+            namespace: Agent namespace
+            response: Response text to cache
+        """
+        expires_at = time.time() + self.ttl
+        self._remember(key, response, expires_at)
+
+        if not self.path:
+            return
+        try:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, namespace, response, expires_at) VALUES (?, ?, ?, ?)",
+                (key, namespace, response, expires_at)
+            )
+            with self._lock:
+                self._writes += 1
+                purge = self._writes % 500 == 0
+            if purge:
+                conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            log.error("llm_cache.write_failed", error=str(e))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get hit/miss counters per agent namespace.
+
+        Returns:
+            Dictionary with configuration and counters
+        """
+        with self._lock:
+            counters = {name: dict(values) for name, values in self._stats.items()}
+            memory_entries = len(self._memory)
+
+        for values in counters.values():
+            lookups = values.get('memory_hits', 0) + values.get('disk_hits', 0) + values.get('misses', 0)
+            hits = lookups - values.get('misses', 0)
+            values['hit_rate'] = round(hits / lookups, 4) if lookups else 0.0
+
+        return {
+            "enabled": self.enabled,
+            "agents": sorted(self.agents),
+            "memory_entries": memory_entries,
+            "disk_enabled": bool(self.path),
+            "by_agent": counters
+        }
+
+    def clear(self) -> None:
+        """Remove all cached entries from both tiers."""
+        with self._lock:
+            self._memory.clear()
+        if self.path:
+            try:
+                self._connection().execute("DELETE FROM llm_cache")
+            except sqlite3.Error as e:
+                log.error("llm_cache.clear_failed", error=str(e))
+
+    def _remember(self, key: str, response: str, expires_at: float) -> None:
+        """Insert into the memory tier, evicting the least recently used entry."""
+        with self._lock:
+            self._memory[key] = (response, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _count(self, namespace: str, counter: str) -> None:
+        """Increment a counter; caller must hold the lock."""
+        values = self._stats.setdefault(namespace, {'memory_hits': 0, 'disk_hits': 0, 'misses': 0})
+        values[counter] += 1
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get a SQLite connection for the current thread and process."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
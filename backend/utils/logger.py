@@ -0,0 +1,245 @@
+"""
+Structured, non-blocking logging.
+
+A log call on a request path only builds a record and puts it on an
+in-memory queue; a background listener thread formats it (one JSON object
+per line by default) and writes it to stderr, so callers never wait on a
+stream lock or a write() syscall. Every record carries the current request
+id (set per HTTP request and per job) so the lines of one request can be
+joined, and fields are passed as keyword arguments:
+
+    log = get_logger(__name__)
+    log.info("email.processed", email_id=email_id, total_ms=812.4)
+
+Records below WARNING are sampled per request: LOG_SAMPLE_RATE=0.1 keeps
+every line of 10% of requests. Warnings and errors are always kept. Log
+ids, labels, counts and durations, never email content (subjects, senders,
+bodies, summaries, replies).
+
+Configuration (environment variables):
+- LOG_LEVEL: minimum level (default INFO)
+- LOG_FORMAT: "json" or "text" (default json)
+- LOG_SAMPLE_RATE: fraction of requests whose DEBUG/INFO records are kept (default 1.0)
+- LOG_QUEUE_SIZE: records buffered for the writer thread; records beyond
+  it are dropped and counted rather than blocking the caller (default 10000)
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import zlib
+import queue
+import random
+import atexit
+import logging
+import threading
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+# Parent of every application logger; kept apart from the root logger so
+# library (httpx, werkzeug, gunicorn) logging is left as configured
+ROOT_LOGGER = "email_assistant"
+
+_request_id: contextvars.ContextVar = contextvars.ContextVar("request_id", default=None)
+
+# Accepted incoming X-Request-ID values
+_REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+_configure_lock = threading.Lock()
+_handler: Optional["NonBlockingQueueHandler"] = None
+_sample_rate = 1.0
+
+
+def new_request_id(candidate: Optional[str] = None) -> str:
+    """Use a well-formed incoming request id, or generate one."""
+    if candidate and _REQUEST_ID_PATTERN.match(candidate):
+        return candidate
+    return uuid.uuid4().hex
+
+
+def set_request_id(request_id: Optional[str]) -> contextvars.Token:
+    """Set the request id of the current context; returns a token for reset_request_id."""
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token: contextvars.Token) -> None:
+    """Restore the request id that was current before set_request_id."""
+    _request_id.reset(token)
+
+
+def get_request_id() -> Optional[str]:
+    """Get the request id of the current context, if any."""
+    return _request_id.get()
+
+
+def _sampled() -> bool:
+    """Keep this DEBUG/INFO record? Decided per request id so requests log whole."""
+    if _sample_rate >= 1:
+        return True
+    if _sample_rate <= 0:
+        return False
+    request_id = _request_id.get()
+    if request_id is None:
+        return random.random() < _sample_rate
+    return zlib.crc32(request_id.encode()) % 10000 < _sample_rate * 10000
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, event, request_id and fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+            "pid": record.process
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable single line: time level logger [request_id] event key=value..."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        parts = [
+            time.strftime("%H:%M:%S", time.localtime(record.created)),
+            record.levelname,
+            record.name
+        ]
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            parts.append(f"[{request_id}]")
+        parts.append(record.getMessage())
+        parts.extend(f"{key}={value}" for key, value in (getattr(record, "fields", None) or {}).items())
+        line = " ".join(str(part) for part in parts)
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to a listener thread through a bounded queue.
+
+    The listener is started on the first record of each process, so a
+    forked worker gets its own thread (and drops records queued in the
+    parent) without a post-fork hook, and a prefork master that logs
+    nothing starts no thread.
+    """
+
+    def __init__(self, maxsize: int, formatter: logging.Formatter):
+        super().__init__(queue.Queue(maxsize))
+        self.maxsize = maxsize
+        self.output_formatter = formatter
+        self.dropped = 0
+        self._pid: Optional[int] = None
+        self._listener: Optional[QueueListener] = None
+        self._start_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Message and traceback formatting happen on the listener thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # The parent's listener thread does not exist in a forked child
+            self.queue = queue.Queue(self.maxsize)
+            stream = logging.StreamHandler(sys.stderr)
+            stream.setFormatter(self.output_formatter)
+            self._listener = QueueListener(self.queue, stream)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def flush(self) -> None:
+        """Stop the listener after it has written every queued record."""
+        with self._start_lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+                self._listener = None
+                self._pid = None
+
+
+class EventLogger(logging.LoggerAdapter):
+    """
+    Logger taking an event name and keyword fields instead of a message:
+
+        log.warning("cache.write_failed", error=str(e))
+
+    Disabled and sampled-out calls return before a record is built.
+    """
+
+    def log(self, level: int, msg: Any, *args, exc_info=None, stack_info=False, **fields) -> None:
+        if not self.logger.isEnabledFor(level):
+            return
+        if level < logging.WARNING and not _sampled():
+            return
+        self.logger.log(level, msg, *args, exc_info=exc_info, stack_info=stack_info, stacklevel=3,
+                        extra={"fields": fields, "request_id": _request_id.get()})
+
+    def isEnabledFor(self, level: int) -> bool:
+        """Whether a call at this level would be logged (use to skip building costly fields)."""
+        return self.logger.isEnabledFor(level) and (level >= logging.WARNING or _sampled())
+
+
+def configure() -> NonBlockingQueueHandler:
+    """Attach the queue handler to the application loggers (once per process)."""
+    global _handler, _sample_rate
+    if _handler is not None:
+        return _handler
+    with _configure_lock:
+        if _handler is None:
+            _sample_rate = float(os.environ.get('LOG_SAMPLE_RATE', '1.0'))
+            formatter = TextFormatter() if os.environ.get('LOG_FORMAT', 'json').lower() == 'text' else JsonFormatter()
+            handler = NonBlockingQueueHandler(int(os.environ.get('LOG_QUEUE_SIZE', '10000')), formatter)
+
+            root = logging.getLogger(ROOT_LOGGER)
+            root.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+            root.addHandler(handler)
+            root.propagate = False
+
+            atexit.register(handler.flush)
+            _handler = handler
+    return _handler
+
+
+def get_logger(name: str) -> EventLogger:
+    """
+    Get the structured logger for a module.
+
+    Args:
+        name: Module name (usually __name__)
+    """
+    configure()
+    return EventLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"), {})
+
+
+def get_stats() -> Dict[str, Any]:
+    """Get the logging configuration and queue state."""
+    handler = configure()
+    return {
+        "level": logging.getLevelName(logging.getLogger(ROOT_LOGGER).level),
+        "sample_rate": _sample_rate,
+        "queued": handler.queue.qsize(),
+        "queue_size": handler.maxsize,
+        "dropped": handler.dropped
+    }
@@ -0,0 +1,188 @@
+"""
+Per-agent model routing by cost, latency and observed health.
+
+Each agent (and, for replies, each importance tier from ImportanceScorer)
+maps to a profile in data/model_routing.json: the minimum model quality it
+needs and whether to optimize for cost or latency. The router orders the
+models of the configured providers that meet the profile, using latencies
+and error rates observed on real calls rather than only the static priors.
+"""
+import os
+import json
+import threading
+from typing import Any, Dict, List, Optional
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_ROUTING_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)),
+    'data',
+    'model_routing.json'
+)
+
+
+class ModelStats:
+    """Exponentially weighted latency and error rate of one model."""
+
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self.latency_ms: Optional[float] = None
+        self.error_rate = 0.0
+        self.calls = 0
+        self.errors = 0
+
+    def record(self, latency: Optional[float], ok: bool) -> None:
+        self.calls += 1
+        self.errors += not ok
+        self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+        if ok and latency is not None:
+            ms = latency * 1000
+            self.latency_ms = ms if self.latency_ms is None else self.latency_ms + self.alpha * (ms - self.latency_ms)
+
+
+class ModelRouter:
+    """
+    Picks the models to try, best first, for an agent call.
+
+    Configuration (environment variables):
+    - MODEL_ROUTING_ENABLED: "false" to always use each provider's default model (default true)
+    - MODEL_ROUTING_PATH: routing config (default data/model_routing.json)
+    - MODEL_ROUTING_MAX_ERROR_RATE: models above this recent error rate are tried last (default 0.25)
+    - MODEL_ROUTING_EWMA_ALPHA: weight of the newest call in the observed stats (default 0.2)
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self.enabled = os.environ.get('MODEL_ROUTING_ENABLED', 'true').lower() == 'true'
+        self.max_error_rate = float(os.environ.get('MODEL_ROUTING_MAX_ERROR_RATE', '0.25'))
+        self.alpha = float(os.environ.get('MODEL_ROUTING_EWMA_ALPHA', '0.2'))
+
+        self._lock = threading.Lock()
+        self._stats: Dict[str, ModelStats] = {}
+        self._routes: Dict[str, Dict[str, int]] = {}
+        self._load_config(os.environ.get('MODEL_ROUTING_PATH') or DEFAULT_ROUTING_PATH)
+
+    def _load_config(self, path: str) -> None:
+        """Load the model catalog and routing profiles."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except Exception as e:
+            log.error("config.load_failed", config="model_routing", error=str(e))
+            config = {}
+        self.models: List[Dict[str, Any]] = config.get('models', [])
+        self.defaults: Dict[str, Any] = config.get('defaults', {})
+        self.agents: Dict[str, Dict[str, Any]] = config.get('agents', {})
+        self.importance_tiers: Dict[str, Dict[str, Any]] = config.get('importance_tiers', {})
+
+    def ensure_model(self, provider: str, model: str) -> None:
+        """Add a provider's configured default model to the catalog if it is not listed."""
+        with self._lock:
+            if not any(m["provider"] == provider and m["model"] == model for m in self.models):
+                self.models.append({"provider": provider, "model": model, "quality": 2,
+                                    "input_cost": 0.0, "output_cost": 0.0, "latency_ms": 1000})
+
+    def profile(self, agent: Optional[str], importance_level: Optional[str] = None) -> Dict[str, Any]:
+        """Merge the default, agent and importance tier profiles."""
+        return {
+            "min_quality": 1, "optimize": "cost",
+            "expected_input_tokens": 1000, "expected_output_tokens": 300,
+            **self.defaults,
+            **self.agents.get(agent or "", {}),
+            **self.importance_tiers.get(importance_level or "", {})
+        }
+
+    def route(self,
+              agent: Optional[str],
+              providers: List[str],
+              importance_level: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Order the models to try for a call.
+
+        Models meeting the profile come first, ranked by expected cost or
+        latency (both inflated by the observed error rate), then those over
+        the profile's latency limit, then lower-quality models (best first)
+        and finally models with a high recent error rate.
+
+        Args:
+            agent: Calling agent (e.g. "classifier")
+            providers: Providers with a configured client
+            importance_level: Importance tier of the email, if known
+
+        Returns:
+            Model entries ({"provider", "model", ...}), best first; empty if
+            routing is disabled
+        """
+        if not self.enabled:
+            return []
+
+        profile = self.profile(agent, importance_level)
+        with self._lock:
+            ranked = []
+            for m in self.models:
+                if m["provider"] not in providers:
+                    continue
+                stats = self._stats.get(f"{m['provider']}:{m['model']}")
+                latency = stats.latency_ms if stats and stats.latency_ms is not None else m.get("latency_ms", 1000)
+                error_rate = stats.error_rate if stats else 0.0
+                penalty = 1.0 / (1.0 - min(error_rate, 0.9))
+                cost = (profile["expected_input_tokens"] * m.get("input_cost", 0.0)
+                        + profile["expected_output_tokens"] * m.get("output_cost", 0.0)) / 1e6
+                if profile["optimize"] == "latency":
+                    key = (latency * penalty, cost)
+                else:
+                    key = (cost * penalty, latency * penalty)
+                quality = m.get("quality", 1)
+                if error_rate > self.max_error_rate:
+                    group = 3
+                elif quality < profile["min_quality"]:
+                    group = 2
+                elif profile.get("max_latency_ms") and latency > profile["max_latency_ms"]:
+                    group = 1
+                else:
+                    group = 0
+                ranked.append(((group, -quality if group == 2 else 0, key), m))
+
+            ranked.sort(key=lambda item: item[0])
+            route_name = f"{agent or 'other'}:{importance_level}" if importance_level else (agent or "other")
+            if ranked:
+                chosen = f"{ranked[0][1]['provider']}:{ranked[0][1]['model']}"
+                counts = self._routes.setdefault(route_name, {})
+                counts[chosen] = counts.get(chosen, 0) + 1
+        return [m for _, m in ranked]
+
+    def record(self, provider: str, model: str, latency: Optional[float], ok: bool) -> None:
+        """Feed the outcome of one provider call into the model's observed stats."""
+        key = f"{provider}:{model}"
+        with self._lock:
+            if key not in self._stats:
+                self._stats[key] = ModelStats(self.alpha)
+            self._stats[key].record(latency, ok)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get observed per-model stats and how often each route picked each model."""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "models": {
+                    key: {
+                        "calls": s.calls,
+                        "errors": s.errors,
+                        "error_rate": round(s.error_rate, 4),
+                        "latency_ms": round(s.latency_ms, 1) if s.latency_ms is not None else None
+                    }
+                    for key, s in self._stats.items()
+                },
+                "routes": {name: dict(counts) for name, counts in self._routes.items()}
+            }
@@ -0,0 +1,234 @@
+"""
+Near-duplicate email detection using SimHash fingerprints and an LSH index.
+
+Bulk mail from the same template (digests, invoices, receipts) differs only in
+numbers and dates. Digits are normalized before hashing, so such emails get
+identical or very close fingerprints and can reuse earlier AI results.
+"""
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+FINGERPRINT_BITS = 64
+BAND_BITS = 8
+BANDS = FINGERPRINT_BITS // BAND_BITS
+MIN_TOKENS = 8
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_DIGITS_RE = re.compile(r'\d+')
+
+
+def compute_fingerprint(subject: str, body: str) -> Optional[str]:
+    """
+    Compute a 64-bit SimHash fingerprint over word trigrams.
+
+    Args:
+        subject: Email subject
+        body: Email body
+
+    Returns:
+        Fingerprint as a 16-character hex string, or None if the email is too
+        short to fingerprint reliably
+    """
+    text = f"{subject or ''} {body or ''}".lower()
+    tokens = [_DIGITS_RE.sub('0', token) for token in _TOKEN_RE.findall(text)]
+    if len(tokens) < MIN_TOKENS:
+        return None
+
+    weights = [0] * FINGERPRINT_BITS
+    for i in range(len(tokens) - 2):
+        shingle = ' '.join(tokens[i:i + 3]).encode('utf-8')
+        value = int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), 'big')
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return f"{fingerprint:016x}"
+
+
+def similarity(a: str, b: str) -> float:
+    """
+    Similarity between two fingerprints (1 - normalized Hamming distance).
+
+    Returns:
+        Value between 0.0 and 1.0
+    """
+    distance = bin(int(a, 16) ^ int(b, 16)).count('1')
+    return 1.0 - distance / FINGERPRINT_BITS
+
+
+def _bands(fingerprint: str) -> List[tuple]:
+    """Split a fingerprint into (band_index, band_value) LSH keys."""
+    value = int(fingerprint, 16)
+    mask = (1 << BAND_BITS) - 1
+    return [(i, (value >> (i * BAND_BITS)) & mask) for i in range(BANDS)]
+
+
+class NearDuplicateIndex:
+    """
+    In-memory LSH index over processed-email fingerprints.
+
+    The 64-bit fingerprint is split into 8 bands of 8 bits; two fingerprints
+    within Hamming distance 7 (similarity >= 0.89) always share a band, so
+    thresholds at or above that never miss a candidate.
+
+    Configuration (environment variables):
+    - NEAR_DUP_ENABLED: "true" to reuse results (default true)
+    - NEAR_DUP_CLASSIFY_THRESHOLD: minimum similarity to reuse a classification (default 0.9)
+    - NEAR_DUP_SUMMARY_THRESHOLD: minimum similarity to reuse a summary (default 0.95)
+    - NEAR_DUP_INDEX_SIZE: maximum number of indexed emails (default 10000)
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self.enabled = os.environ.get('NEAR_DUP_ENABLED', 'true').lower() == 'true'
+        self.classify_threshold = float(os.environ.get('NEAR_DUP_CLASSIFY_THRESHOLD', '0.9'))
+        self.summary_threshold = float(os.environ.get('NEAR_DUP_SUMMARY_THRESHOLD', '0.95'))
+        self.max_entries = int(os.environ.get('NEAR_DUP_INDEX_SIZE', '10000'))
+
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._buckets: Dict[tuple, set] = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self._stats = {"classification_reused": 0, "summary_reused": 0}
+
+    def add(self, email_id: str, fingerprint: Optional[str], entry: Dict[str, Any]) -> None:
+        """
+        Index a processed email.
+
+        Args:
+            email_id: Email ID
+            fingerprint: SimHash fingerprint (ignored if None)
+            entry: Stored results; should include user_id, sender, and the
+                "classification" and "summarization" agent results
+        """
+        if not self.enabled or not fingerprint or not email_id:
+            return
+
+        with self._lock:
+            if email_id in self._entries:
+                return
+            self._entries[email_id] = {**entry, "email_id": email_id, "fingerprint": fingerprint}
+            for key in _bands(fingerprint):
+                self._buckets.setdefault(key, set()).add(email_id)
+
+            while len(self._entries) > self.max_entries:
+                old_id, old = self._entries.popitem(last=False)
+                for key in _bands(old["fingerprint"]):
+                    bucket = self._buckets.get(key)
+                    if bucket:
+                        bucket.discard(old_id)
+                        if not bucket:
+                            del self._buckets[key]
+
+    def find(self,
+             fingerprint: Optional[str],
+             threshold: float,
+             field: str,
+             user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Find the most similar indexed email that has a stored result.
+
+        Args:
+            fingerprint: Fingerprint of the email being processed
+            threshold: Minimum similarity (0.0-1.0)
+            field: Result that must be present ("classification" or "summarization")
+            user_id: If given, only match emails of this user
+
+        Returns:
+            The matching entry plus a "similarity" key, or None
+        """
+        if not self.enabled or not fingerprint:
+            return None
+
+        with self._lock:
+            candidates = set()
+            for key in _bands(fingerprint):
+                candidates.update(self._buckets.get(key, ()))
+
+            best, best_score = None, threshold
+            for email_id in candidates:
+                entry = self._entries[email_id]
+                if not entry.get(field):
+                    continue
+                if user_id is not None and entry.get("user_id") != user_id:
+                    continue
+                score = similarity(fingerprint, entry["fingerprint"])
+                if score >= best_score:
+                    best, best_score = entry, score
+
+            if best is None:
+                return None
+            self._stats["classification_reused" if field == "classification" else "summary_reused"] += 1
+            return {**best, "similarity": round(best_score, 4)}
+
+    def ensure_loaded(self, db) -> None:
+        """
+        Warm the index from recently processed emails in MongoDB (once).
+
+        Concurrent callers wait for the one load in progress; a failed load
+        is retried on the next call.
+
+        Args:
+            db: MongoDB instance
+        """
+        if self._loaded or not self.enabled:
+            return
+
+        with self._load_lock:
+            if self._loaded:
+                return
+            try:
+                docs = db.get_fingerprinted_emails(limit=self.max_entries)
+                if docs is None:
+                    return
+                for doc in docs:
+                    self.add(doc["email_id"], doc.get("fingerprint"), {
+                        "user_id": doc.get("user_id"),
+                        "sender": doc.get("sender"),
+                        "classification": {
+                            "category": doc.get("category"),
+                            "confidence": doc.get("classification_confidence", 0.8),
+                            "reasoning": doc.get("classification_reasoning", "Reused from near-duplicate email")
+                        } if doc.get("category") else None,
+                        "summarization": {
+                            "summary": doc.get("summary"),
+                            "key_points": doc.get("key_points", []),
+                            "action_items": doc.get("action_items", [])
+                        } if doc.get("summary") else None
+                    })
+            except Exception as e:
+                log.error("near_duplicate.load_failed", error=str(e))
+                return
+            self._loaded = True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get index size and reuse counters."""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "indexed": len(self._entries),
+                "classify_threshold": self.classify_threshold,
+                "summary_threshold": self.summary_threshold,
+                **self._stats
+            }
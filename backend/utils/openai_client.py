@@ -3,63 +3,109 @@ AI API client wrapper for the AI Email Assistant.
 Supports both OpenAI and Google Gemini.
 """
 import os
-import sys
-import json
-import re
-from typing import Dict, List, Any, Optional
+import asyncio
+import time
+import inspect
+import functools
+from typing import AsyncIterator, Dict, List, Any, Optional, Tuple
+from dotenv import load_dotenv
 from utils.errors import OpenAIAPIError
+from utils.llm_cache import LLMCache
+from utils.resilience import ResiliencePolicy, CircuitBreaker, is_retryable, is_request_error
+from utils.adaptive_limiter import AdaptiveLimiter
+from utils.client_registry import ClientRegistry, ProviderBackend
+from utils.tokens import TokenUsage, count_tokens
+from utils.json_repair import repair_json, JSONRepairStats
+from utils.context_cache import GeminiContextCache
+from utils.model_router import ModelRouter
+from utils.logger import get_logger
 
-try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
+log = get_logger(__name__)
 
-try:
+load_dotenv()
+
+
+@functools.lru_cache(maxsize=None)
+def gemini_structured_output() -> Tuple[bool, bool]:
+    """
+    Whether the installed Gemini SDK supports (JSON mode, response schemas);
+    both need newer SDKs than the pinned one. Only called on Gemini calls,
+    so the SDK is already imported by then.
+    """
     import google.generativeai as genai
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
+    fields = inspect.signature(genai.types.GenerationConfig).parameters
+    return 'response_mime_type' in fields, 'response_schema' in fields
 
 
 class OpenAIClient:
     """
     A wrapper around AI APIs (OpenAI or Gemini) for text generation.
+    
+    Every provider with an API key is configured; calls go to the first one
+    in AI_PROVIDER_ORDER and fail over to the next when it keeps failing or
+    its circuit breaker is open. Transient errors are retried with jittered
+    exponential backoff (see ResiliencePolicy).
+    
+    Agents pass a JSON schema (response_schema) to get structured output
+    where the provider supports it. LLM_STRUCTURED_OUTPUT selects the mode:
+    "schema" (default; OpenAI strict json_schema, Gemini response_schema),
+    "json" (JSON mode only) or "off" (prompt instructions only).
+    
+    Each call is routed to a model by the calling agent and, when known, the
+    email's importance tier (see ModelRouter); the provider defaults above
+    remain the fallback after the routed models.
     """
     
+    # Retry, hedging and circuit breaker state shared by every agent's client
+    resilience = ResiliencePolicy()
+    
     def __init__(self):
-        # Try Gemini first, then OpenAI
-        gemini_key = os.environ.get('GEMINI_API_KEY')
-        openai_key = os.environ.get('OPENAI_API_KEY')
+        order = [name.strip().lower() for name in os.environ.get('AI_PROVIDER_ORDER', 'gemini,openai').split(',')]
+        default_models = {
+            # gemini-2.0-flash: fast and free tier available
+            'gemini': 'gemini-2.0-flash',
+            'openai': os.environ.get('OPENAI_MODEL', 'gpt-4o-mini')
+        }
         
-        if gemini_key and GEMINI_AVAILABLE:
+        # SDK clients and connection pools are shared process-wide
+        self.registry = ClientRegistry.get_instance()
+        self.backends: List[ProviderBackend] = []
+        init_error = None
+        for name in order:
+            if name not in default_models or not os.environ.get(f'{name.upper()}_API_KEY'):
+                continue
             try:
-                genai.configure(api_key=gemini_key)
-                # Use gemini-2.0-flash (fast and free tier available)
-                self.client = genai.GenerativeModel('models/gemini-2.0-flash')
-                self.model_type = 'gemini'
-                self.model = 'gemini-2.0-flash'
-                print("✅ Using Google Gemini AI (gemini-2.0-flash)", file=sys.stderr)
+                self.backends.append(self.registry.backend(name, default_models[name]))
             except Exception as e:
-                print(f"Error initializing Gemini client: {str(e)}", file=sys.stderr)
-                raise OpenAIAPIError("Could not initialize AI service") from e
-        elif openai_key and OPENAI_AVAILABLE:
-            try:
-                self.client = OpenAI(api_key=openai_key)
-                self.model_type = 'openai'
-                self.model = os.environ.get('OPENAI_MODEL', 'gpt-4o-mini')
-                print("✅ Using OpenAI GPT", file=sys.stderr)
-            except Exception as e:
-                print(f"Error initializing OpenAI client: {str(e)}", file=sys.stderr)
-                raise OpenAIAPIError("Could not initialize AI service") from e
-        else:
+                log.error("ai.client_init_failed", provider=name, error=str(e))
+                init_error = e
+        
+        if not self.backends:
+            if init_error:
+                raise OpenAIAPIError("Could not initialize AI service") from init_error
             raise ValueError("No AI API key found. Set GEMINI_API_KEY or OPENAI_API_KEY environment variable")
+        
+        # The primary backend; also used for response cache keys
+        primary = self.backends[0]
+        self.client = primary.client
+        self.async_client = primary.async_client
+        self.model_type = primary.name
+        self.model = primary.model
+        
+        self.structured_output = os.environ.get('LLM_STRUCTURED_OUTPUT', 'schema').lower()
+        
+        self.router = ModelRouter.get_instance()
+        for backend in self.backends:
+            self.router.ensure_model(backend.name, backend.model)
     
     def generate_text(self, 
                      prompt: str, 
                      system_instruction: Optional[str] = None,
                      temperature: float = 0.7,
-                     max_tokens: int = 1024) -> str:
+                     max_tokens: int = 1024,
+                     cache_namespace: Optional[str] = None,
+                     response_schema: Optional[Dict[str, Any]] = None,
+                     importance_level: Optional[str] = None) -> str:
         """
         Generate text using AI API (OpenAI or Gemini).
         
@@ -68,55 +114,708 @@ class OpenAIClient:
             system_instruction: System instruction for the model
             temperature: Creativity level (0.0-2.0)
             max_tokens: Maximum tokens in response
+            cache_namespace: Agent name for the response cache; the cache is
+                only consulted if this agent has opted in
+            response_schema: JSON schema of the expected response, for
+                providers with structured output
+            importance_level: Importance tier of the email (ImportanceScorer
+                level), for model routing
             
         Returns:
             Generated text response
         """
+        backends = self._route(cache_namespace, importance_level)
+        cache = LLMCache.get_instance()
+        caching = cache.enabled_for(cache_namespace)
+        if caching:
+            cached = cache.get(self._cache_key(self._primary_model(backends), system_instruction, prompt,
+                                               temperature, max_tokens, response_schema),
+                               cache_namespace)
+            if cached is not None:
+                return cached
+        
         try:
-            if self.model_type == 'gemini':
-                # Combine system instruction and prompt for Gemini
-                full_prompt = prompt
-                if system_instruction:
-                    full_prompt = f"{system_instruction}\n\n{prompt}"
-                
-                response = self.client.generate_content(
-                    full_prompt,
-                    generation_config={
-                        'temperature': temperature,
-                        'max_output_tokens': max_tokens,
-                    }
-                )
-                return response.text
-                
-            else:  # OpenAI
-                messages = []
-                
-                if system_instruction:
-                    messages.append({"role": "system", "content": system_instruction})
-                
-                messages.append({"role": "user", "content": prompt})
-                
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens
-                )
-                
-                return response.choices[0].message.content
+            text, usage, model = self._call_with_failover(
+                prompt, system_instruction, temperature, max_tokens, response_schema, backends
+            )
+        except Exception as e:
+            log.error("ai.generate_failed", agent=cache_namespace, error=str(e))
+            raise OpenAIAPIError("AI service is temporarily unavailable") from e
+        
+        self._record_usage(cache_namespace, model, system_instruction, prompt, text, usage)
+        if caching and self._cacheable(text, response_schema):
+            cache.set(self._cache_key(model, system_instruction, prompt, temperature, max_tokens, response_schema),
+                      cache_namespace, text)
+        return text
+    
+    async def agenerate_text(self,
+                             prompt: str,
+                             system_instruction: Optional[str] = None,
+                             temperature: float = 0.7,
+                             max_tokens: int = 1024,
+                             cache_namespace: Optional[str] = None,
+                             response_schema: Optional[Dict[str, Any]] = None,
+                             importance_level: Optional[str] = None) -> str:
+        """
+        Asynchronous variant of generate_text.
+        
+        Awaits the provider call instead of blocking the worker thread, so many
+        requests can be in flight on a single event loop. Slow calls may be
+        hedged with a duplicate request (LLM_HEDGE_ENABLED).
+        
+        Args:
+            prompt: The user prompt
+            system_instruction: System instruction for the model
+            temperature: Creativity level (0.0-2.0)
+            max_tokens: Maximum tokens in response
+            cache_namespace: Agent name for the response cache; the cache is
+                only consulted if this agent has opted in
+            response_schema: JSON schema of the expected response, for
+                providers with structured output
+            importance_level: Importance tier of the email (ImportanceScorer
+                level), for model routing
             
+        Returns:
+            Generated text response
+        """
+        backends = self._route(cache_namespace, importance_level)
+        cache = LLMCache.get_instance()
+        caching = cache.enabled_for(cache_namespace)
+        if caching:
+            cached = await asyncio.to_thread(
+                cache.get, self._cache_key(self._primary_model(backends), system_instruction, prompt,
+                                           temperature, max_tokens, response_schema),
+                cache_namespace
+            )
+            if cached is not None:
+                return cached
+        
+        try:
+            text, usage, model = await self._acall_with_failover(
+                prompt, system_instruction, temperature, max_tokens, response_schema, backends
+            )
         except Exception as e:
-            error_msg = f"Error generating text with AI API: {str(e)}"
-            print(error_msg, file=sys.stderr)
+            log.error("ai.generate_failed", agent=cache_namespace, error=str(e))
             raise OpenAIAPIError("AI service is temporarily unavailable") from e
+        
+        self._record_usage(cache_namespace, model, system_instruction, prompt, text, usage)
+        if caching and self._cacheable(text, response_schema):
+            await asyncio.to_thread(
+                cache.set, self._cache_key(model, system_instruction, prompt, temperature, max_tokens, response_schema),
+                cache_namespace, text
+            )
+        return text
     
-    def parse_json_response(self, response: str, required_fields: List[str] = None) -> Dict[str, Any]:
+    async def astream_text(self,
+                           prompt: str,
+                           system_instruction: Optional[str] = None,
+                           temperature: float = 0.7,
+                           max_tokens: int = 1024,
+                           cache_namespace: Optional[str] = None,
+                           response_schema: Optional[Dict[str, Any]] = None,
+                           importance_level: Optional[str] = None) -> AsyncIterator[str]:
         """
-        Parse a JSON response from OpenAI API in a robust way.
+        Stream generated text chunk by chunk as the provider produces it.
+        
+        A cached response is yielded as a single chunk; a completed stream is
+        stored in the cache like generate_text results. Retries and failover
+        only apply until the first chunk has been yielded.
         
         Args:
-            response: The text response from OpenAI
+            prompt: The user prompt
+            system_instruction: System instruction for the model
+            temperature: Creativity level (0.0-2.0)
+            max_tokens: Maximum tokens in response
+            cache_namespace: Agent name for the response cache
+            response_schema: JSON schema of the expected response
+            importance_level: Importance tier of the email, for model routing
+            
+        Yields:
+            Text chunks in order
+            
+        Raises:
+            OpenAIAPIError: If the request fails before or during streaming
+        """
+        backends = self._route(cache_namespace, importance_level)
+        cache = LLMCache.get_instance()
+        caching = cache.enabled_for(cache_namespace)
+        if caching:
+            cached = await asyncio.to_thread(
+                cache.get, self._cache_key(self._primary_model(backends), system_instruction, prompt,
+                                           temperature, max_tokens, response_schema),
+                cache_namespace
+            )
+            if cached is not None:
+                yield cached
+                return
+        
+        policy = self.resilience
+        parts = []
+        last_error: Optional[BaseException] = None
+        for index, backend in enumerate(backends):
+            breaker = policy.breaker(backend.name)
+            if not breaker.allow():
+                last_error = last_error or RuntimeError(f"Circuit breaker open for {backend.name}")
+                continue
+            if index > 0:
+                policy.count("failovers")
+            
+            try:
+                for attempt in range(policy.max_retries + 1):
+                    try:
+                        async with backend.limiter.slot(track_latency=False):
+                            async for chunk in self._astream_provider(backend, prompt, system_instruction,
+                                                                      temperature, max_tokens, response_schema):
+                                parts.append(chunk)
+                                yield chunk
+                    except Exception as e:
+                        invalid_request = not self._record_error(backend, breaker, e)
+                        last_error = e
+                        if parts or invalid_request:
+                            log.error("ai.stream_failed", agent=cache_namespace, provider=backend.name, error=str(e))
+                            raise OpenAIAPIError("AI service is temporarily unavailable") from e
+                        if not self._should_retry(attempt, e, breaker):
+                            break
+                        policy.count("retries")
+                        await asyncio.sleep(policy.retry_delay(attempt, e))
+                        continue
+                    
+                    breaker.record_success()
+                    # Stream duration depends on the response length, so only health is recorded
+                    self.router.record(backend.name, backend.model, None, True)
+                    text = ''.join(parts)
+                    self._record_usage(cache_namespace, backend.model, system_instruction, prompt, text, None)
+                    if caching and self._cacheable(text, response_schema):
+                        await asyncio.to_thread(
+                            cache.set, self._cache_key(backend.model, system_instruction, prompt, temperature,
+                                                       max_tokens, response_schema),
+                            cache_namespace, text
+                        )
+                    return
+            finally:
+                # Covers errors that are not the provider's fault and a client disconnect
+                breaker.release()
+        
+        policy.count("exhausted")
+        log.error("ai.stream_failed", agent=cache_namespace, error=str(last_error))
+        raise OpenAIAPIError("AI service is temporarily unavailable") from last_error
+    
+    @classmethod
+    def reset_after_fork(cls) -> None:
+        """
+        Give a forked worker process its own provider clients and resilience
+        state. Existing OpenAIClient instances keep the parent's clients, so
+        the agents holding them must be recreated too.
+        """
+        ClientRegistry.reset_after_fork()
+        cls.resilience = ResiliencePolicy()
+    
+    @classmethod
+    def get_resilience_stats(cls) -> Dict[str, Any]:
+        """
+        Get retry, failover and hedge counters, circuit breaker states and the
+        adaptive concurrency limit of each provider/model.
+        """
+        return {**cls.resilience.get_stats(), "limiters": AdaptiveLimiter.get_all_stats()}
+    
+    @classmethod
+    def get_client_stats(cls) -> Dict[str, Any]:
+        """Get the shared SDK client pools and connection warm-up results."""
+        return ClientRegistry.get_instance().get_stats()
+    
+    @classmethod
+    def get_routing_stats(cls) -> Dict[str, Any]:
+        """Get observed per-model latency and error rates and the models each route picked."""
+        return ModelRouter.get_instance().get_stats()
+    
+    def _cache_key(self,
+                   model: str,
+                   system_instruction: Optional[str],
+                   prompt: str,
+                   temperature: float,
+                   max_tokens: int,
+                   response_schema: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Response cache key for a call. Responses are stored under the model
+        that produced them and looked up under the route's first model, so
+        routing tiers (and failover models) never serve each other's outputs;
+        schema calls are also keyed by the schema and structured-output mode.
+        """
+        response_format = [self.structured_output, response_schema] if response_schema else None
+        return LLMCache.make_key(model, system_instruction, prompt, temperature, max_tokens, response_format)
+    
+    def _primary_model(self, backends: List[ProviderBackend]) -> str:
+        """Model a routed call tries first (its cache lookup model)."""
+        return backends[0].model if backends else self.model
+    
+    @staticmethod
+    def _cacheable(text: str, response_schema: Optional[Dict[str, Any]]) -> bool:
+        """
+        Whether a response may be cached. For schema calls it must be a JSON
+        object with the schema's required fields, so a malformed or truncated
+        answer is not replayed to every worker until it expires.
+        """
+        if not text:
+            return False
+        if not response_schema:
+            return True
+        try:
+            value, _ = repair_json(text, expected_type=dict)
+        except ValueError:
+            return False
+        return all(field in value for field in response_schema.get("required", []))
+    
+    def _route(self, agent: Optional[str], importance_level: Optional[str] = None) -> List[ProviderBackend]:
+        """
+        Get the backends to try for a call: the routed models best first,
+        then any provider default not already among them.
+        """
+        routed: List[ProviderBackend] = []
+        for spec in self.router.route(agent, [b.name for b in self.backends], importance_level):
+            backend = self._backend_for(spec["provider"], spec["model"])
+            if backend is not None and backend not in routed:
+                routed.append(backend)
+        return routed + [b for b in self.backends if b not in routed]
+    
+    def _backend_for(self, provider: str, model: str) -> Optional[ProviderBackend]:
+        """Get the shared backend for a model of one of the configured providers."""
+        if not any(b.name == provider for b in self.backends):
+            return None
+        try:
+            return self.registry.backend(provider, model)
+        except Exception as e:
+            log.error("ai.client_init_failed", provider=provider, model=model, error=str(e))
+            return None
+    
+    def _should_retry(self, attempt: int, error: BaseException, breaker: CircuitBreaker) -> bool:
+        """Whether to retry the same backend after a failed attempt."""
+        return (attempt < self.resilience.max_retries
+                and is_retryable(error)
+                and breaker.state != CircuitBreaker.OPEN)
+    
+    def _record_error(self, backend: ProviderBackend, breaker: CircuitBreaker, error: BaseException) -> bool:
+        """
+        Account for a failed attempt on a backend.
+        
+        Returns:
+            False if the request itself is invalid and must not be sent to
+            another backend
+        """
+        if is_request_error(error):
+            return False
+        if is_retryable(error):
+            breaker.record_failure()
+            self.router.record(backend.name, backend.model, None, False)
+        return True
+    
+    def _call_with_failover(self,
+                            prompt: str,
+                            system_instruction: Optional[str],
+                            temperature: float,
+                            max_tokens: int,
+                            response_schema: Optional[Dict[str, Any]] = None,
+                            backends: Optional[List[ProviderBackend]] = None) -> Tuple[str, Optional[Dict[str, int]], str]:
+        """
+        Call the backends (default: provider defaults) in order with retries,
+        skipping open breakers.
+        
+        Transient errors (timeouts, connection errors, 429, 5xx) are retried
+        and count against the backend's breaker; provider-specific errors
+        (auth, unknown model, content block) move on to the next backend
+        without tripping it; an invalid request (400, 422) is raised as is.
+        
+        Returns:
+            Tuple of (text, provider-reported usage or None, model used)
+        """
+        policy = self.resilience
+        last_error: Optional[BaseException] = None
+        for index, backend in enumerate(backends or self.backends):
+            breaker = policy.breaker(backend.name)
+            if not breaker.allow():
+                last_error = last_error or RuntimeError(f"Circuit breaker open for {backend.name}")
+                continue
+            if index > 0:
+                policy.count("failovers")
+            
+            try:
+                for attempt in range(policy.max_retries + 1):
+                    try:
+                        with backend.limiter.slot():
+                            started = time.perf_counter()
+                            text, usage = self._call_provider(
+                                backend, prompt, system_instruction, temperature, max_tokens, response_schema
+                            )
+                    except Exception as e:
+                        if not self._record_error(backend, breaker, e):
+                            raise
+                        last_error = e
+                        if not self._should_retry(attempt, e, breaker):
+                            break
+                        policy.count("retries")
+                        time.sleep(policy.retry_delay(attempt, e))
+                        continue
+                    
+                    breaker.record_success()
+                    elapsed = time.perf_counter() - started
+                    policy.latency(backend.name).record(elapsed)
+                    self.router.record(backend.name, backend.model, elapsed, True)
+                    return text, usage, backend.model
+            finally:
+                breaker.release()
+        
+        policy.count("exhausted")
+        raise last_error
+    
+    async def _acall_with_failover(self,
+                                   prompt: str,
+                                   system_instruction: Optional[str],
+                                   temperature: float,
+                                   max_tokens: int,
+                                   response_schema: Optional[Dict[str, Any]] = None,
+                                   backends: Optional[List[ProviderBackend]] = None) -> Tuple[str, Optional[Dict[str, int]], str]:
+        """Awaitable variant of _call_with_failover, with optional hedging."""
+        policy = self.resilience
+        last_error: Optional[BaseException] = None
+        for index, backend in enumerate(backends or self.backends):
+            breaker = policy.breaker(backend.name)
+            if not breaker.allow():
+                last_error = last_error or RuntimeError(f"Circuit breaker open for {backend.name}")
+                continue
+            if index > 0:
+                policy.count("failovers")
+            
+            try:
+                for attempt in range(policy.max_retries + 1):
+                    try:
+                        text, usage = await self._ahedged_call(
+                            backend, prompt, system_instruction, temperature, max_tokens, response_schema
+                        )
+                    except Exception as e:
+                        if not self._record_error(backend, breaker, e):
+                            raise
+                        last_error = e
+                        if not self._should_retry(attempt, e, breaker):
+                            break
+                        policy.count("retries")
+                        await asyncio.sleep(policy.retry_delay(attempt, e))
+                        continue
+                    
+                    breaker.record_success()
+                    return text, usage, backend.model
+            finally:
+                # A cancelled call (hedge loser, cancelled stage) ends a half-open trial too
+                breaker.release()
+        
+        policy.count("exhausted")
+        raise last_error
+    
+    async def _ahedged_call(self,
+                            backend: ProviderBackend,
+                            prompt: str,
+                            system_instruction: Optional[str],
+                            temperature: float,
+                            max_tokens: int,
+                            response_schema: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[Dict[str, int]]]:
+        """
+        Make one call; if it runs past the backend's latency percentile, send
+        a duplicate and return whichever finishes first successfully.
+        """
+        args = (backend, prompt, system_instruction, temperature, max_tokens, response_schema)
+        delay = self.resilience.hedge_delay(backend.name)
+        if delay is None:
+            return await self._aattempt(*args)
+        
+        first = asyncio.ensure_future(self._aattempt(*args))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+        
+        self.resilience.count("hedges")
+        hedge = asyncio.ensure_future(self._aattempt(*args))
+        pending = {first, hedge}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.resilience.count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def _aattempt(self,
+                        backend: ProviderBackend,
+                        prompt: str,
+                        system_instruction: Optional[str],
+                        temperature: float,
+                        max_tokens: int,
+                        response_schema: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[Dict[str, int]]]:
+        """Make one awaitable provider request and record its latency."""
+        async with backend.limiter.slot():
+            started = time.perf_counter()
+            result = await self._acall_provider(
+                backend, prompt, system_instruction, temperature, max_tokens, response_schema
+            )
+        elapsed = time.perf_counter() - started
+        self.resilience.latency(backend.name).record(elapsed)
+        self.router.record(backend.name, backend.model, elapsed, True)
+        return result
+    
+    def _call_provider(self,
+                       backend: ProviderBackend,
+                       prompt: str,
+                       system_instruction: Optional[str],
+                       temperature: float,
+                       max_tokens: int,
+                       response_schema: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[Dict[str, int]]]:
+        """
+        Make one blocking request to a provider.
+        
+        Returns:
+            Tuple of (text, provider-reported usage or None)
+        """
+        if backend.name == 'gemini':
+            model, contents = self._gemini_target(backend, prompt, system_instruction)
+            response = model.generate_content(
+                contents,
+                generation_config=self._build_gemini_config(temperature, max_tokens, response_schema)
+            )
+            return response.text, self._gemini_usage(response)
+        
+        # OpenAI
+        response = backend.client.chat.completions.create(
+            model=backend.model,
+            messages=self._build_openai_messages(prompt, system_instruction),
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **self._build_openai_format(response_schema)
+        )
+        return response.choices[0].message.content, self._openai_usage(response)
+    
+    async def _acall_provider(self,
+                              backend: ProviderBackend,
+                              prompt: str,
+                              system_instruction: Optional[str],
+                              temperature: float,
+                              max_tokens: int,
+                              response_schema: Optional[Dict[str, Any]] = None) -> Tuple[str, Optional[Dict[str, int]]]:
+        """Make one awaitable request to a provider."""
+        if backend.name == 'gemini':
+            model, contents = await self._agemini_target(backend, prompt, system_instruction)
+            response = await model.generate_content_async(
+                contents,
+                generation_config=self._build_gemini_config(temperature, max_tokens, response_schema)
+            )
+            return response.text, self._gemini_usage(response)
+        
+        # OpenAI
+        response = await backend.async_client.chat.completions.create(
+            model=backend.model,
+            messages=self._build_openai_messages(prompt, system_instruction),
+            temperature=temperature,
+            max_tokens=max_tokens,
+            **self._build_openai_format(response_schema)
+        )
+        return response.choices[0].message.content, self._openai_usage(response)
+    
+    async def _astream_provider(self,
+                                backend: ProviderBackend,
+                                prompt: str,
+                                system_instruction: Optional[str],
+                                temperature: float,
+                                max_tokens: int,
+                                response_schema: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """Make one streaming request to a provider."""
+        if backend.name == 'gemini':
+            model, contents = await self._agemini_target(backend, prompt, system_instruction)
+            response = await model.generate_content_async(
+                contents,
+                generation_config=self._build_gemini_config(temperature, max_tokens, response_schema),
+                stream=True
+            )
+            async for chunk in response:
+                if chunk.parts:
+                    yield chunk.text
+            return
+        
+        # OpenAI
+        stream = await backend.async_client.chat.completions.create(
+            model=backend.model,
+            messages=self._build_openai_messages(prompt, system_instruction),
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            **self._build_openai_format(response_schema)
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    def _gemini_target(self,
+                       backend: ProviderBackend,
+                       prompt: str,
+                       system_instruction: Optional[str]) -> Tuple[Any, str]:
+        """
+        Pick the model and contents of a Gemini call: if the system
+        instruction is in cached content, only the prompt is sent.
+        """
+        contexts = GeminiContextCache.get_instance()
+        model = contexts.lookup(backend.model, system_instruction)
+        if model is None and contexts.should_create(backend.model, system_instruction):
+            model = contexts.create(backend.model, system_instruction)
+        if model is not None:
+            return model, prompt
+        return backend.client, self._build_gemini_prompt(prompt, system_instruction)
+    
+    async def _agemini_target(self,
+                              backend: ProviderBackend,
+                              prompt: str,
+                              system_instruction: Optional[str]) -> Tuple[Any, str]:
+        """Awaitable variant of _gemini_target; the cached content is created in a worker thread."""
+        contexts = GeminiContextCache.get_instance()
+        model = contexts.lookup(backend.model, system_instruction)
+        if model is None and contexts.should_create(backend.model, system_instruction):
+            model = await asyncio.to_thread(contexts.create, backend.model, system_instruction)
+        if model is not None:
+            return model, prompt
+        return backend.async_client, self._build_gemini_prompt(prompt, system_instruction)
+    
+    def _record_usage(self,
+                      agent: Optional[str],
+                      model: str,
+                      system_instruction: Optional[str],
+                      prompt: str,
+                      text: str,
+                      usage: Optional[Dict[str, int]]) -> None:
+        """Record the token usage of a call, counting locally if the provider did not report it."""
+        if usage:
+            TokenUsage.get_instance().record(
+                agent, model, usage["prompt_tokens"], usage["completion_tokens"], estimated=False,
+                cached_tokens=usage.get("cached_tokens", 0)
+            )
+            return
+        prompt_tokens = count_tokens(system_instruction) + count_tokens(prompt)
+        TokenUsage.get_instance().record(agent, model, prompt_tokens, count_tokens(text), estimated=True)
+    
+    def _openai_usage(self, response: Any) -> Optional[Dict[str, int]]:
+        """Extract token usage from an OpenAI response, including automatically cached prefix tokens."""
+        usage = getattr(response, "usage", None)
+        if usage is None or usage.prompt_tokens is None:
+            return None
+        # prompt_tokens_details is newer than the pinned SDK's types, so it may arrive as a dict
+        details = getattr(usage, "prompt_tokens_details", None) or {}
+        cached = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", None)
+        return {"prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens or 0,
+                "cached_tokens": cached or 0}
+    
+    def _gemini_usage(self, response: Any) -> Optional[Dict[str, int]]:
+        """Extract token usage from a Gemini response (newer SDKs only)."""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None or not getattr(usage, "prompt_token_count", None):
+            return None
+        return {"prompt_tokens": usage.prompt_token_count,
+                "completion_tokens": getattr(usage, "candidates_token_count", 0) or 0,
+                "cached_tokens": getattr(usage, "cached_content_token_count", 0) or 0}
+    
+    def _build_gemini_prompt(self, prompt: str, system_instruction: Optional[str]) -> str:
+        """Combine system instruction and prompt for Gemini."""
+        if system_instruction:
+            return f"{system_instruction}\n\n{prompt}"
+        return prompt
+    
+    def _build_gemini_config(self,
+                             temperature: float,
+                             max_tokens: int,
+                             response_schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Build the Gemini generation config, with JSON mode/schema when the SDK supports it."""
+        config = {
+            'temperature': temperature,
+            'max_output_tokens': max_tokens,
+        }
+        if response_schema and self.structured_output != 'off':
+            json_mode, schema_mode = gemini_structured_output()
+        else:
+            json_mode = schema_mode = False
+        if json_mode:
+            config['response_mime_type'] = 'application/json'
+            if self.structured_output == 'schema' and schema_mode:
+                config['response_schema'] = self._to_gemini_schema(response_schema)
+        return config
+    
+    def _to_gemini_schema(self, schema: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Convert a JSON schema to Gemini's OpenAPI subset: no
+        additionalProperties or title, and nullable instead of anyOf null.
+        """
+        options = schema.get("anyOf")
+        if options:
+            non_null = [option for option in options if option.get("type") != "null"]
+            converted = self._to_gemini_schema(non_null[0])
+            if len(non_null) < len(options):
+                converted["nullable"] = True
+            return converted
+        
+        converted = {}
+        for key, value in schema.items():
+            if key in ("additionalProperties", "title"):
+                continue
+            if key == "type":
+                converted[key] = value.upper()
+            elif key == "properties":
+                converted[key] = {name: self._to_gemini_schema(prop) for name, prop in value.items()}
+            elif key == "items":
+                converted[key] = self._to_gemini_schema(value)
+            else:
+                converted[key] = value
+        return converted
+    
+    def _build_openai_format(self, response_schema: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Build the OpenAI response_format argument (empty if structured output is off)."""
+        if not response_schema or self.structured_output == 'off':
+            return {}
+        if self.structured_output == 'json':
+            return {"response_format": {"type": "json_object"}}
+        return {"response_format": {
+            "type": "json_schema",
+            "json_schema": {
+                "name": response_schema.get("title", "response"),
+                "schema": response_schema,
+                "strict": True
+            }
+        }}
+    
+    def _build_openai_messages(self, prompt: str, system_instruction: Optional[str]) -> List[Dict[str, str]]:
+        """Build the OpenAI chat messages list."""
+        messages = []
+        
+        if system_instruction:
+            messages.append({"role": "system", "content": system_instruction})
+        
+        messages.append({"role": "user", "content": prompt})
+        return messages
+    
+    def parse_json_response(self,
+                            response: str,
+                            required_fields: List[str] = None,
+                            agent: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Parse a JSON response from the AI API in a robust way.
+        
+        Code fences, surrounding text, trailing commas, Python literals and
+        truncated output are repaired (see utils.json_repair). Whether the
+        response parsed cleanly, needed repair or was lost is counted per
+        agent.
+        
+        Args:
+            response: The text response from the AI API
             required_fields: List of field names that must be present in the JSON
+            agent: Agent name the outcome is counted under
             
         Returns:
             A dictionary parsed from the JSON
@@ -124,26 +823,19 @@ class OpenAIClient:
         Raises:
             ValueError: If the JSON doesn't have all required fields or can't be parsed
         """
+        stats = JSONRepairStats.get_instance()
         try:
-            # Clean the response to extract only JSON if there's any extra text
-            # Look for text that looks like JSON (between curly braces)
-            json_match = re.search(r'(\{.*\})', response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                json_str = response
-            
-            # Try to parse the JSON
-            result = json.loads(json_str)
+            result, repaired = repair_json(response, expected_type=dict)
             
             # Validate that we have all required fields if specified
             if required_fields and not all(key in result for key in required_fields):
                 missing_fields = [field for field in required_fields if field not in result]
                 raise ValueError(f"Missing required fields in JSON response: {missing_fields}")
-                
-            return result
-            
-        except json.JSONDecodeError as json_err:
-            print(f"JSON parse error: {str(json_err)}")
-            print(f"Attempted to parse: {json_str}")
-            raise ValueError(f"Could not parse JSON response: {str(json_err)}")
+        except ValueError as e:
+            stats.record(agent, "lost")
+            # The response text can quote the email, so only its size is logged
+            log.warning("ai.json_parse_failed", agent=agent, error=str(e), response_chars=len(response or ''))
+            raise ValueError(f"Could not parse JSON response: {str(e)}")
+        
+        stats.record(agent, "repaired" if repaired else "clean")
+        return result
@@ -0,0 +1,181 @@
+"""
+Incremental parser for a streamed JSON object with string fields.
+
+Models stream JSON a few characters at a time. To render the "brief" reply
+while "detailed" is still being generated, string values of the top-level
+object are decoded as they arrive instead of after the closing brace.
+"""
+from typing import Any, Dict, List, Optional
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class PartialJSONObjectParser:
+    """
+    Feed chunks of a JSON object and get events for its top-level string fields.
+
+    Events returned by feed():
+    - {"type": "delta", "field": name, "text": decoded new characters}
+    - {"type": "field", "field": name, "value": complete string}
+
+    Anything before the first "{" (e.g. a ```json fence) is ignored. Values
+    that are not strings (numbers, arrays, nested objects) are skipped;
+    parse the full text afterwards if they are needed.
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, str] = {}
+        self.done = False
+
+        self._state = "before_object"
+        self._key: List[str] = []
+        self._current: Optional[str] = None
+        self._value: List[str] = []
+        self._escape: Optional[str] = None
+        self._pending_high: Optional[int] = None
+        self._depth = 0
+        self._in_nested_string = False
+        self._nested_escape = False
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        Consume the next chunk of model output.
+
+        Args:
+            chunk: Newly received text
+
+        Returns:
+            Events produced by this chunk, in order
+        """
+        events: List[Dict[str, Any]] = []
+        delta: List[str] = []
+
+        for char in chunk:
+            if self.done:
+                break
+            state = self._state
+
+            if state == "before_object":
+                if char == '{':
+                    self._state = "before_key"
+
+            elif state == "before_key":
+                if char == '"':
+                    self._key = []
+                    self._state = "key"
+                elif char == '}':
+                    self.done = True
+
+            elif state == "key":
+                if self._escape is not None:
+                    self._key.append(_ESCAPES.get(char, char))
+                    self._escape = None
+                elif char == '\\':
+                    self._escape = ''
+                elif char == '"':
+                    self._state = "before_colon"
+                else:
+                    self._key.append(char)
+
+            elif state == "before_colon":
+                if char == ':':
+                    self._state = "before_value"
+
+            elif state == "before_value":
+                if char == '"':
+                    self._current = ''.join(self._key)
+                    self._value = []
+                    self._state = "string"
+                elif char in '{[':
+                    self._depth = 1
+                    self._state = "nested"
+                elif not char.isspace():
+                    self._state = "scalar"
+
+            elif state == "string":
+                text = self._string_char(char)
+                if text is None:
+                    if delta:
+                        events.append(self._delta(delta))
+                        delta = []
+                    value = ''.join(self._value)
+                    self.fields[self._current] = value
+                    events.append({"type": "field", "field": self._current, "value": value})
+                    self._state = "after_value"
+                elif text:
+                    self._value.append(text)
+                    delta.append(text)
+
+            elif state == "nested":
+                self._skip_nested(char)
+
+            elif state in ("scalar", "after_value"):
+                if char == ',':
+                    self._state = "before_key"
+                elif char == '}':
+                    self.done = True
+
+        if delta:
+            events.append(self._delta(delta))
+        return events
+
+    def _delta(self, parts: List[str]) -> Dict[str, Any]:
+        return {"type": "delta", "field": self._current, "text": ''.join(parts)}
+
+    def _string_char(self, char: str) -> Optional[str]:
+        """
+        Decode one character inside a string value.
+
+        Returns:
+            Decoded text to append ("" while inside an escape sequence), or
+            None when the closing quote is reached
+        """
+        if self._escape is None:
+            if char == '\\':
+                self._escape = ''
+                return ''
+            if char == '"':
+                return None
+            return char
+
+        if self._escape == '':
+            if char == 'u':
+                self._escape = 'u'
+                return ''
+            self._escape = None
+            return _ESCAPES.get(char, char)
+
+        # Inside \uXXXX
+        self._escape += char
+        if len(self._escape) < 5:
+            return ''
+        code = int(self._escape[1:], 16)
+        self._escape = None
+
+        if 0xD800 <= code <= 0xDBFF:
+            self._pending_high = code
+            return ''
+        if 0xDC00 <= code <= 0xDFFF and self._pending_high is not None:
+            code = 0x10000 + ((self._pending_high - 0xD800) << 10) + (code - 0xDC00)
+        self._pending_high = None
+        return chr(code)
+
+    def _skip_nested(self, char: str) -> None:
+        """Skip over an array or object value, honouring strings inside it."""
+        if self._in_nested_string:
+            if self._nested_escape:
+                self._nested_escape = False
+            elif char == '\\':
+                self._nested_escape = True
+            elif char == '"':
+                self._in_nested_string = False
+            return
+
+        if char == '"':
+            self._in_nested_string = True
+        elif char in '{[':
+            self._depth += 1
+        elif char in '}]':
+            self._depth -= 1
+            if self._depth == 0:
+                self._state = "after_value"
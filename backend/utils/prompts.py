@@ -0,0 +1,81 @@
+"""
+Compiled prompt templates.
+
+Every prompt is laid out as a byte-stable prefix (the system instruction,
+compiled once when the agent is created) followed by a variable suffix (the
+email). Keeping all per-email values out of the prefix lets providers reuse
+it: OpenAI caches identical prompt prefixes automatically, and Gemini can
+serve it from cached content (see OpenAIClient).
+"""
+import hashlib
+import textwrap
+import threading
+from typing import Any, Dict, Optional
+from utils.tokens import count_tokens
+
+
+class PromptTemplate:
+    """
+    A compiled system instruction plus a format string for the per-call prompt.
+
+    Args:
+        name: Registry name (e.g. "classifier")
+        system: System instruction; str.format placeholders are filled from
+            static once, so literal braces must be doubled
+        prompt: Per-call prompt with str.format placeholders
+        static: Values fixed for the life of the process (e.g. category list)
+    """
+
+    def __init__(self, name: str, system: str, prompt: str, static: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.system = textwrap.dedent(system).strip().format(**(static or {}))
+        self.prompt = textwrap.dedent(prompt).strip()
+        self.prefix_hash = hashlib.sha256(self.system.encode('utf-8')).hexdigest()[:16]
+        self.prefix_tokens = count_tokens(self.system)
+
+    def render(self, **values: Any) -> str:
+        """Fill the per-call prompt."""
+        return self.prompt.format(**values)
+
+
+class PromptRegistry:
+    """Process-wide registry of compiled prompt templates."""
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._templates: Dict[str, PromptTemplate] = {}
+
+    def register(self, template: PromptTemplate) -> PromptTemplate:
+        """
+        Register a compiled template, or return the registered one if an
+        identical prefix is already known under that name.
+        """
+        with self._lock:
+            existing = self._templates.get(template.name)
+            if existing is not None and existing.prefix_hash == template.prefix_hash:
+                return existing
+            self._templates[template.name] = template
+            return template
+
+    def get(self, name: str) -> PromptTemplate:
+        with self._lock:
+            return self._templates[name]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the prefix hash and size of every template."""
+        with self._lock:
+            return {
+                name: {"prefix_hash": t.prefix_hash, "prefix_tokens": t.prefix_tokens}
+                for name, t in self._templates.items()
+            }
@@ -23,6 +23,8 @@ class RateLimiterConfig:
     def __init__(self, app):
         # Check if we should use Redis or in-memory storage
         use_redis = os.environ.get('USE_REDIS', 'false').lower() == 'true'
+        # Disable only behind a gateway that enforces limits, or for load tests
+        enabled = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
         
         if use_redis:
             redis_host = os.environ.get('REDIS_HOST', 'localhost')
@@ -38,7 +40,8 @@ class RateLimiterConfig:
                 storage_uri=redis_uri,
                 storage_options={"socket_connect_timeout": 30},
                 strategy="fixed-window",
-                default_limits=["200 per day", "50 per hour"]
+                default_limits=["200 per day", "50 per hour"],
+                enabled=enabled
             )
         else:
             # Use in-memory storage for development
@@ -47,9 +50,26 @@ class RateLimiterConfig:
                 key_func=get_remote_address,
                 storage_uri="memory://",
                 strategy="fixed-window",
-                default_limits=["200 per day", "50 per hour"]
+                default_limits=["200 per day", "50 per hour"],
+                enabled=enabled
             )
     
+    def reset_after_fork(self):
+        """
+        Drop rate limit storage state inherited from the parent process.
+        
+        Redis connections are reopened. In-memory counters are per process,
+        so with several workers use Redis (USE_REDIS=true) for shared limits.
+        """
+        if not self.limiter.enabled:
+            return
+        storage = self.limiter.storage
+        client = getattr(storage, 'storage', None)
+        if hasattr(client, 'connection_pool'):
+            client.connection_pool.reset()
+        else:
+            storage.reset()
+    
     def limit_health_check(self, f):
         """Rate limit for health check endpoint."""
         return self.limiter.limit("20 per minute")(f)
@@ -67,6 +87,10 @@ class RateLimiterConfig:
         """Rate limit for batch email processing."""
         return self.limiter.limit("5 per minute", key_func=get_user_identifier)(f)
     
+    def limit_reply_generation(self, f):
+        """Rate limit for on-demand reply generation."""
+        return self.limiter.limit("20 per minute", key_func=get_user_identifier)(f)
+    
     def limit_email_list(self, f):
         """Rate limit for listing emails."""
         return self.limiter.limit("30 per minute", key_func=get_user_identifier)(f)
@@ -0,0 +1,272 @@
+"""
+Resilience helpers for AI provider calls: error classification, jittered
+backoff, circuit breakers and latency tracking for hedged requests.
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+RETRYABLE_STATUS = {408, 409, 429}
+# Statuses meaning the request itself is invalid, whichever provider gets it
+REQUEST_ERROR_STATUS = {400, 422}
+_TRANSIENT_NAMES = ("Timeout", "Connection", "ServiceUnavailable", "DeadlineExceeded", "ResourceExhausted")
+
+
+def status_code_of(error: BaseException) -> Optional[int]:
+    """
+    Get the HTTP status of a provider error, if it has one.
+
+    Works for OpenAI (status_code) and google.api_core (code) exceptions.
+    """
+    for attr in ("status_code", "code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether an error is transient (429, 5xx, timeout, connection problem)."""
+    status = status_code_of(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    return any(name in type(error).__name__ for name in _TRANSIENT_NAMES)
+
+
+def is_request_error(error: BaseException) -> bool:
+    """
+    Whether an error rejects the request itself (400, 422), so another
+    provider would reject it too. Auth, unknown-model and content-policy
+    errors are provider-specific and not request errors.
+    """
+    return status_code_of(error) in REQUEST_ERROR_STATUS
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """
+    Get the delay requested by the provider's Retry-After header, if any.
+
+    Returns:
+        Seconds to wait, or None if the error carries no Retry-After
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(float(value) / 1000, 0.0)
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2^attempt))."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker.
+
+    After failure_threshold consecutive failures the breaker opens and calls
+    are rejected for reset_timeout seconds; then a single trial call is let
+    through (half-open). Success closes the breaker, failure reopens it;
+    a trial that ends any other way (a non-transient error, cancellation)
+    must be given back with release().
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self._stats = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def allow(self) -> bool:
+        """Whether a call may be made now."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self._stats["rejected"] += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._stats["opened"] += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def release(self) -> None:
+        """End a half-open trial without an outcome, so the next call can be the trial."""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._trial_in_flight = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self._current_state(),
+                "consecutive_failures": self._failures,
+                **self._stats
+            }
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies, used to time hedged requests."""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction: float, min_samples: int = 1) -> Optional[float]:
+        """
+        Get a latency percentile in seconds.
+
+        Returns:
+            The percentile, or None if fewer than min_samples were recorded
+        """
+        with self._lock:
+            if len(self._samples) < max(min_samples, 1):
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+class ResiliencePolicy:
+    """
+    Retry, hedging and breaker settings shared by all provider calls.
+
+    Configuration (environment variables):
+    - LLM_MAX_RETRIES: retries per provider on transient errors (default 2)
+    - LLM_RETRY_BASE_DELAY / LLM_RETRY_MAX_DELAY: backoff bounds in seconds (default 0.5 / 8)
+    - LLM_HEDGE_ENABLED: "true" to send a duplicate request when a call runs
+      past the latency percentile (default false)
+    - LLM_HEDGE_PERCENTILE: latency percentile that triggers the hedge (default 0.95)
+    - LLM_HEDGE_MIN_SAMPLES: successful calls needed before hedging starts (default 20)
+    - LLM_BREAKER_FAILURE_THRESHOLD: consecutive failures that open a breaker (default 5)
+    - LLM_BREAKER_RESET_TIMEOUT: seconds before an open breaker allows a trial call (default 30)
+    """
+
+    def __init__(self):
+        self.max_retries = int(os.environ.get('LLM_MAX_RETRIES', '2'))
+        self.base_delay = float(os.environ.get('LLM_RETRY_BASE_DELAY', '0.5'))
+        self.max_delay = float(os.environ.get('LLM_RETRY_MAX_DELAY', '8'))
+        self.hedge_enabled = os.environ.get('LLM_HEDGE_ENABLED', 'false').lower() == 'true'
+        self.hedge_percentile = float(os.environ.get('LLM_HEDGE_PERCENTILE', '0.95'))
+        self.hedge_min_samples = int(os.environ.get('LLM_HEDGE_MIN_SAMPLES', '20'))
+        self.breaker_failure_threshold = int(os.environ.get('LLM_BREAKER_FAILURE_THRESHOLD', '5'))
+        self.breaker_reset_timeout = float(os.environ.get('LLM_BREAKER_RESET_TIMEOUT', '30'))
+
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[str, LatencyTracker] = {}
+        self._lock = threading.Lock()
+        self._stats = {"retries": 0, "failovers": 0, "hedges": 0, "hedge_wins": 0, "exhausted": 0}
+
+    def breaker(self, backend: str) -> CircuitBreaker:
+        """Get the process-wide circuit breaker of a backend."""
+        with self._lock:
+            if backend not in self._breakers:
+                self._breakers[backend] = CircuitBreaker(
+                    backend, self.breaker_failure_threshold, self.breaker_reset_timeout
+                )
+            return self._breakers[backend]
+
+    def latency(self, backend: str) -> LatencyTracker:
+        """Get the latency tracker of a backend."""
+        with self._lock:
+            if backend not in self._latencies:
+                self._latencies[backend] = LatencyTracker()
+            return self._latencies[backend]
+
+    def retry_delay(self, attempt: int, error: BaseException) -> float:
+        """Delay before the next attempt, honouring Retry-After when larger."""
+        delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+        requested = retry_after_seconds(error)
+        if requested is not None:
+            delay = max(delay, min(requested, self.max_delay * 4))
+        return delay
+
+    def hedge_delay(self, backend: str) -> Optional[float]:
+        """Seconds to wait before hedging a call, or None if hedging is off."""
+        if not self.hedge_enabled:
+            return None
+        return self.latency(backend).percentile(self.hedge_percentile, self.hedge_min_samples)
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get retry/failover/hedge counters and per-backend breaker state."""
+        with self._lock:
+            stats = dict(self._stats)
+            backends = list(self._breakers)
+        stats["backends"] = {}
+        for name in backends:
+            p95 = self.latency(name).percentile(0.95)
+            stats["backends"][name] = {
+                **self.breaker(name).get_stats(),
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None
+            }
+        return stats
@@ -0,0 +1,84 @@
+"""
+Startup timing and deferred startup tasks.
+
+Importing the app no longer connects to MongoDB, creates indexes or builds
+the AI agents. Slow one-off work (index creation) runs here as background
+tasks so it never blocks worker boot, and the milestones of each boot
+(imports done, app ready to serve, first readiness check passed) are
+recorded in milliseconds for /api/v1/metrics and bench_startup.py.
+"""
+import time
+import threading
+from typing import Any, Callable, Dict
+from utils.logger import get_logger
+
+log = get_logger(__name__)
+
+# Reference point for the startup milestones; the app sets it before its imports
+_STARTED = time.perf_counter()
+
+_lock = threading.Lock()
+_marks: Dict[str, float] = {}
+_tasks: Dict[str, Dict[str, Any]] = {}
+
+
+def begin(started: float) -> None:
+    """Measure milestones from started (a time.perf_counter() value)."""
+    global _STARTED
+    _STARTED = started
+
+
+def mark(phase: str) -> float:
+    """
+    Record a startup milestone once (later calls keep the first time).
+
+    Args:
+        phase: Milestone name (e.g. "imports", "boot", "ready")
+
+    Returns:
+        Milliseconds since startup began
+    """
+    with _lock:
+        if phase not in _marks:
+            _marks[phase] = round((time.perf_counter() - _STARTED) * 1000, 1)
+        return _marks[phase]
+
+
+def run_in_background(name: str, task: Callable[[], Any]) -> threading.Thread:
+    """
+    Run a startup task in a daemon thread and record its outcome.
+
+    A task fails if it raises or returns False.
+
+    Args:
+        name: Task name for task_status/get_stats
+        task: Callable to run
+    """
+    with _lock:
+        _tasks[name] = {"status": "running"}
+
+    def run():
+        started = time.perf_counter()
+        try:
+            status = "failed" if task() is False else "done"
+        except Exception as e:
+            log.error("startup.task_failed", task=name, error=str(e))
+            status = "failed"
+        with _lock:
+            _tasks[name] = {"status": status, "ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    thread = threading.Thread(target=run, name=f"startup-{name}", daemon=True)
+    thread.start()
+    return thread
+
+
+def task_status(name: str) -> str:
+    """Get a startup task's status: "running", "done", "failed" or "skipped"."""
+    with _lock:
+        return _tasks.get(name, {}).get("status", "skipped")
+
+
+def get_stats() -> Dict[str, Any]:
+    """Get the startup milestones (ms) and startup task outcomes."""
+    with _lock:
+        return {"marks_ms": dict(_marks), "tasks": {name: dict(t) for name, t in _tasks.items()}}
@@ -0,0 +1,235 @@
+"""
+Token counting, prompt budget allocation and per-call token accounting.
+
+Counting uses tiktoken when it is installed (local BPE files, no network at
+call time) and otherwise a calibrated estimator. The estimator counts word
+pieces: about 4 characters per token for ASCII words, about 2.5 for words
+with diacritics (Vietnamese splits into more tokens), one per punctuation
+mark.
+"""
+import os
+import re
+import math
+import time
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+# tiktoken encoding, loaded on the first count (False: tiktoken unavailable)
+_ENCODING: Any = None
+_ENCODING_LOCK = threading.Lock()
+
+_PIECE_RE = re.compile(r'\w+|[^\w\s]', re.UNICODE)
+_SENTENCE_RE = re.compile(r'[^.!?\n]+(?:[.!?]+|\n+|$)', re.UNICODE)
+_SALIENT_RE = re.compile(
+    r'\?|\d|'
+    r'\b(please|deadline|asap|urgent|by|due|confirm|approve|meeting|invoice|payment|'
+    r'vui lòng|làm ơn|hạn|gấp|xác nhận|duyệt|cuộc họp|thanh toán|hóa đơn)\b',
+    re.IGNORECASE | re.UNICODE
+)
+GAP_MARKER = "[…]"
+
+# Input token budget for the email body in each agent's prompt
+DEFAULT_BUDGETS = {
+    "classifier": 256,
+    "summarizer": 1500,
+    "reply": 800,
+    "fused": 1500,
+}
+
+
+def _get_encoding() -> Any:
+    """Load the tiktoken encoding on first use (it reads the BPE ranks from disk)."""
+    global _ENCODING
+    if _ENCODING is None:
+        with _ENCODING_LOCK:
+            if _ENCODING is None:
+                try:
+                    import tiktoken
+                    _ENCODING = tiktoken.get_encoding("cl100k_base")
+                except Exception:
+                    _ENCODING = False
+    return _ENCODING
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """
+    Count (or estimate) the tokens of a text.
+
+    Args:
+        text: Text to count
+
+    Returns:
+        Number of tokens
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+
+    total = 0
+    for piece in _PIECE_RE.findall(text):
+        if piece.isascii():
+            total += max(1, math.ceil(len(piece) / 4)) if piece[0].isalnum() else 1
+        else:
+            total += max(1, math.ceil(len(piece) / 2.5))
+    return total
+
+
+def agent_budget(agent: str) -> int:
+    """
+    Get the body token budget of an agent.
+
+    Configured with TOKEN_BUDGET_<AGENT> (e.g. TOKEN_BUDGET_SUMMARIZER).
+    """
+    value = os.environ.get(f"TOKEN_BUDGET_{agent.upper()}")
+    return int(value) if value else DEFAULT_BUDGETS.get(agent, 1000)
+
+
+def fit_to_budget(text: Optional[str], budget: int) -> str:
+    """
+    Shrink a text to a token budget, keeping what matters most.
+
+    The beginning (greeting and the actual ask usually come first) and the
+    end (sign-off, deadline reminders) are kept; the remaining budget goes
+    to the most salient middle sentences (questions, numbers and dates,
+    requests, deadlines), kept in their original order. Gaps are marked
+    with "[…]".
+
+    Args:
+        text: Text to shrink
+        budget: Maximum number of tokens
+
+    Returns:
+        The text itself if it fits, otherwise the selected parts
+    """
+    if not text or count_tokens(text) <= budget:
+        return text or ""
+
+    sentences = [s for s in _SENTENCE_RE.findall(text) if s.strip()]
+    costs = [count_tokens(s) for s in sentences]
+    if len(sentences) < 3:
+        return _truncate(text, budget)
+
+    selected = set()
+    used = 0
+
+    # Head: about half the budget
+    for i, cost in enumerate(costs):
+        if used + cost > budget * 0.5:
+            break
+        selected.add(i)
+        used += cost
+
+    # Tail: about a fifth of the budget
+    tail_used = 0
+    for i in range(len(sentences) - 1, -1, -1):
+        if i in selected or tail_used + costs[i] > budget * 0.2:
+            break
+        selected.add(i)
+        tail_used += costs[i]
+    used += tail_used
+
+    # Middle: most salient sentences that still fit
+    middle = [i for i in range(len(sentences)) if i not in selected]
+    middle.sort(key=lambda i: (-len(_SALIENT_RE.findall(sentences[i])), i))
+    for i in middle:
+        if not _SALIENT_RE.search(sentences[i]):
+            break
+        if used + costs[i] + 2 <= budget:
+            selected.add(i)
+            used += costs[i] + 2
+
+    if not selected:
+        return _truncate(text, budget)
+
+    parts: List[str] = []
+    previous = -1
+    for i in sorted(selected):
+        if i != previous + 1 and parts:
+            parts.append(GAP_MARKER)
+        parts.append(sentences[i].strip())
+        previous = i
+    if previous != len(sentences) - 1:
+        parts.append(GAP_MARKER)
+    return " ".join(parts)
+
+
+def _truncate(text: str, budget: int) -> str:
+    """Keep the first budget tokens of a text (by estimated characters per token)."""
+    ratio = len(text) / max(count_tokens(text), 1)
+    return text[:int(max(budget - 2, 1) * ratio)].rstrip() + " " + GAP_MARKER
+
+
+class TokenUsage:
+    """
+    Per-agent prompt/completion token counters plus a log of recent calls.
+
+    Provider-reported usage is used when the response carries it; otherwise
+    both sides are counted locally and the call is marked "estimated".
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[str, Dict[str, int]] = {}
+        self._recent: deque = deque(maxlen=int(os.environ.get('TOKEN_USAGE_LOG_SIZE', '200')))
+
+    def record(self,
+               agent: Optional[str],
+               model: str,
+               prompt_tokens: int,
+               completion_tokens: int,
+               estimated: bool,
+               cached_tokens: int = 0) -> None:
+        """
+        Record the token usage of one provider call.
+
+        Args:
+            agent: Calling agent (the cache namespace), or None
+            model: Model that served the call
+            prompt_tokens: Input tokens
+            completion_tokens: Output tokens
+            estimated: True if counted locally rather than reported by the provider
+            cached_tokens: Input tokens served from the provider's prompt cache
+        """
+        agent = agent or "other"
+        with self._lock:
+            totals = self._totals.setdefault(agent, {
+                "calls": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0,
+                "completion_tokens": 0, "estimated_calls": 0
+            })
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["cached_prompt_tokens"] += cached_tokens
+            totals["completion_tokens"] += completion_tokens
+            totals["estimated_calls"] += int(estimated)
+            self._recent.append({
+                "agent": agent,
+                "model": model,
+                "prompt_tokens": prompt_tokens,
+                "cached_tokens": cached_tokens,
+                "completion_tokens": completion_tokens,
+                "estimated": estimated,
+                "at": time.time()
+            })
+
+    def get_stats(self, recent: int = 20) -> Dict[str, Any]:
+        """Get per-agent totals and the most recent calls."""
+        with self._lock:
+            return {
+                "tokenizer": "tiktoken" if _get_encoding() else "estimator",
+                "by_agent": {agent: dict(totals) for agent, totals in self._totals.items()},
+                "recent_calls": list(self._recent)[-recent:]
+            }
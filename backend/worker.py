@@ -0,0 +1,32 @@
+"""
+Standalone job worker for the AI Email Assistant.
+
+Drains the job queue (JOB_QUEUE_BACKEND) without serving HTTP, so workers can
+be scaled out independently of the API. Run as many copies as needed:
+
+    python worker.py
+"""
+import os
+import time
+from dotenv import load_dotenv
+from agents.email_coordinator import EmailCoordinator
+from utils.job_queue import get_job_queue, JobWorkerPool
+
+load_dotenv()
+
+if __name__ == '__main__':
+    coordinator = EmailCoordinator()
+    queue = get_job_queue()
+    if os.environ.get('DB_ENSURE_INDEXES', 'background').lower() != 'off':
+        queue.ensure_indexes()
+    pool = JobWorkerPool(queue, coordinator.handle_job,
+                         concurrency=int(os.environ.get('JOB_WORKERS', '4')) or 4)
+
+    print(f"🛠️  Starting {pool.concurrency} job workers (backend: {os.environ.get('JOB_QUEUE_BACKEND', 'mongo')})")
+    pool.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping job workers...")
+        pool.stop()
@@ -562,6 +562,7 @@ Phone: 028 3724 xxxx (ext. 105)`,
           {activeView === 'detail' && selectedEmail && (
             <EmailDetailView
               email={selectedEmail}
+              userId={userId}
               onBack={handleBackToList}
             />
           )}
@@ -7,12 +7,40 @@ import {
   ArrowLeft, Copy, Check, Mail, Tag, FileText, 
   ChevronDown, ChevronUp, Clock, User, Send 
 } from 'lucide-react';
+import { emailApi } from '../services/api';
 import '../styles/EmailDetailView.css';
 
-const EmailDetailView = ({ email, onBack }) => {
+const EmailDetailView = ({ email, userId, onBack }) => {
   const [copiedReply, setCopiedReply] = useState(false);
   const [showRawContent, setShowRawContent] = useState(false);
   const [showScheduleModal, setShowScheduleModal] = useState(false);
+  const [pendingReply, setPendingReply] = useState(null);
+  const [loadingReply, setLoadingReply] = useState(false);
+  const [replyError, setReplyError] = useState(null);
+
+  // Replies of lower-importance emails are generated on first view
+  React.useEffect(() => {
+    setPendingReply(null);
+    setReplyError(null);
+    setLoadingReply(false);
+    if (!email.reply_pending || email.suggested_reply || !email.email_id || !userId) {
+      return;
+    }
+
+    let cancelled = false;
+    setLoadingReply(true);
+    emailApi.getEmailReply(email.email_id, userId)
+      .then((response) => {
+        if (!cancelled) setPendingReply(response.data?.suggested_reply || null);
+      })
+      .catch((err) => {
+        if (!cancelled) setReplyError(err.message);
+      })
+      .finally(() => {
+        if (!cancelled) setLoadingReply(false);
+      });
+    return () => { cancelled = true; };
+  }, [email, userId]);
 
   // Debug: Log email data to see what we receive
   React.useEffect(() => {
@@ -46,6 +74,7 @@ const EmailDetailView = ({ email, onBack }) => {
   const getReplyText = () => {
     // Try multiple fields to find reply
     const replyFields = [
+      pendingReply,
       email.suggested_reply,
       email.reply,
       email.suggestedReply
@@ -125,6 +154,7 @@ ${replyText}`;
   };
 
   const categoryInfo = getCategoryInfo(email.category);
+  const replyVersions = pendingReply || email.suggested_reply;
 
   return (
     <div className="email-detail-view">
@@ -251,17 +281,22 @@ ${replyText}`;
           </div>
           <div className="reply-divider"></div>
           <div className="reply-body">
-            {getReplyText()}
+            {loadingReply ? 'Đang tạo phản hồi gợi ý...' : getReplyText()}
           </div>
+          {replyError && (
+            <div className="reply-versions-note">
+              <small>⚠️ Không tạo được phản hồi gợi ý: {replyError}</small>
+            </div>
+          )}
           
           {/* Show all reply versions if available */}
-          {email.suggested_reply && typeof email.suggested_reply === 'object' && (
+          {replyVersions && typeof replyVersions === 'object' && (
             <div className="reply-versions-note">
               <small>
                 💡 Phiên bản: 
-                {email.suggested_reply.brief && ' Ngắn gọn'}
-                {email.suggested_reply.standard && ' • Chuẩn'}
-                {email.suggested_reply.detailed && ' • Chi tiết'}
+                {replyVersions.brief && ' Ngắn gọn'}
+                {replyVersions.standard && ' • Chuẩn'}
+                {replyVersions.detailed && ' • Chi tiết'}
               </small>
             </div>
           )}
@@ -16,6 +16,8 @@ import {
 
 const EmailList = ({ userId, refresh }) => {
   const [emails, setEmails] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [filteredEmails, setFilteredEmails] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
@@ -23,6 +25,7 @@ const EmailList = ({ userId, refresh }) => {
   const [showImportantOnly, setShowImportantOnly] = useState(false);
   const [searchQuery, setSearchQuery] = useState('');
   const [expandedEmail, setExpandedEmail] = useState(null);
+  const [replies, setReplies] = useState({});
 
   // Categories for filtering
   const categories = [
@@ -75,6 +78,7 @@ const EmailList = ({ userId, refresh }) => {
       setError(null);
       const response = await emailApi.getEmails(userId);
       setEmails(response.data || []);
+      setNextCursor(response.next_cursor || null);
     } catch (err) {
       setError(err.message || 'Failed to load emails');
     } finally {
@@ -82,6 +86,20 @@ const EmailList = ({ userId, refresh }) => {
     }
   };
 
+  // Append the next page (the API returns emails in pages, newest first)
+  const loadMore = async () => {
+    try {
+      setLoadingMore(true);
+      const response = await emailApi.getEmails(userId, { cursor: nextCursor });
+      setEmails((current) => [...current, ...(response.data || [])]);
+      setNextCursor(response.next_cursor || null);
+    } catch (err) {
+      alert('Failed to load more emails: ' + err.message);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleDelete = async (emailId) => {
     if (window.confirm('Are you sure you want to delete this email?')) {
       try {
@@ -93,8 +111,31 @@ const EmailList = ({ userId, refresh }) => {
     }
   };
 
-  const toggleExpand = (emailId) => {
-    setExpandedEmail(expandedEmail === emailId ? null : emailId);
+  const toggleExpand = (email) => {
+    const expanding = expandedEmail !== email.email_id;
+    setExpandedEmail(expanding ? email.email_id : null);
+    if (expanding && hasReply(email) && !replies[email.email_id]) {
+      loadReply(email.email_id);
+    }
+  };
+
+  const hasReply = (email) =>
+    email.reply_pending ||
+    (email.suggested_action || []).some((action) => ['needs_reply', 'reply_asap'].includes(action));
+
+  // The list omits suggested_reply, so it is fetched on expand; pending
+  // replies are generated by that first request
+  const loadReply = async (emailId) => {
+    setReplies((current) => ({ ...current, [emailId]: { loading: true } }));
+    try {
+      const response = await emailApi.getEmailReply(emailId, userId);
+      setReplies((current) => ({
+        ...current,
+        [emailId]: { reply: response.data?.suggested_reply || null },
+      }));
+    } catch (err) {
+      setReplies((current) => ({ ...current, [emailId]: { error: err.message } }));
+    }
   };
 
   const getCategoryColor = (category) => {
@@ -199,7 +240,7 @@ const EmailList = ({ userId, refresh }) => {
                 </div>
                 <div className="email-actions">
                   <button
-                    onClick={() => toggleExpand(email.email_id)}
+                    onClick={() => toggleExpand(email)}
                     className="btn-icon"
                     title={expandedEmail === email.email_id ? 'Collapse' : 'Expand'}
                   >
@@ -231,10 +272,12 @@ const EmailList = ({ userId, refresh }) => {
               {/* Expanded Details */}
               {expandedEmail === email.email_id && (
                 <div className="email-details">
-                  <div className="detail-section">
-                    <strong>Body:</strong>
-                    <p>{email.body?.substring(0, 200)}...</p>
-                  </div>
+                  {email.body && (
+                    <div className="detail-section">
+                      <strong>Body:</strong>
+                      <p>{email.body.substring(0, 200)}...</p>
+                    </div>
+                  )}
 
                   {email.key_points && email.key_points.length > 0 && (
                     <div className="detail-section">
@@ -258,6 +301,19 @@ const EmailList = ({ userId, refresh }) => {
                     </div>
                   )}
 
+                  {replies[email.email_id] && (
+                    <div className="detail-section">
+                      <strong>Suggested Reply:</strong>
+                      {replies[email.email_id].loading && <p>Generating reply...</p>}
+                      {replies[email.email_id].error && (
+                        <p>Failed to generate reply: {replies[email.email_id].error}</p>
+                      )}
+                      {replies[email.email_id].reply && (
+                        <p>{replies[email.email_id].reply.standard || replies[email.email_id].reply.brief}</p>
+                      )}
+                    </div>
+                  )}
+
                   {email.suggested_action && email.suggested_action.length > 0 && (
                     <div className="detail-section">
                       <strong>Suggested Actions:</strong>
@@ -276,6 +332,12 @@ const EmailList = ({ userId, refresh }) => {
           ))}
         </div>
       )}
+
+      {nextCursor && (
+        <button onClick={loadMore} className="btn-secondary" disabled={loadingMore}>
+          {loadingMore ? 'Loading...' : 'Load more'}
+        </button>
+      )}
     </div>
   );
 };
@@ -71,7 +71,9 @@ export const emailApi = {
   },
 
   /**
-   * Get all emails for a user
+   * Get one page of a user's emails (newest first, without body and
+   * suggested_reply). filters: category, is_important, limit, fields, and
+   * cursor (next_cursor of the previous page).
    */
   getEmails: async (userId, filters = {}) => {
     try {
@@ -97,6 +99,21 @@ export const emailApi = {
     }
   },
 
+  /**
+   * Get the suggested reply of an email. Replies of lower-importance emails
+   * are saved with reply_pending: true and generated on this first request.
+   */
+  getEmailReply: async (emailId, userId) => {
+    try {
+      const response = await apiClient.get(`/emails/${emailId}/reply`, {
+        params: { user_id: userId },
+      });
+      return response.data;
+    } catch (error) {
+      throw handleApiError(error);
+    }
+  },
+
   /**
    * Delete an email
    */